@@ -0,0 +1,51 @@
+# benchmarks/common.py
+
+# Helpers shared by the benchmarks: timing of micro-benchmarks, percentiles and the format of
+# results. A result is a dictionary of metrics, each {"value": ..., "unit": ..., "better": "lower"
+# or "higher"}, so as run.py can save the results of a run and compare them with another one.
+
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+Metrics = Dict[str, Dict]
+
+def metric(value: float, unit: str, better: str = "lower") -> Dict:
+    return {"value": value, "unit": unit, "better": better}
+
+def time_per_call(function: Callable[[], object], repeat: int = 5, min_time: float = 0.2) -> float:
+    """
+    Return the time of one call of 'function' in nanoseconds: the number of calls is calibrated
+    so as a measurement takes at least 'min_time' seconds, and the best of 'repeat' measurements
+    is taken, which is the least disturbed by other activity of the machine.
+    """
+    number = 1
+    while True:
+        elapsed = _measure(function, number)
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / elapsed))
+    best = min(_measure(function, number) for _ in range(repeat))
+    return best / number * 1e9
+
+def _measure(function: Callable[[], object], number: int) -> float:
+    calls = range(number)
+    start = time.perf_counter()
+    for _ in calls:
+        function()
+    return time.perf_counter() - start
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Return the value below which 'fraction' (0..1) of 'sorted_values' lie (nearest rank).
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
@@ -0,0 +1,127 @@
+# benchmarks/e2e.py
+
+# End-to-end benchmark: MS commands through the whole stack (MQTTms -> MSProtocol -> MQTTHandler
+# -> broker -> simulated MS servers -> MQTTDispatcher -> MSProtocol), reporting commands per
+# second and the p50 / p99 latency of a command, from put_command() to its resolved future.
+#
+# Scenarios:
+# - sequential: one command at a time (the default MS protocol mode),
+# - pipelined: 'ms.pipeline' with 'concurrency' commands in flight, spread over 'servers' servers.
+#
+# The servers are simulated by mqttms.simulator on the loopback transport (no broker needed),
+# or on a local broker with --transport paho:
+#
+#   python benchmarks/e2e.py [--quick] [--transport paho --host localhost --port 1883]
+
+import sys
+import time
+import argparse
+import threading
+from typing import Dict, List, Optional
+
+from common import Metrics, metric, percentile
+
+def make_config(options: Dict, pipeline: bool) -> dict:
+    mqtt = {"host": options["host"], "port": options["port"], "username": options["username"], "password": options["password"],
+            "client_id": "e2e-benchmark", "timeout": 5.0, "transport": options["transport"],
+            "loopback": {"broker": "e2e-benchmark", "latency": options["broker_latency"]}}
+    ms = {"client_uuid": "c", "server_uuid": "_", "cmd_topic": "@/server_uuid/CMD/format", "rsp_topic": "@/server_uuid/RSP/format",
+          "subs_topics": [{"topic": "@/+/RSP/format", "format": "ASCIIHEX"}], "timeout": 5.0, "multi_server": True,
+          "pipeline": pipeline, "window": max(1, options["concurrency"])}
+    if options["transport"] == "paho":
+        mqtt.pop("loopback")
+    return {"mqtt": mqtt, "ms": ms}
+
+def run_scenario(ms, servers: List[str], commands: int, concurrency: int) -> Dict[str, float]:
+    """
+    Send 'commands' commands, keeping 'concurrency' of them in flight, and return the rate and latencies.
+    """
+    slots = threading.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = [0]
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def completed(future, sent_at: float) -> None:
+        elapsed = time.perf_counter() - sent_at
+        failed = future.cancelled() or future.result().get("response") != "OK"
+        with lock:
+            latencies.append(elapsed)
+            if failed:
+                failures[0] += 1
+            if len(latencies) == commands:
+                done.set()
+        slots.release()
+
+    start = time.perf_counter()
+    for index in range(commands):
+        slots.acquire()
+        sent_at = time.perf_counter()
+        future = ms.ms_protocol.put_command({"command": "read", "index": index}, server=servers[index % len(servers)])
+        future.add_done_callback(lambda f, sent_at=sent_at: completed(f, sent_at))
+    done.wait()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"rate": commands / elapsed, "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99), "failures": failures[0]}
+
+def run(quick: bool = False, options: Optional[Dict] = None) -> Metrics:
+    # pylint: disable=import-outside-toplevel
+    from mqttms import MQTTms
+    from mqttms.simulator import ServerFarm
+
+    options = {"transport": "loopback", "host": "localhost", "port": 1883, "username": "", "password": "",
+               "servers": 100, "concurrency": 64, "server_latency": 0.0, "broker_latency": 0.0, **(options or {})}
+    scenarios = {
+        "sequential": {"pipeline": False, "concurrency": 1, "commands": 300 if quick else 2000},
+        "pipelined": {"pipeline": True, "concurrency": options["concurrency"], "commands": 2000 if quick else 20000},
+    }
+
+    farm_config = {key: options[key] for key in ("host", "port", "username", "password", "transport")}
+    farm_config.update({"client_id": "e2e-benchmark-farm", "loopback": {"broker": "e2e-benchmark", "latency": options["broker_latency"]}})
+    if options["transport"] == "paho":
+        farm_config.pop("loopback")
+    farm = ServerFarm(farm_config, seed=1)
+    servers = farm.add_servers(options["servers"], {"latency": options["server_latency"]})
+    if not farm.start():
+        raise RuntimeError("The simulated servers could not connect to the broker")
+
+    results: Metrics = {}
+    try:
+        for name, scenario in scenarios.items():
+            ms = MQTTms(make_config({**options, "concurrency": scenario["concurrency"]}, scenario["pipeline"]), {"verbose": 0})
+            try:
+                if not ms.connect_mqtt_broker() or not ms.subscribe_all():
+                    raise RuntimeError("MQTTms could not connect to the broker")
+                # warm up the connection, the validators and the simulator
+                run_scenario(ms, servers, 100, scenario["concurrency"])
+                measured = run_scenario(ms, servers, scenario["commands"], scenario["concurrency"])
+            finally:
+                ms.graceful_exit()
+            results[f"e2e.{name}.commands_per_sec"] = metric(measured["rate"], "1/s", "higher")
+            results[f"e2e.{name}.p50_ms"] = metric(measured["p50"] * 1000, "ms")
+            results[f"e2e.{name}.p99_ms"] = metric(measured["p99"] * 1000, "ms")
+            results[f"e2e.{name}.failures"] = metric(measured["failures"], "commands")
+    finally:
+        farm.stop()
+    return results
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="mqttms end-to-end benchmark")
+    parser.add_argument("--quick", action="store_true", help="fewer commands")
+    parser.add_argument("--transport", default="loopback", choices=("loopback", "paho"))
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username", default="")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--servers", type=int, default=100, help="simulated MS servers")
+    parser.add_argument("--concurrency", type=int, default=64, help="commands in flight in the pipelined scenario")
+    parser.add_argument("--server-latency", type=float, default=0.0, help="seconds of processing of a command by a server")
+    parser.add_argument("--broker-latency", type=float, default=0.0, help="seconds of a hop to the loopback broker")
+    args = parser.parse_args()
+    options = {key: value for key, value in vars(args).items() if key != "quick"}
+    for name, result in run(args.quick, options).items():
+        print(f"{name:45s} {result['value']:12.2f} {result['unit']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
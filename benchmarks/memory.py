@@ -0,0 +1,73 @@
+# benchmarks/memory.py
+
+# Memory per session: Python heap allocated (tracemalloc) per MQTTms object, measured over a
+# number of sessions:
+# - constructed: MQTTms objects which are not connected,
+# - connected: sessions connected to the loopback broker and subscribed, with their threads running.
+# Thread stacks and memory of C libraries are not included.
+#
+#   python benchmarks/memory.py [--quick]
+
+import gc
+import sys
+import argparse
+import tracemalloc
+
+from common import Metrics, metric
+
+def make_config(index: int) -> dict:
+    return {
+        "mqtt": {"host": "localhost", "port": 1883, "username": "", "password": "", "client_id": f"memory-benchmark-{index}",
+                 "timeout": 5.0, "transport": "loopback", "loopback": {"broker": "memory-benchmark"}},
+        "ms": {"client_uuid": "c", "server_uuid": "4fdc0d1f-2421-4b5b-975b-9b4d0a08d712", "cmd_topic": "@/server_uuid/CMD/format",
+               "subs_topics": [{"topic": "@/server_uuid/RSP/format", "format": "ASCIIHEX"},
+                               {"topic": "@/server_uuid/USL/format", "format": "JSON"}], "timeout": 5.0}
+    }
+
+def measure(sessions: int, connect: bool) -> float:
+    # pylint: disable=import-outside-toplevel
+    from mqttms import MQTTms
+
+    # the first session imports and builds what is shared by all sessions
+    first = MQTTms(make_config(0), {"verbose": 0})
+    if connect:
+        first.connect_mqtt_broker()
+        first.subscribe_all()
+    created = [first]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(1, sessions + 1):
+        ms = MQTTms(make_config(index), {"verbose": 0})
+        if connect:
+            ms.connect_mqtt_broker()
+            ms.subscribe_all()
+        created.append(ms)
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for ms in created:
+        if connect:
+            ms.graceful_exit()
+        else:
+            ms.ms_protocol.graceful_exit()
+            ms.mqtt_handler.exit_threads()
+    return allocated / sessions
+
+def run(quick: bool = False) -> Metrics:
+    sessions = 10 if quick else 50
+    return {
+        "memory.constructed_bytes_per_session": metric(measure(sessions, connect=False), "bytes"),
+        "memory.connected_bytes_per_session": metric(measure(sessions, connect=True), "bytes"),
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="mqttms memory per session")
+    parser.add_argument("--quick", action="store_true", help="fewer sessions")
+    args = parser.parse_args()
+    for name, result in run(args.quick).items():
+        print(f"{name:45s} {result['value']:10.0f} {result['unit']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# benchmarks/micro.py
+
+# Micro-benchmarks of the per-message hot paths, in nanoseconds per call:
+# - MQTTDispatcher.handle_message / topic matching,
+# - MSProtocol.validate_json ('full' and 'fast' validation),
+# - MSProtocol.add_tracking_information (JSON text and dict payloads) and add_data_type,
+# - MQTTHandler.on_message: decoding and queueing with logging off, and with INFO logging on.
+#
+#   python benchmarks/micro.py [--quick]
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+from common import Metrics, metric, time_per_call
+
+SERVER = "4fdc0d1f-2421-4b5b-975b-9b4d0a08d712"
+
+def make_config(validation: str = "full") -> dict:
+    return {
+        "mqttms": {
+            "mqtt": {"host": "localhost", "port": 1883, "username": "", "password": "", "client_id": "micro-benchmark",
+                     "timeout": 1.0, "long_payload": 25, "transport": "loopback", "loopback": {"broker": "micro-benchmark"}},
+            "ms": {"client_uuid": "c", "server_uuid": SERVER, "cmd_topic": "@/server_uuid/CMD/format",
+                   "rsp_topic": "@/server_uuid/RSP/format", "timeout": 1.0, "validation": validation}
+        },
+        "logging": {"verbose": 0}
+    }
+
+class Sink:
+    """Receiving queue which forgets the messages, so as only on_message itself is measured."""
+
+    def put(self, item, block=True, timeout=None) -> None:
+        pass
+
+def run(quick: bool = False) -> Metrics:
+    # pylint: disable=import-outside-toplevel
+    from mqttms.ms_protocol import MSProtocol
+    from mqttms.mqtt_dispatcher import MQTTDispatcher
+    from mqttms.mqtt_handler import MQTTHandler
+    from mqttms.loopback import LoopbackMessage
+
+    repeat, min_time = (3, 0.05) if quick else (5, 0.2)
+    results: Metrics = {}
+
+    def measure(name: str, function) -> None:
+        results[f"micro.{name}"] = metric(time_per_call(function, repeat=repeat, min_time=min_time), "ns")
+
+    # ---- dispatcher ----
+    config = make_config()
+    protocol = MSProtocol(config)
+    dispatcher = MQTTDispatcher(config, protocol)
+    # routes of an application besides the MS protocol routes
+    for index in range(100):
+        dispatcher.add_route(f"app/{index}/+/status", lambda message: None)
+    rsp_topic = f"@/{SERVER}/RSP/ASCIIHEX"
+    measure("dispatch_match", lambda: dispatcher.router.match(rsp_topic))
+    unrouted = ("app/17/x/other", "{}")
+    measure("dispatch_handle_message_unrouted", lambda: dispatcher.handle_message(unrouted))
+    routed = ("app/17/x/status", "{}")
+    measure("dispatch_handle_message_routed", lambda: dispatcher.handle_message(routed))
+
+    # ---- validation ----
+    response = {"cid": 123, "server": SERVER, "response": "OK", "dataType": "asciihex", "data": "0123456789ABCDEF" * 4}
+    measure("validate_json_full", lambda: protocol.validate_json(response))
+    fast_protocol = MSProtocol(make_config("fast"))
+    measure("validate_json_fast", lambda: fast_protocol.validate_json(response))
+
+    # ---- tracking information and data type ----
+    text_command = json.dumps({"command": "read", "address": 4096, "length": 64})
+    dict_command = {"command": "read", "address": 4096, "length": 64}
+    measure("add_tracking_information_text", lambda: protocol.add_tracking_information(text_command, cid=7))
+    measure("add_tracking_information_dict", lambda: protocol.add_tracking_information(dict_command, cid=7))
+    payload = dict(response)
+    measure("add_data_type", lambda: protocol.add_data_type(rsp_topic, payload))
+
+    # ---- MQTTHandler.on_message ----
+    handler = MQTTHandler(config)
+    handler.queue_rec = Sink()
+    message = LoopbackMessage(rsp_topic, json.dumps(response).encode(), 0)
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.WARNING)
+    measure("on_message", lambda: handler.on_message(None, None, message))
+
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        log_handler = logging.StreamHandler(devnull)
+        root.addHandler(log_handler)
+        root.setLevel(logging.INFO)
+        try:
+            measure("on_message_logging", lambda: handler.on_message(None, None, message))
+        finally:
+            root.removeHandler(log_handler)
+            root.setLevel(level)
+
+    handler.exit_threads()
+    protocol.graceful_exit()
+    fast_protocol.graceful_exit()
+    return results
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="mqttms micro-benchmarks")
+    parser.add_argument("--quick", action="store_true", help="shorter measurements")
+    args = parser.parse_args()
+    for name, result in run(args.quick).items():
+        print(f"{name:45s} {result['value']:10.0f} {result['unit']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# benchmarks/run.py
+
+# Benchmark suite of mqttms: runs the benchmarks, saves the results as JSON and compares them
+# with the results of another run (e.g. of the main branch).
+#
+#   python benchmarks/run.py [--suite micro,e2e,memory,startup] [--quick] [--output results.json]
+#                            [--compare baseline.json] [--threshold 10]
+#
+# With --compare every metric found in both runs is compared; the exit code is 1 when a metric
+# is worse than in the baseline by more than --threshold percent (a regression), so the suite can
+# guard performance changes in CI. Results of different machines are not comparable.
+
+import sys
+import json
+import time
+import argparse
+import platform
+from typing import Dict, List, Tuple
+
+from common import Metrics
+
+SUITES = ("micro", "e2e", "memory", "startup")
+
+def run_suites(names: List[str], quick: bool, e2e_options: Dict) -> Metrics:
+    # pylint: disable=import-outside-toplevel
+    import micro
+    import e2e
+    import memory
+    import startup
+
+    results: Metrics = {}
+    for name in names:
+        started = time.perf_counter()
+        if name == "micro":
+            results.update(micro.run(quick))
+        elif name == "e2e":
+            results.update(e2e.run(quick, e2e_options))
+        elif name == "memory":
+            results.update(memory.run(quick))
+        elif name == "startup":
+            results.update(startup.run(quick))
+        print(f"{name} done in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    return results
+
+def metadata() -> Dict:
+    # pylint: disable=import-outside-toplevel
+    from importlib import metadata as importlib_metadata
+    from mqttms import codec
+    try:
+        version = importlib_metadata.version("mqttms")
+    except importlib_metadata.PackageNotFoundError:
+        version = "unknown"
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "mqttms": version,
+        "compiled_codec": codec.COMPILED,
+    }
+
+def compare(results: Metrics, baseline: Metrics, threshold: float) -> Tuple[List[str], List[str]]:
+    """
+    Compare 'results' with 'baseline'. Returns the lines of the report and the names of the
+    metrics which regressed by more than 'threshold' percent.
+    """
+    lines = [f"{'metric':45s} {'baseline':>12s} {'current':>12s} {'change':>8s}"]
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["value"], result["value"]
+        if old == 0:
+            change = 0.0 if new == 0 else float("inf")
+        else:
+            change = (new - old) / abs(old) * 100
+        # positive 'worse' is a deterioration, whichever direction is better
+        worse = change if result.get("better", "lower") == "lower" else -change
+        mark = ""
+        if worse > threshold:
+            regressions.append(name)
+            mark = "  REGRESSION"
+        elif worse < -threshold:
+            mark = "  improved"
+        lines.append(f"{name:45s} {old:12.2f} {new:12.2f} {change:+7.1f}%{mark}")
+    return lines, regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="mqttms benchmark suite")
+    parser.add_argument("--suite", default=",".join(SUITES), help=f"comma separated suites of {', '.join(SUITES)}")
+    parser.add_argument("--quick", action="store_true", help="shorter runs, for smoke testing")
+    parser.add_argument("--output", default=None, help="file to save the results to (JSON)")
+    parser.add_argument("--compare", default=None, help="results of a previous run (JSON) to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent of deterioration reported as a regression")
+    parser.add_argument("--transport", default="loopback", choices=("loopback", "paho"), help="transport of the e2e suite")
+    parser.add_argument("--host", default="localhost", help="broker of the e2e suite with --transport paho")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.suite.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SUITES]
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(unknown)}")
+
+    results = run_suites(names, args.quick, {"transport": args.transport, "host": args.host, "port": args.port})
+    report = {"meta": metadata(), "metrics": results}
+
+    for name, result in results.items():
+        print(f"{name:45s} {result['value']:12.2f} {result['unit']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline["metrics"], args.threshold)
+        print()
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold}%: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# benchmarks/startup.py
+
+# Startup benchmark: time of importing mqttms and of constructing MQTTms, each measured in
+# fresh interpreters so as nothing is cached by a previous run.
+#
+#   python benchmarks/startup.py [--runs N] [--json] [--max-import-ms MS] [--max-init-ms MS]
+#
+# With the --max-* limits the exit code is 1 when a median exceeds its limit, so the script
+# can guard against startup regressions in CI.
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Each probe prints a JSON object with its measurements
+PROBES = {
+    "import_mqttms": """
+import time, sys, json
+t = time.perf_counter()
+import mqttms
+elapsed = time.perf_counter() - t
+heavy = sorted({m.split('.')[0] for m in sys.modules} & {'paho', 'jsonschema', 'colorama', 'numpy'})
+print(json.dumps({"seconds": elapsed, "heavy_modules": heavy}))
+""",
+    "import_core": """
+import time, json
+t = time.perf_counter()
+from mqttms import MQTTms
+print(json.dumps({"seconds": time.perf_counter() - t}))
+""",
+    "construct": """
+import time, json, threading
+from mqttms import MQTTms
+config = {
+    "mqtt": {"host": "localhost", "port": 1883, "username": "", "password": "",
+             "client_id": "startup-benchmark", "timeout": 1.0},
+    "ms": {"client_uuid": "c", "server_uuid": "s", "cmd_topic": "@/server_uuid/CMD/format",
+           "subs_topics": [{"topic": "@/server_uuid/RSP/format", "format": "JSON"}], "timeout": 1.0}
+}
+threads = threading.active_count()
+t = time.perf_counter()
+ms = MQTTms(config, {"verbose": 0})
+elapsed = time.perf_counter() - t
+started = threading.active_count() - threads
+# never connected, only the threads have to exit
+ms.ms_protocol.graceful_exit()
+ms.mqtt_handler.exit_threads()
+print(json.dumps({"seconds": elapsed, "threads_started": started}))
+""",
+}
+
+def run_probe(code: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"Probe failed:\n{result.stderr}")
+    # the last line is the JSON of the probe, logging may precede it
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def run_probes(count: int) -> dict:
+    """
+    Run every probe in 'count' fresh interpreters and return the median / min / max times per probe.
+    """
+    results = {}
+    for name, code in PROBES.items():
+        runs = [run_probe(code) for _ in range(count)]
+        seconds = [run["seconds"] for run in runs]
+        results[name] = {
+            "median_ms": statistics.median(seconds) * 1000,
+            "min_ms": min(seconds) * 1000,
+            "max_ms": max(seconds) * 1000,
+        }
+        # details which do not vary between runs are taken from the last one
+        results[name].update({key: value for key, value in runs[-1].items() if key != "seconds"})
+
+    return results
+
+def run(quick: bool = False) -> dict:
+    """
+    Startup metrics in the format of the benchmark suite (run.py).
+    """
+    # pylint: disable=import-outside-toplevel
+    from common import metric
+    results = run_probes(3 if quick else 10)
+    return {f"startup.{name}_ms": metric(result["median_ms"], "ms") for name, result in results.items()}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="mqttms startup benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per probe")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="limit of the median time of 'import mqttms'")
+    parser.add_argument("--max-init-ms", type=float, default=None, help="limit of the median time of MQTTms()")
+    args = parser.parse_args()
+
+    results = run_probes(args.runs)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            details = ", ".join(f"{key}={value}" for key, value in result.items() if not key.endswith("_ms"))
+            print(f"{name:15s} median {result['median_ms']:8.2f} ms  min {result['min_ms']:8.2f} ms  max {result['max_ms']:8.2f} ms  {details}")
+
+    failed = False
+    if args.max_import_ms is not None and results["import_mqttms"]["median_ms"] > args.max_import_ms:
+        print(f"import mqttms exceeds {args.max_import_ms} ms", file=sys.stderr)
+        failed = True
+    if args.max_init_ms is not None and results["construct"]["median_ms"] > args.max_init_ms:
+        print(f"MQTTms() exceeds {args.max_init_ms} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
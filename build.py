@@ -85,6 +85,8 @@ def build_cython_extensions():
         if subdir.is_dir():
             # Recursively get all .c and .pyx files for the current module
             c_files = [file for pattern in patterns for file in subdir.rglob(pattern)]
+            # .c files generated by cythonize from a .pyx of a previous build are not sources
+            c_files = [file for file in c_files if not (file.suffix == ".c" and file.with_suffix(".pyx").exists())]
         if c_files:
             ext_dirs.append(subdir)
             extensions.append(
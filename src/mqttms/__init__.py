@@ -1,7 +1,38 @@
 # mqttms/__init__.py
 
-from .ms_protocol import MSProtocol
-from .mqtt_handler import MQTTHandler
-from .mqtt_dispatcher import MQTTDispatcher
-from .core import MQTTms
-from .conferror import ConfigurationError
+# The classes are imported from their modules on first access (PEP 562), so as importing
+# mqttms does not pull in paho, jsonschema and the other dependencies until they are used.
+
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .ms_protocol import MSProtocol
+    from .mqtt_handler import MQTTHandler
+    from .mqtt_dispatcher import MQTTDispatcher
+    from .core import MQTTms
+    from .async_core import AsyncMQTTms
+    from .conferror import ConfigurationError
+
+_LAZY_ATTRIBUTES = {
+    "MSProtocol": ".ms_protocol",
+    "MQTTHandler": ".mqtt_handler",
+    "MQTTDispatcher": ".mqtt_dispatcher",
+    "MQTTms": ".core",
+    "AsyncMQTTms": ".async_core",
+    "ConfigurationError": ".conferror",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    # cache it, so as __getattr__ is not called again for this name
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,12 +1,41 @@
 # mqtt_dispatcher.py
 
+import time
 from typing import Dict, Tuple
 from abc import ABC, abstractmethod
+from mqttms.topic_router import TopicRouter, RouteHandler
+from mqttms.metrics import FAST_BUCKETS, NULL_METRICS
 
 class AbstractMQTTDispatcher(ABC):
     def __init__(self, config: Dict):
         self.config = config
+        # routes compiled once, matched per message in O(topic levels)
+        self.router = TopicRouter()
+        # metrics are recorded after define_metrics() attaches a registry
+        self.define_metrics(NULL_METRICS)
+
+    def define_metrics(self, registry) -> None:
+        self.metric_match = registry.histogram("dispatch_match_seconds", "Topic matching time of a received message", FAST_BUCKETS)
+        self.metric_unrouted = registry.counter("dispatch_unrouted_total", "Received messages which matched no route")
+
+    def add_route(self, topic_filter: str, handler: RouteHandler) -> None:
+        """
+        Register a handler for messages whose topic matches 'topic_filter' (MQTT wildcards allowed).
+        """
+        self.router.add_route(topic_filter, handler)
+
+    def remove_route(self, topic_filter: str, handler: RouteHandler) -> bool:
+        return self.router.remove_route(topic_filter, handler)
 
     @abstractmethod
     def handle_message(self, message: Tuple[str, str]) -> bool:
-        return False
+        # dispatch to the registered routes; True if any route matched
+        start = time.perf_counter()
+        handlers = self.router.match(message[0])
+        self.metric_match.observe(time.perf_counter() - start)
+        if not handlers:
+            self.metric_unrouted.inc()
+            return False
+        for handler in handlers:
+            handler(message)
+        return True
@@ -0,0 +1,164 @@
+# mqttms/async_core.py
+
+import asyncio
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from mqttms.core import MQTTms
+from mqttms.mqtt_dispatcher import MQTTDispatcher
+from mqttms.mqtt_handler import SUBACK_UNSPECIFIED_ERROR
+
+from mqttms.logger import get_app_logger
+
+logger = get_app_logger(__name__)
+
+class AsyncMQTTms:
+    """
+    asyncio facade of MQTTms.
+
+    It runs on the same paho client and internal objects as MQTTms. Waiting is done on
+    per-request futures which are resolved by the paho callbacks and bridged to the running
+    event loop with call_soon_threadsafe, so no thread is blocked per waiting coroutine.
+    """
+
+    def __init__(self, config:Dict, logging:Dict, mqtt_dispatcher: MQTTDispatcher=None, unsolicited_maxsize: int = 0):
+        self.mqttms = MQTTms(config, logging, mqtt_dispatcher)
+        self.config = self.mqttms.config
+        self.unsolicited_maxsize = unsolicited_maxsize
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._unsolicited: Optional[asyncio.Queue] = None
+
+    def _bind_loop(self) -> None:
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._unsolicited = asyncio.Queue(maxsize=self.unsolicited_maxsize)
+        # unsolicited messages come from the MS unsolicited thread
+        self.mqttms.ms_protocol.set_unsolicited_message_processor(self._on_unsolicited)
+
+    def _on_unsolicited(self, message: dict) -> None:
+        self._loop.call_soon_threadsafe(self._put_unsolicited, message)
+
+    def _put_unsolicited(self, message: Optional[dict]) -> None:
+        try:
+            self._unsolicited.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("MQTTMS: unsolicited message dropped, queue is full")
+
+    def _timeout(self) -> float:
+        return self.config['mqttms']['mqtt'].get('timeout', 5.0)
+
+    async def connect(self) -> bool:
+        self._bind_loop()
+        self.mqttms.ms_protocol.start()
+        future = self.mqttms.mqtt_handler.connect_nowait()
+        try:
+            res = await asyncio.wait_for(asyncio.wrap_future(future), self._timeout())
+        except asyncio.TimeoutError:
+            logger.warning("No MQTT connection was established in time")
+            res = False
+        if not res:
+            self.mqttms.mqtt_handler.stop_network_loop()
+            self.mqttms.mqtt_handler.exit_threads()
+        return res
+
+    async def subscribe(self, topic: str) -> bool:
+        future = self.mqttms.mqtt_handler.subscribe_nowait(topic)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self._timeout())
+        except asyncio.TimeoutError:
+            logger.warning("MQTTMS: Not successful subscription to '%s'", topic)
+            return False
+
+    async def subscribe_all(self) -> bool:
+        # all subscriptions are sent in one packet and acknowledged at once
+        future = self.mqttms.ms_protocol.subscribe_all_nowait()
+        try:
+            codes = await asyncio.wait_for(asyncio.wrap_future(future), self._timeout())
+        except asyncio.TimeoutError:
+            logger.warning("MQTTMS: Not successful subscription")
+            return False
+        if any(code >= SUBACK_UNSPECIFIED_ERROR for code in codes.values()):
+            logger.warning("MQTTMS: Not successful subscription")
+            return False
+        return True
+
+    async def send_command(self, payload, server: Optional[str] = None, priority: int = 0,
+                           deadline: Optional[float] = None, timeout: Optional[float] = None) -> dict:
+        """
+        Send an MS command to 'server' (default: the configured server_uuid) and wait for its response.
+        'priority', 'deadline' (time.monotonic()) and 'timeout' are those of MSProtocol.put_command().
+        Returns the validated response or the generated TM / BD response.
+        """
+        return await asyncio.wrap_future(self.mqttms.ms_protocol.put_command(payload, server, priority, deadline, timeout))
+
+    async def broadcast(self, payload, servers: Iterable[str], deadline: Optional[float] = None,
+                        priority: int = 0, timeout: Optional[float] = None) -> Dict[str, dict]:
+        """
+        Send an MS command to many servers at once and wait until all have answered or the deadline
+        (time.monotonic()) has passed. Returns the dictionary server -> response, TM for silent servers.
+        """
+        broadcast = self.mqttms.ms_protocol.broadcast(payload, servers, deadline, None, priority, timeout)
+        return await asyncio.wrap_future(broadcast.future)
+
+    async def broadcast_stream(self, payload, servers: Iterable[str], deadline: Optional[float] = None,
+                               priority: int = 0, timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Like broadcast(), but yields (server, response) pairs as the responses arrive.
+        """
+        loop = asyncio.get_running_loop()
+        arrivals: asyncio.Queue = asyncio.Queue()
+        callback = lambda server, response: loop.call_soon_threadsafe(arrivals.put_nowait, (server, response))
+        broadcast = self.mqttms.ms_protocol.broadcast(payload, servers, deadline, callback, priority, timeout)
+        broadcast.future.add_done_callback(lambda f: loop.call_soon_threadsafe(arrivals.put_nowait, None))
+        yielded = set()
+        while True:
+            arrival = await arrivals.get()
+            if arrival is None:
+                break
+            yielded.add(arrival[0])
+            yield arrival
+        # responses whose callbacks were scheduled after the end of the broadcast
+        if not broadcast.future.cancelled():
+            for server, response in broadcast.future.result().items():
+                if server not in yielded:
+                    yield server, response
+
+    async def publish(self, topic: str, payload: str, qos: Optional[int] = None) -> bool:
+        """
+        Publish a message and wait until it is published (QoS 0) or acknowledged (QoS 1/2).
+        """
+        handler = self.mqttms.mqtt_handler
+        future = handler.publish_message(topic, payload, qos, block=False)
+        if future is None:
+            # the in-flight window is full, wait for a slot out of the event loop
+            future = await asyncio.get_running_loop().run_in_executor(None, handler.publish_message, topic, payload, qos)
+        return await asyncio.wrap_future(future)
+
+    async def unsolicited(self) -> AsyncIterator[dict]:
+        """
+        Iterate over valid unsolicited messages as they arrive. The iteration ends
+        after graceful_exit().
+        """
+        self._bind_loop()
+        while True:
+            message = await self._unsolicited.get()
+            if message is None:
+                break
+            yield message
+
+    async def graceful_exit(self) -> None:
+        # joining the internal threads blocks, so it is done out of the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.mqttms.graceful_exit)
+        if self._unsolicited is not None:
+            # make room for the end marker of the iteration
+            if self._unsolicited.full():
+                self._unsolicited.get_nowait()
+            self._put_unsolicited(None)
+
+    async def __aenter__(self) -> "AsyncMQTTms":
+        self._bind_loop()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.graceful_exit()
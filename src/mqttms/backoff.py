@@ -0,0 +1,50 @@
+# backoff.py
+
+import random
+from typing import Dict, Optional
+
+JITTER_MODES = ("full", "equal", "none")
+
+class Backoff:
+    """
+    Exponential backoff of reconnection attempts.
+
+    The base delay grows from 'min_delay' by 'multiplier' per attempt up to 'max_delay'.
+    Jitter spreads the attempts of many clients disconnected at the same moment:
+    - full: a random delay between 0 and the base delay,
+    - equal: half of the base delay plus a random part up to the other half,
+    - none: the base delay.
+    """
+
+    def __init__(self, min_delay: float = 1.0, max_delay: float = 60.0, multiplier: float = 2.0, jitter: str = "full", rng: Optional[random.Random] = None):
+        if jitter not in JITTER_MODES:
+            raise ValueError(f"Unknown jitter mode '{jitter}'")
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.attempt = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> "Backoff":
+        config = config or {}
+        return cls(min_delay=config.get("min_delay", 1.0),
+                   max_delay=config.get("max_delay", 60.0),
+                   multiplier=config.get("multiplier", 2.0),
+                   jitter=config.get("jitter", "full"))
+
+    def next_delay(self) -> float:
+        """
+        Return the delay before the next attempt and count the attempt.
+        """
+        base = min(self.max_delay, self.min_delay * self.multiplier ** self.attempt)
+        self.attempt += 1
+        if self.jitter == "full":
+            return self.rng.uniform(0, base)
+        if self.jitter == "equal":
+            return base / 2 + self.rng.uniform(0, base / 2)
+        return base
+
+    def reset(self) -> None:
+        self.attempt = 0
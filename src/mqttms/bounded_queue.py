@@ -0,0 +1,137 @@
+# bounded_queue.py
+
+import heapq
+import queue
+from typing import Any, Callable, Dict, Optional
+
+from mqttms.logger import get_app_logger
+
+logger = get_app_logger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+class BoundedQueue(queue.Queue):
+    """
+    queue.Queue with a maximum size and a selectable overflow policy.
+
+    - block: put() waits for free space (standard queue.Queue behaviour),
+    - drop_oldest: the oldest queued item is dropped to make room for the new one,
+    - drop_newest: the new item is dropped.
+
+    Every dropped item is counted in 'dropped' and passed to the optional 'on_drop' callback,
+    so that its owner can release resources bound to it. maxsize 0 means unbounded.
+
+    close() puts the exit signal of the consumer thread regardless of the size limit; items put
+    after it are dropped, so producers never wait for a consumer which has exited.
+    """
+
+    def __init__(self, maxsize: int = 0, policy: str = "block", name: str = "", on_drop: Optional[Callable[[Any], None]] = None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{policy}'")
+        super().__init__(maxsize)
+        self.policy = policy
+        self.name = name
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        if not self.closed and (self.maxsize <= 0 or self.policy == "block"):
+            super().put(item, block, timeout)
+            return
+
+        dropped = None
+        with self.mutex:
+            accept = True
+            if self.closed:
+                self.dropped += 1
+                dropped = item
+                accept = False
+            elif self._qsize() >= self.maxsize:
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    dropped = item
+                    accept = False
+                else:
+                    # the new item takes the place of the oldest one
+                    dropped = self._evict(item)
+                    if dropped is item:
+                        accept = False
+                    else:
+                        self.unfinished_tasks -= 1
+            if accept:
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+
+        if dropped is not None:
+            logger.debug("Queue '%s' is full (%d), item dropped (%s)", self.name, self.maxsize, self.policy)
+            if self.on_drop:
+                self.on_drop(dropped)
+
+    def _evict(self, item: Any) -> Any:
+        # called with the mutex held: remove and return the item dropped by drop_oldest to make
+        # room for 'item', or return 'item' itself if it is the one to drop
+        return self._get()
+
+    def close(self, item: Any) -> None:
+        """
+        Put the exit signal 'item' of the consumer regardless of the size limit and close the queue.
+        """
+        with self.mutex:
+            self.closed = True
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def stats(self) -> Dict:
+        return {"depth": self.qsize(), "maxsize": self.maxsize, "policy": self.policy, "dropped": self.dropped}
+
+class PriorityBoundedQueue(BoundedQueue):
+    """
+    BoundedQueue which returns its items in order of key(item), the smallest key first, and items
+    with equal keys in the order of putting.
+
+    When the queue is full, drop_oldest drops the last item in this order (the least urgent one,
+    the oldest of them if there are several), which may be the new item itself.
+    """
+
+    def __init__(self, key: Callable[[Any], Any], maxsize: int = 0, policy: str = "block", name: str = "", on_drop: Optional[Callable[[Any], None]] = None):
+        self.key = key
+        self.sequence = 0
+        super().__init__(maxsize=maxsize, policy=policy, name=name, on_drop=on_drop)
+
+    # storage of queue.Queue replaced by a heap of (key, sequence, item)
+    def _init(self, maxsize: int) -> None:
+        self.queue = []
+
+    def _qsize(self) -> int:
+        return len(self.queue)
+
+    def _put(self, item: Any) -> None:
+        self.sequence += 1
+        heapq.heappush(self.queue, (self.key(item), self.sequence, item))
+
+    def _get(self) -> Any:
+        return heapq.heappop(self.queue)[2]
+
+    def _evict(self, item: Any) -> Any:
+        # the least urgent entry: the largest key, the newest of equal keys is kept
+        last = max(range(len(self.queue)), key=lambda index: (self.queue[index][0], -self.queue[index][1]))
+        if self.key(item) > self.queue[last][0]:
+            return item
+        entry = self.queue[last]
+        self.queue[last] = self.queue[-1]
+        self.queue.pop()
+        heapq.heapify(self.queue)
+        return entry[2]
+
+def make_queue(config: Optional[Dict], name: str, on_drop: Optional[Callable[[Any], None]] = None, key: Optional[Callable[[Any], Any]] = None) -> BoundedQueue:
+    """
+    Create a BoundedQueue from a queue configuration {"maxsize": int, "policy": str}.
+    With 'key' the queue is a PriorityBoundedQueue ordered by key(item).
+    """
+    config = config or {}
+    if key is not None:
+        return PriorityBoundedQueue(key, maxsize=config.get("maxsize", 0), policy=config.get("policy", "block"), name=name, on_drop=on_drop)
+    return BoundedQueue(maxsize=config.get("maxsize", 0), policy=config.get("policy", "block"), name=name, on_drop=on_drop)
@@ -0,0 +1,62 @@
+# cid_allocator.py
+
+import threading
+from typing import Dict, Optional, Set
+
+class CidExhaustedError(RuntimeError):
+    """Raised when all command ids of a server are outstanding."""
+
+class CidAllocator:
+    """
+    Allocator of command ids (cid) within the range allowed by the MS response schema.
+
+    Ids are handed out from a ring sequence, so a released id is reused as late as possible,
+    and ids still outstanding are skipped. Ids are tracked per server uuid ('key'): two servers
+    can have the same cid in flight, because their responses are told apart by the topic.
+    """
+
+    def __init__(self, low: int = 0, high: int = 999):
+        self.low = low
+        self.high = high
+        self.size = high - low + 1
+        self.next_cid = low
+        # outstanding ids per key
+        self.in_use: Dict[str, Set[int]] = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def allocate(self, key: str = "") -> int:
+        with self.lock:
+            used = self.in_use.setdefault(key, set())
+            if len(used) >= self.size:
+                raise CidExhaustedError(f"All {self.size} command ids of '{key}' are outstanding")
+            cid = self.next_cid
+            while cid in used:
+                cid = cid + 1 if cid < self.high else self.low
+            self.next_cid = cid + 1 if cid < self.high else self.low
+            used.add(cid)
+            self.count += 1
+            return cid
+
+    def release(self, cid: int, key: str = "") -> None:
+        with self.lock:
+            used = self.in_use.get(key)
+            if used is None or cid not in used:
+                return
+            used.discard(cid)
+            self.count -= 1
+            if not used:
+                del self.in_use[key]
+
+    def is_outstanding(self, cid: int, key: str = "") -> bool:
+        with self.lock:
+            return cid in self.in_use.get(key, ())
+
+    def occupancy(self, key: Optional[str] = None) -> int:
+        """
+        Number of outstanding ids, of all keys or of the given key.
+        """
+        with self.lock:
+            if key is None:
+                return self.count
+            return len(self.in_use.get(key, ()))
@@ -0,0 +1,108 @@
+# codec.py
+
+import os
+import json
+import binascii
+from typing import Any, Optional, Tuple, Union
+
+# Per-message codec functions: topic parsing, ASCIIHEX / base64 decoding into buffers and
+# extraction of the envelope fields of MS responses. The functions below are the pure-Python
+# implementation; when the compiled extension (extensions/codec/codec.pyx, built by build.py)
+# is available, its functions replace them. MQTTMS_PURE_PYTHON=1 forces the pure-Python ones.
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# topic format -> 'dataType' of the response
+FORMAT_DATA_TYPES = {"BINARY": "base64", "ASCIIHEX": "asciihex", "ASCII": "ascii", "JSON": "object"}
+MS_TOPIC_KINDS = ("RSP", "USL")
+
+def topic_server(topic: str) -> str:
+    """
+    Return the server uuid segment of a topic @/<server_uuid>/..., '' if the topic has no such segment.
+    """
+    return topic.split('/', 2)[1] if topic.count('/') >= 2 else ''
+
+def topic_format(topic: str) -> Optional[str]:
+    """
+    Return the last segment (the format) of a topic of at least 4 segments, None for shorter topics.
+    """
+    if topic.count('/') < 3:
+        return None
+    return topic[topic.rfind('/') + 1:]
+
+def parse_ms_topic(topic: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Parse a topic @/<server_uuid>/<RSP|USL>/<format> into (server_uuid, kind, format).
+    Returns None for other topics.
+    """
+    parts = topic.split('/')
+    if len(parts) != 4 or parts[0] != '@' or not parts[1]:
+        return None
+    if parts[2] not in MS_TOPIC_KINDS or parts[3] not in FORMAT_DATA_TYPES:
+        return None
+    return parts[1], parts[2], parts[3]
+
+def decode_asciihex(data: Union[str, BytesLike]) -> bytes:
+    """
+    Decode ASCIIHEX data (str or bytes-like) into bytes.
+    """
+    return binascii.a2b_hex(data)
+
+def decode_base64(data: Union[str, BytesLike]) -> bytes:
+    """
+    Decode base64 data (str or bytes-like) into bytes. Invalid characters raise binascii.Error.
+    """
+    return binascii.a2b_base64(data, strict_mode=True)
+
+def decode_asciihex_into(data: Union[str, BytesLike], buffer: Any) -> int:
+    """
+    Decode ASCIIHEX data into the writable buffer 'buffer' (bytearray, memoryview, array)
+    and return the number of bytes written. Raises ValueError if the buffer is too small.
+    """
+    decoded = binascii.a2b_hex(data)
+    return _copy_into(decoded, buffer)
+
+def decode_base64_into(data: Union[str, BytesLike], buffer: Any) -> int:
+    """
+    Decode base64 data into the writable buffer 'buffer' and return the number of bytes written.
+    """
+    decoded = binascii.a2b_base64(data, strict_mode=True)
+    return _copy_into(decoded, buffer)
+
+def _copy_into(decoded: bytes, buffer: Any) -> int:
+    target = memoryview(buffer).cast('B')
+    if len(decoded) > len(target):
+        raise ValueError(f"Buffer of {len(target)} bytes is too small for {len(decoded)} bytes")
+    target[:len(decoded)] = decoded
+    return len(decoded)
+
+def response_envelope(payload: Union[str, BytesLike]) -> Optional[Tuple[Optional[int], Optional[str], Optional[str]]]:
+    """
+    Extract the envelope fields (cid, server, response) of an MS response from its JSON text,
+    a field is None when it is missing or of another type. Returns None when the payload is
+    not a JSON object, or (compiled codec) when the fields cannot be extracted without a full parse.
+    """
+    try:
+        data = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    cid = data.get("cid")
+    server = data.get("server")
+    response = data.get("response")
+    return (cid if type(cid) is int else None,
+            server if type(server) is str else None,
+            response if type(response) is str else None)
+
+COMPILED = False
+if os.environ.get("MQTTMS_PURE_PYTHON", "") in ("", "0"):
+    try:
+        # pylint: disable=no-name-in-module,import-error
+        from mqttms.extensions.codec.codec import (  # type: ignore[import-not-found,no-redef]  # noqa: F811
+            topic_server, topic_format, parse_ms_topic,
+            decode_asciihex_into, decode_base64_into, response_envelope,
+        )
+        COMPILED = True
+    except ImportError:
+        pass
@@ -1,13 +1,14 @@
 # mqttms/core.py
 
-from typing import Dict
-from jsonschema import validate, ValidationError
+from typing import Callable, Dict, Iterable, Optional
+from concurrent.futures import Future
 from mqttms.mqtt_handler import MQTTHandler
-from mqttms.ms_protocol import MSProtocol
+from mqttms.ms_protocol import MSProtocol, Broadcast
 from mqttms.mqtt_dispatcher import MQTTDispatcher
 from mqttms.conferror import ConfigurationError
+from mqttms.metrics import MetricsRegistry
 
-from mqttms.logger import get_app_logger
+from mqttms.logger import get_app_logger, enable_trace
 
 logger = get_app_logger(__name__)
 
@@ -15,6 +16,17 @@ class MQTTms:
 
     CONFIG_SCHEMA = {
         "$schema": "https://json-schema.org/draft/2020-12/schema",
+        "$defs": {
+            # size limit and overflow policy of an internal queue
+            "queue": {
+                "type": "object",
+                "properties": {
+                    "maxsize": {"type": "integer", "minimum": 0},
+                    "policy": {"type": "string", "enum": ["block", "drop_oldest", "drop_newest"]}
+                },
+                "additionalProperties": False
+            }
+        },
         "type": "object",
         "properties": {
             "mqttms": {
@@ -29,7 +41,48 @@ class MQTTms:
                             "password": {"type": "string"},
                             "client_id": {"type": "string"},
                             "timeout": {"type": "number"},
-                            "long_payload": {"type": "integer", "minimum": 10, "maximum": 32768}
+                            "long_payload": {"type": "integer", "minimum": 10, "maximum": 32768},
+                            "raw_payload": {"type": "boolean"},
+                            "transport": {"type": "string"},
+                            "loopback": {
+                                "type": "object",
+                                "properties": {
+                                    "broker": {"type": "string"},
+                                    "latency": {"type": "number", "minimum": 0},
+                                    "jitter": {"type": "number", "minimum": 0},
+                                    "loss": {"type": "number", "minimum": 0, "maximum": 1},
+                                    "max_qos": {"type": "integer", "minimum": 0, "maximum": 2},
+                                    "seed": {"type": "integer"}
+                                },
+                                "additionalProperties": False
+                            },
+                            "qos": {"type": "integer", "minimum": 0, "maximum": 2},
+                            "topic_qos": {
+                                "type": "object",
+                                "additionalProperties": {"type": "integer", "minimum": 0, "maximum": 2}
+                            },
+                            "max_inflight": {"type": "integer", "minimum": 1},
+                            "reconnect": {
+                                "type": "object",
+                                "properties": {
+                                    "enabled": {"type": "boolean"},
+                                    "min_delay": {"type": "number", "exclusiveMinimum": 0},
+                                    "max_delay": {"type": "number", "exclusiveMinimum": 0},
+                                    "multiplier": {"type": "number", "minimum": 1},
+                                    "jitter": {"type": "string", "enum": ["full", "equal", "none"]},
+                                    "max_attempts": {"type": "integer", "minimum": 0},
+                                    "resubscribe": {"type": "boolean"}
+                                },
+                                "additionalProperties": False
+                            },
+                            "queues": {
+                                "type": "object",
+                                "properties": {
+                                    "pub": {"$ref": "#/$defs/queue"},
+                                    "rec": {"$ref": "#/$defs/queue"}
+                                },
+                                "additionalProperties": False
+                            }
                         },
                         "required": ["host", "port"]
                     },
@@ -50,7 +103,8 @@ class MQTTms:
                                         "format": {
                                             "type": "string",
                                             "enum": ["BINARY", "ASCIIHEX", "ASCII", "JSON" ]
-                                        }
+                                        },
+                                        "qos": {"type": "integer", "minimum": 0, "maximum": 2}
                                     },
                                     "required": ["topic", "format"],
                                     "additionalProperties": False
@@ -58,9 +112,40 @@ class MQTTms:
                                 "minItems": 1,
                                 "uniqueItems": True
                             },
-                            "timeout": {"type": "number", "minimum": 0.1, "maximum": 60.0}
+                            "timeout": {"type": "number", "minimum": 0.1, "maximum": 60.0},
+                            "pipeline": {"type": "boolean"},
+                            "window": {"type": "integer", "minimum": 1, "maximum": 1000},
+                            "multi_server": {"type": "boolean"},
+                            "validation": {"type": "string", "enum": ["full", "fast", "off"]},
+                            "encoder": {"type": "string", "enum": ["auto", "json", "orjson", "msgspec"]},
+                            "queues": {
+                                "type": "object",
+                                "properties": {
+                                    "cmd": {"$ref": "#/$defs/queue"},
+                                    "unsolicited": {"$ref": "#/$defs/queue"},
+                                    "unsolicited_worker": {"$ref": "#/$defs/queue"}
+                                },
+                                "additionalProperties": False
+                            },
+                            "unsolicited_workers": {"type": "integer", "minimum": 1, "maximum": 256},
+                            "unsolicited_executor": {"type": "string", "enum": ["thread", "process"]},
+                            "inflight_on_disconnect": {"type": "string", "enum": ["keep", "expire", "replay"]}
+                        },
+                        "required": ["client_uuid", "cmd_topic", "subs_topics", "timeout"],
+                        # server_uuid may be omitted only when every command names its server
+                        "anyOf": [
+                            {"required": ["server_uuid"]},
+                            {"properties": {"multi_server": {"const": True}}, "required": ["multi_server"]}
+                        ]
+                    },
+                    "metrics": {
+                        "type": "object",
+                        "properties": {
+                            "enabled": {"type": "boolean"},
+                            "prometheus_port": {"type": "integer", "minimum": 0, "maximum": 65535},
+                            "prometheus_host": {"type": "string"}
                         },
-                        "required": ["client_uuid", "server_uuid", "cmd_topic", "subs_topics", "timeout"]
+                        "additionalProperties": False
                     }
                 },
                 "required": ["mqtt", "ms"],
@@ -83,8 +168,30 @@ class MQTTms:
                     "use_string_handler": {
                         "type": "boolean"
                     },
+                    "use_queue_handler": {
+                        "type": "boolean"
+                    },
+                    "string_max_records": {
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    "string_max_bytes": {
+                        "type": "integer",
+                        "minimum": 1
+                    },
                     "version_option": {
                         "type": "boolean"
+                    },
+                    "trace": {
+                        "type": "boolean"
+                    },
+                    "sample_every": {
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    "sample_topics": {
+                        "type": "object",
+                        "additionalProperties": {"type": "integer", "minimum": 1}
                     }
                 },
                 "additionalProperties": False
@@ -94,6 +201,20 @@ class MQTTms:
         "additionalProperties": False
     }
 
+    # validator of CONFIG_SCHEMA, built on first use and shared by all instances
+    _config_validator = None
+
+    @classmethod
+    def config_validator(cls):
+        # look in the class itself, so as a subclass with its own CONFIG_SCHEMA gets its own validator
+        validator = cls.__dict__.get('_config_validator')
+        if validator is None:
+            # jsonschema is imported with the first configuration to validate, not with mqttms
+            from jsonschema import Draft202012Validator  # pylint: disable=import-outside-toplevel
+            validator = Draft202012Validator(cls.CONFIG_SCHEMA)
+            cls._config_validator = validator
+        return validator
+
     def __init__(self, config:Dict, logging:Dict, mqtt_dispatcher: MQTTDispatcher=None):
         '''
         Initialize objects
@@ -107,15 +228,18 @@ class MQTTms:
         self.config['mqttms'].update(config)
         self.config['logging'].update(logging)
         # validate configuration
-        try:
-            validate(instance=self.config, schema=self.CONFIG_SCHEMA)
-        except ValidationError as e:
-            logger.error("MQTTMS: Invalid configuration. Reason: %s", e.message)
-            raise ConfigurationError("MQTTMS: Invalid configuration") from e
+        error = next(self.config_validator().iter_errors(self.config), None)
+        if error is not None:
+            logger.error("MQTTMS: Invalid configuration. Reason: %s", error.message)
+            raise ConfigurationError("MQTTMS: Invalid configuration") from error
 
         if self.config['logging'].get('verbose', False):
             logger.info("MQTTms Configuration: %s", self.config)
 
+        # per-message trace channel, can be switched at runtime with enable_trace() / disable_trace()
+        if self.config['logging'].get('trace', False):
+            enable_trace()
+
         # Create MQTTDispatcher object
         try:
             self.mqtt_dispatcher = None
@@ -153,7 +277,21 @@ class MQTTms:
         self.ms_protocol.define_mqtt_handler(self.mqtt_handler)
         self.mqtt_handler.define_message_handler(self.mqtt_dispatcher)
 
+        # Metrics of all objects are collected in one registry. They are off by default: without
+        # a registry the objects record into NULL_METRICS, which takes no locks.
+        self.metrics = None
+        metrics_config = self.config['mqttms'].get('metrics', {})
+        if metrics_config.get('enabled', False):
+            self.metrics = MetricsRegistry()
+            self.mqtt_dispatcher.define_metrics(self.metrics)
+            self.ms_protocol.define_metrics(self.metrics)
+            self.mqtt_handler.define_metrics(self.metrics)
+            if 'prometheus_port' in metrics_config:
+                self.metrics.start_http_server(metrics_config['prometheus_port'], metrics_config.get('prometheus_host', '127.0.0.1'))
+
     def connect_mqtt_broker(self) -> bool:
+        # the threads of the objects are created here, so as constructing MQTTms stays cheap
+        self.ms_protocol.start()
         try:
             res = self.mqtt_handler.connect()
             if not res:
@@ -190,13 +328,61 @@ class MQTTms:
             return False
 
     def _subscribe(self, topic: str, timeout: float = 5.0) -> bool:
-        self.mqtt_handler.subscribe(topic)
-        return bool(self.mqtt_handler.subscription_established.wait(timeout=self.config['mqttms']['mqtt'].get('timeout', timeout)))
+        # acknowledged by the SUBACK of this very subscription
+        return self.mqtt_handler.subscribe(topic)
+
+    def subscribe_many(self, topics: list) -> Dict[str, int]:
+        """
+        Subscribe to 'topics' (topic filters or (topic filter, QoS) tuples) with one SUBSCRIBE packet.
+        Returns the SUBACK reason code per topic: the granted QoS, or 0x80 and higher on failure.
+        """
+        return self.mqtt_handler.subscribe_many(topics)
+
+    def add_connection_listener(self, callback: Callable[[str], None]) -> None:
+        """
+        Register a callback called with the state of the broker connection:
+        'connected', 'disconnected', 'reconnecting' or 'failed'.
+        """
+        self.mqtt_handler.add_connection_listener(callback)
+
+    def publish(self, topic: str, payload:str, qos: Optional[int] = None) -> Future:
+        return self.mqtt_handler.publish_message(topic, payload, qos)
+
+    def broadcast(self, payload, servers: Iterable[str], deadline: Optional[float] = None,
+                  callback: Optional[Callable[[str, dict], None]] = None, priority: int = 0,
+                  timeout: Optional[float] = None) -> Broadcast:
+        """
+        Send an MS command to many servers at once and collect their responses until 'deadline'
+        (time.monotonic()); see MSProtocol.broadcast(). Servers are addressed in 'ms.multi_server' mode.
+        """
+        return self.ms_protocol.broadcast(payload, servers, deadline, callback, priority, timeout)
+
+    def get_metrics(self, baseline: Optional[Dict] = None) -> Dict:
+        """
+        Snapshot of the metrics: counters and their rates, gauges (queue depths, outstanding
+        commands) and histograms (latency, validation and dispatching times). Empty if metrics
+        are disabled. The rates are since 'baseline' (see MetricsRegistry.snapshot()), a
+        dictionary the caller passes to every call, or since the start without it.
+        """
+        return self.metrics.snapshot(baseline) if self.metrics else {}
+
+    def metrics_text(self) -> str:
+        """
+        The metrics in Prometheus text exposition format.
+        """
+        return self.metrics.prometheus_text() if self.metrics else ""
 
-    def publish(self, topic: str, payload:str) -> None:
-        self.mqtt_handler.publish_message(topic,payload)
+    def start_metrics_snapshots(self, callback: Callable[[Dict], None], interval: float = 10.0) -> None:
+        """
+        Call 'callback' with a snapshot of the metrics every 'interval' seconds until graceful_exit().
+        The rates of a snapshot are since the previous one.
+        """
+        if self.metrics:
+            self.metrics.start_snapshots(callback, interval)
 
     def graceful_exit(self) -> None:
+        if self.metrics:
+            self.metrics.stop()
         if self.ms_protocol:
             self.ms_protocol.graceful_exit()
         if self.mqtt_handler:
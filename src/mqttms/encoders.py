@@ -0,0 +1,68 @@
+# encoders.py
+
+import json
+from typing import Any, Callable
+
+from mqttms.logger import get_app_logger
+
+logger = get_app_logger(__name__)
+
+# JSON encoders of command payloads. orjson and msgspec are optional: they are used if installed.
+# Every encoder returns a compact JSON text. int and float dictionary keys are written as JSON
+# strings by all encoders, as stdlib json does. Payloads which can not be encoded raise an
+# exception of the encoder (TypeError, ValueError, msgspec.EncodeError).
+
+Encoder = Callable[[Any], str]
+
+def _json_encoder() -> Encoder:
+    encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    return encoder.encode
+
+def _orjson_encoder() -> Encoder:
+    import orjson  # pylint: disable=import-outside-toplevel
+    dumps = orjson.dumps
+    non_str_keys = orjson.OPT_NON_STR_KEYS
+
+    def encode(obj: Any) -> str:
+        try:
+            return dumps(obj).decode()
+        except TypeError:
+            # orjson refuses non-str dictionary keys without OPT_NON_STR_KEYS, which is slower
+            return dumps(obj, option=non_str_keys).decode()
+
+    return encode
+
+def _msgspec_encoder() -> Encoder:
+    import msgspec  # pylint: disable=import-outside-toplevel
+    encode = msgspec.json.Encoder().encode
+    return lambda obj: encode(obj).decode()
+
+ENCODERS = {
+    "json": _json_encoder,
+    "orjson": _orjson_encoder,
+    "msgspec": _msgspec_encoder,
+}
+
+def get_encoder(name: str = "auto") -> Encoder:
+    """
+    Return the JSON encoder function with the given name.
+
+    'auto' selects the fastest installed encoder (orjson, msgspec, then stdlib json).
+    When the requested encoder is not installed, stdlib json is used.
+    """
+    if name == "auto":
+        for candidate in ("orjson", "msgspec"):
+            try:
+                return ENCODERS[candidate]()
+            except ImportError:
+                continue
+        return _json_encoder()
+
+    factory = ENCODERS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown JSON encoder '{name}'")
+    try:
+        return factory()
+    except ImportError:
+        logger.warning("JSON encoder '%s' is not installed, using json", name)
+        return _json_encoder()
@@ -0,0 +1,336 @@
+# codec.pyx
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+
+# Compiled per-message codec functions of mqttms. They are imported by mqttms/codec.py, which
+# has the pure-Python implementations and the documentation of every function; both must
+# return the same results.
+
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE, PyBUF_WRITABLE
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_GET_SIZE
+
+import binascii
+
+FORMAT_DATA_TYPES = {"BINARY": "base64", "ASCIIHEX": "asciihex", "ASCII": "ascii", "JSON": "object"}
+MS_TOPIC_KINDS = ("RSP", "USL")
+
+# ================================================================
+#  Topics
+# ================================================================
+
+cdef inline Py_ssize_t _find_slash(str topic, Py_ssize_t start, Py_ssize_t length) noexcept:
+    cdef Py_ssize_t i
+    for i in range(start, length):
+        if topic[i] == u'/':
+            return i
+    return -1
+
+def topic_server(str topic):
+    cdef Py_ssize_t length = len(topic)
+    cdef Py_ssize_t first = _find_slash(topic, 0, length)
+    if first < 0:
+        return ''
+    cdef Py_ssize_t second = _find_slash(topic, first + 1, length)
+    if second < 0:
+        return ''
+    return topic[first + 1:second]
+
+def topic_format(str topic):
+    cdef Py_ssize_t length = len(topic)
+    cdef Py_ssize_t slashes = 0
+    cdef Py_ssize_t last = -1
+    cdef Py_ssize_t i
+    for i in range(length):
+        if topic[i] == u'/':
+            slashes += 1
+            last = i
+    if slashes < 3:
+        return None
+    return topic[last + 1:]
+
+def parse_ms_topic(str topic):
+    cdef Py_ssize_t length = len(topic)
+    if length < 4 or topic[0] != u'@' or topic[1] != u'/':
+        return None
+    cdef Py_ssize_t second = _find_slash(topic, 2, length)
+    if second <= 2:
+        return None
+    cdef Py_ssize_t third = _find_slash(topic, second + 1, length)
+    if third < 0 or _find_slash(topic, third + 1, length) >= 0:
+        return None
+    kind = topic[second + 1:third]
+    fmt = topic[third + 1:]
+    if kind not in MS_TOPIC_KINDS or fmt not in FORMAT_DATA_TYPES:
+        return None
+    return topic[2:second], kind, fmt
+
+# ================================================================
+#  ASCIIHEX / base64 decoding into buffers
+# ================================================================
+
+cdef signed char HEX_VALUES[256]
+cdef signed char BASE64_VALUES[256]
+
+cdef void _init_tables():
+    cdef int i
+    for i in range(256):
+        HEX_VALUES[i] = -1
+        BASE64_VALUES[i] = -1
+    for i in range(10):
+        HEX_VALUES[ord('0') + i] = i
+    for i in range(6):
+        HEX_VALUES[ord('a') + i] = 10 + i
+        HEX_VALUES[ord('A') + i] = 10 + i
+    alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+    for i in range(64):
+        BASE64_VALUES[alphabet[i]] = i
+
+_init_tables()
+
+cdef bytes _source(data):
+    # str data must be ASCII, like in binascii
+    if isinstance(data, str):
+        try:
+            return (<str>data).encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError("string argument should contain only ASCII characters")
+    if isinstance(data, bytes):
+        return <bytes>data
+    return bytes(data)
+
+def decode_asciihex_into(data, buffer):
+    cdef bytes data_bytes = _source(data)
+    cdef const unsigned char *source = <const unsigned char *>PyBytes_AS_STRING(data_bytes)
+    cdef Py_ssize_t length = PyBytes_GET_SIZE(data_bytes)
+    cdef Py_ssize_t count = length // 2
+    cdef Py_ssize_t i
+    cdef signed char high, low
+    cdef unsigned char *target
+    cdef Py_buffer view
+    if length % 2:
+        raise binascii.Error("Odd-length string")
+    PyObject_GetBuffer(buffer, &view, PyBUF_SIMPLE | PyBUF_WRITABLE)
+    try:
+        if count > view.len:
+            raise ValueError(f"Buffer of {view.len} bytes is too small for {count} bytes")
+        target = <unsigned char *>view.buf
+        for i in range(count):
+            high = HEX_VALUES[source[2 * i]]
+            low = HEX_VALUES[source[2 * i + 1]]
+            if high < 0 or low < 0:
+                raise binascii.Error("Non-hexadecimal digit found")
+            target[i] = <unsigned char>((high << 4) | low)
+    finally:
+        PyBuffer_Release(&view)
+    return count
+
+def decode_base64_into(data, buffer):
+    cdef bytes data_bytes = _source(data)
+    cdef const unsigned char *source = <const unsigned char *>PyBytes_AS_STRING(data_bytes)
+    cdef Py_ssize_t length = PyBytes_GET_SIZE(data_bytes)
+    cdef Py_ssize_t used = 0
+    cdef Py_ssize_t count, rest, i, j
+    cdef unsigned int quantum
+    cdef signed char value
+    cdef unsigned char *target
+    cdef Py_buffer view
+
+    # padding rules of binascii.a2b_base64(strict_mode=True): the data characters are followed
+    # only by '=', and incomplete quanta are padded by exactly one or two '='
+    while used < length and source[used] != ord('='):
+        used += 1
+    if used == 0 and length > 0:
+        raise binascii.Error("Leading padding not allowed")
+    for i in range(used, length):
+        if source[i] != ord('='):
+            raise binascii.Error("Excess data after padding")
+    rest = used % 4
+    if rest == 1:
+        raise binascii.Error("Invalid base64-encoded string")
+    if (rest == 2 and length - used != 2) or (rest == 3 and length - used != 1):
+        raise binascii.Error("Incorrect padding")
+    count = used // 4 * 3 + (rest - 1 if rest else 0)
+
+    PyObject_GetBuffer(buffer, &view, PyBUF_SIMPLE | PyBUF_WRITABLE)
+    try:
+        if count > view.len:
+            raise ValueError(f"Buffer of {view.len} bytes is too small for {count} bytes")
+        target = <unsigned char *>view.buf
+        j = 0
+        quantum = 0
+        for i in range(used):
+            value = BASE64_VALUES[source[i]]
+            if value < 0:
+                raise binascii.Error("Only base64 data is allowed")
+            quantum = (quantum << 6) | <unsigned int>value
+            if i % 4 == 3:
+                target[j] = <unsigned char>(quantum >> 16)
+                target[j + 1] = <unsigned char>(quantum >> 8)
+                target[j + 2] = <unsigned char>quantum
+                j += 3
+                quantum = 0
+        if rest == 3:
+            target[j] = <unsigned char>(quantum >> 10)
+            target[j + 1] = <unsigned char>(quantum >> 2)
+        elif rest == 2:
+            target[j] = <unsigned char>(quantum >> 4)
+    finally:
+        PyBuffer_Release(&view)
+    return count
+
+# ================================================================
+#  Envelope of MS responses
+# ================================================================
+
+cdef inline Py_ssize_t _skip_space(const unsigned char *text, Py_ssize_t i, Py_ssize_t length) noexcept:
+    while i < length and (text[i] == 32 or text[i] == 9 or text[i] == 10 or text[i] == 13):
+        i += 1
+    return i
+
+cdef Py_ssize_t _skip_string(const unsigned char *text, Py_ssize_t i, Py_ssize_t length) noexcept:
+    # i is at the opening quote; returns the index after the closing quote, -1 if there is none
+    i += 1
+    while i < length:
+        if text[i] == ord('\\'):
+            i += 2
+            continue
+        if text[i] == ord('"'):
+            return i + 1
+        i += 1
+    return -1
+
+cdef Py_ssize_t _skip_value(const unsigned char *text, Py_ssize_t i, Py_ssize_t length) noexcept:
+    # returns the index after the value, -1 for malformed text
+    cdef Py_ssize_t depth = 0
+    cdef unsigned char c
+    if i >= length:
+        return -1
+    c = text[i]
+    if c == ord('"'):
+        return _skip_string(text, i, length)
+    if c == ord('{') or c == ord('['):
+        while i < length:
+            c = text[i]
+            if c == ord('"'):
+                i = _skip_string(text, i, length)
+                if i < 0:
+                    return -1
+                continue
+            if c == ord('{') or c == ord('['):
+                depth += 1
+            elif c == ord('}') or c == ord(']'):
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        return -1
+    # number, true, false or null
+    while i < length:
+        c = text[i]
+        if c == ord(',') or c == ord('}') or c == ord(']') or c == 32 or c == 9 or c == 10 or c == 13:
+            break
+        i += 1
+    return i
+
+cdef inline bint _is_key(const unsigned char *text, Py_ssize_t start, Py_ssize_t end, const char *key) noexcept:
+    cdef Py_ssize_t i
+    for i in range(end - start):
+        if key[i] == 0 or text[start + i] != <unsigned char>key[i]:
+            return False
+    return key[end - start] == 0
+
+cdef object _plain_string(const unsigned char *text, Py_ssize_t start, Py_ssize_t end):
+    # content of a string value without escapes, None if it has any
+    cdef Py_ssize_t i
+    for i in range(start, end):
+        if text[i] == ord('\\'):
+            return None
+    return (<const char *>text)[start:end].decode('utf-8')
+
+def response_envelope(payload):
+    cdef bytes payload_bytes
+    if isinstance(payload, str):
+        payload_bytes = (<str>payload).encode('utf-8')
+    elif isinstance(payload, bytes):
+        payload_bytes = <bytes>payload
+    else:
+        payload_bytes = bytes(payload)
+    cdef const unsigned char *text = <const unsigned char *>PyBytes_AS_STRING(payload_bytes)
+    cdef Py_ssize_t length = PyBytes_GET_SIZE(payload_bytes)
+    cdef Py_ssize_t i = _skip_space(text, 0, length)
+    cdef Py_ssize_t key_start, key_end, value_start, value_end, k
+    cdef bint negative
+    cdef long long number
+    cid = None
+    server = None
+    response = None
+
+    if i >= length or text[i] != ord('{'):
+        return None
+    i = _skip_space(text, i + 1, length)
+    if i < length and text[i] == ord('}'):
+        return (cid, server, response)
+
+    while True:
+        # key
+        if i >= length or text[i] != ord('"'):
+            return None
+        key_start = i + 1
+        i = _skip_string(text, i, length)
+        if i < 0:
+            return None
+        key_end = i - 1
+        for k in range(key_start, key_end):
+            if text[k] == ord('\\'):
+                # escaped keys are left to the full parse
+                return None
+        i = _skip_space(text, i, length)
+        if i >= length or text[i] != ord(':'):
+            return None
+        i = _skip_space(text, i + 1, length)
+
+        # value
+        value_start = i
+        i = _skip_value(text, i, length)
+        if i < 0 or i == value_start:
+            return None
+        value_end = i
+        if _is_key(text, key_start, key_end, b"cid"):
+            cid = None
+            k = value_start
+            negative = text[k] == ord('-')
+            if negative:
+                k += 1
+            if k == value_end:
+                return None
+            number = 0
+            while k < value_end:
+                if text[k] < ord('0') or text[k] > ord('9'):
+                    # not an integer literal, e.g. 1.0 or a string; left to the full parse
+                    if text[k] == ord('.') or text[k] == ord('e') or text[k] == ord('E'):
+                        return None
+                    break
+                if k - value_start > 15:
+                    return None
+                number = number * 10 + (text[k] - ord('0'))
+                k += 1
+            else:
+                cid = -number if negative else number
+        elif _is_key(text, key_start, key_end, b"server") or _is_key(text, key_start, key_end, b"response"):
+            value = None
+            if text[value_start] == ord('"'):
+                value = _plain_string(text, value_start + 1, value_end - 1)
+                if value is None:
+                    return None
+            if text[key_start] == ord('s'):
+                server = value
+            else:
+                response = value
+
+        i = _skip_space(text, i, length)
+        if i >= length:
+            return None
+        if text[i] == ord('}'):
+            return (cid, server, response)
+        if text[i] != ord(','):
+            return None
+        i = _skip_space(text, i + 1, length)
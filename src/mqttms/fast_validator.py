@@ -0,0 +1,49 @@
+# fast_validator.py
+
+import re
+from typing import Any
+
+# Hand-compiled equivalent of MSProtocol.response_schema. It checks the fixed response
+# shape (cid/server/response/dataType/data) with plain Python and precompiled patterns.
+
+_RESPONSE_KEYS = frozenset(("cid", "server", "response", "dataType", "data"))
+
+_SERVER_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-4[0-9a-fA-F]{3}-[89abAB][0-9a-fA-F]{3}-[0-9a-fA-F]{12}")
+_RESPONSE_PATTERN = re.compile(r"[A-Z]{2}")
+
+_DATA_PATTERNS = {
+    "asciihex": re.compile(r"[0-9a-fA-F]*"),
+    "ascii": re.compile(r"[\x20-\x7E]*"),
+    "base64": re.compile(r"(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?"),
+}
+
+def is_valid_response(data: Any) -> bool:
+    """
+    Return True if 'data' is a valid MS response.
+
+    The check is stricter than the JSON schema in corner cases (e.g. an integral float as cid),
+    so a False result should be confirmed by the full validator before rejecting the response.
+    """
+    if type(data) is not dict or data.keys() != _RESPONSE_KEYS:
+        return False
+
+    cid = data["cid"]
+    if type(cid) is not int or not 0 <= cid <= 999:
+        return False
+
+    server = data["server"]
+    if type(server) is not str or not _SERVER_PATTERN.fullmatch(server):
+        return False
+
+    response = data["response"]
+    if type(response) is not str or not _RESPONSE_PATTERN.fullmatch(response):
+        return False
+
+    payload = data["data"]
+    data_type = data["dataType"]
+    if data_type == "object":
+        return type(payload) is dict
+    pattern = _DATA_PATTERNS.get(data_type)
+    if pattern is None:
+        return False
+    return type(payload) is str and pattern.fullmatch(payload) is not None
@@ -1,5 +1,5 @@
 # logger/logger_module.py
 
-from .logger_module import setup_logging, get_app_logger, StringHandler, enable_string_handler, disable_string_handler, get_string_logs, clear_string_logs
+from .logger_module import setup_logging, get_app_logger, StringHandler, enable_string_handler, disable_string_handler, get_string_logs, clear_string_logs, get_trace_logger, enable_trace, disable_trace, is_trace_enabled, LogSampler, stop_queue_listener
 
-__all__ = ["get_app_logger", "setup_logging", "StringHandler", "enable_string_handler", "disable_string_handler", "get_string_logs", "clear_string_logs"]
+__all__ = ["get_app_logger", "setup_logging", "StringHandler", "enable_string_handler", "disable_string_handler", "get_string_logs", "clear_string_logs", "get_trace_logger", "enable_trace", "disable_trace", "is_trace_enabled", "LogSampler", "stop_queue_listener"]
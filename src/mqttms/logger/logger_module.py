@@ -2,9 +2,13 @@
 
 # logger_module.py
 import sys
+import atexit
+import queue
 import logging
-import colorama
-from typing import Optional
+import itertools
+import collections
+import logging.handlers
+from typing import Dict, Optional
 from datetime import datetime
 
 TAGNAME = "invoices"
@@ -64,8 +68,15 @@ if not hasattr(logging, "VERBOSE"):
             self._log(VERBOSE_LEVEL, msg, args, **kwargs)
     logging.Logger.verbose = verbose
 
-# Initialize colorama for Windows ANSI support
-colorama.init()
+# colorama (Windows ANSI support) is initialized by setup_logging(), so importing does not wrap stdout
+_colorama_initialized = False
+
+def init_colorama() -> None:
+    global _colorama_initialized  # pylint: disable=global-statement
+    if not _colorama_initialized:
+        import colorama  # pylint: disable=import-outside-toplevel
+        colorama.init()
+        _colorama_initialized = True
 
 # ================================================================
 #  Color map
@@ -107,24 +118,44 @@ class ColorFormatter(logging.Formatter):
 #  String handler (optional)
 # ================================================================
 class StringHandler(logging.Handler):
-    """Stores logs in an internal buffer with enable/disable control."""
+    """
+    Stores logs in an internal ring buffer with enable/disable control.
+    The buffer keeps the newest 'max_records' records and, if 'max_bytes' is given,
+    not more than 'max_bytes' bytes (UTF-8) of them; older records are discarded.
+    """
 
-    def __init__(self, level=logging.INFO):
+    def __init__(self, level=logging.INFO, max_records: int = 10000, max_bytes: Optional[int] = None):
         super().__init__(level)
-        self.buffer : list[str]= []
+        self.buffer: collections.deque[str] = collections.deque(maxlen=max_records)
+        self.max_bytes = max_bytes
+        self.size = 0
         self.enabled = True  # can disable storing without affecting normal logging
 
     def emit(self, record: logging.LogRecord):
-        if self.enabled:
-            self.buffer.append(self.format(record))
+        if not self.enabled:
+            return
+        entry = self.format(record)
+        if self.max_bytes is None:
+            self.buffer.append(entry)
+            return
+        # emit() is called with the handler lock held, the size is updated consistently
+        if len(self.buffer) == self.buffer.maxlen:
+            self.size -= len(self.buffer[0].encode())
+        self.buffer.append(entry)
+        self.size += len(entry.encode())
+        while self.size > self.max_bytes and self.buffer:
+            self.size -= len(self.buffer.popleft().encode())
 
     def get_logs(self) -> str:
         """Return all stored logs as a single string."""
-        return "\n".join(self.buffer)
+        with self.lock:
+            return "\n".join(self.buffer)
 
     def clear_logs(self) -> None:
         """Clear the buffer."""
-        self.buffer.clear()
+        with self.lock:
+            self.buffer.clear()
+            self.size = 0
 
     def disable(self) -> None:
         self.enabled = False
@@ -133,6 +164,9 @@ class StringHandler(logging.Handler):
         self.enabled = True
 
 string_handler_instance = None  # global to reuse
+# queue mode: records are put into a queue on the logging thread and handled by a listener thread
+queue_handler_instance: Optional[logging.handlers.QueueHandler] = None
+queue_listener_instance: Optional[logging.handlers.QueueListener] = None
 
 # ================================================================
 #  Main setup function (no duplicate handlers)
@@ -140,10 +174,16 @@ string_handler_instance = None  # global to reuse
 def setup_logging(verbosity: int = 3,
                   log_prefix: bool = True,
                   use_color: bool = True,
-                  use_string_handler: bool = False):
+                  use_string_handler: bool = False,
+                  use_queue_handler: bool = False,
+                  string_max_records: int = 10000,
+                  string_max_bytes: Optional[int] = None):
     """
     Configure logging with custom levels, prefix toggle, color output,
     and optional string handler.
+
+    With use_queue_handler the logging threads (e.g. the MQTT network thread) only put records
+    into a queue; formatting, coloring and writing to stdout are done by a listener thread.
     """
 
     # -----------------------------------------
@@ -161,6 +201,10 @@ def setup_logging(verbosity: int = 3,
 
     level = LEVELS.get(verbosity, logging.INFO)
 
+    # before looking for the handler of sys.stdout, which colorama may wrap
+    if use_color:
+        init_colorama()
+
     root = logging.getLogger()
     root.setLevel(level)
 
@@ -172,6 +216,9 @@ def setup_logging(verbosity: int = 3,
     # -----------------------------------------
     # STREAM HANDLER (stdout) — avoid duplicates
     # -----------------------------------------
+    # the handlers may be attached to the listener of a previous queue mode setup
+    stop_queue_listener()
+
     console_handler = None
     for h in root.handlers:
         if isinstance(h, logging.StreamHandler) and getattr(h, "stream", None) is sys.stdout:
@@ -192,14 +239,48 @@ def setup_logging(verbosity: int = 3,
 
     if use_string_handler:
         if string_handler_instance is None:
-            string_handler_instance = StringHandler(level)
+            string_handler_instance = StringHandler(level, max_records=string_max_records, max_bytes=string_max_bytes)
             root.addHandler(string_handler_instance)
 
         string_handler_instance.setLevel(level)
         string_handler_instance.setFormatter(formatter)
 
+    # -----------------------------------------
+    # QUEUE HANDLER — optional, moves the handlers to a listener thread
+    # -----------------------------------------
+    if use_queue_handler:
+        global queue_handler_instance, queue_listener_instance
+        handlers = [h for h in (console_handler, string_handler_instance) if h is not None]
+        for h in handlers:
+            root.removeHandler(h)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler_instance = logging.handlers.QueueHandler(log_queue)
+        root.addHandler(queue_handler_instance)
+        queue_listener_instance = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        queue_listener_instance.start()
+
     return string_handler_instance
 
+def stop_queue_listener() -> None:
+    """
+    Stop the listener thread of the queue mode, after it has handled all queued records,
+    and attach its handlers to the root logger again.
+    """
+    global queue_handler_instance, queue_listener_instance
+    if queue_listener_instance is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(queue_handler_instance)
+    queue_listener_instance.stop()
+    for h in queue_listener_instance.handlers:
+        root.addHandler(h)
+    queue_handler_instance = None
+    queue_listener_instance = None
+
+# queued records are written out on interpreter exit
+atexit.register(stop_queue_listener)
+
 def get_app_logger(area_tag: str) -> logging.Logger:
     """
     Returns a logger for a given module/area tag.
@@ -211,6 +292,72 @@ def get_app_logger(area_tag: str) -> logging.Logger:
     # Do not set level here; inherit from root
     return lg
 
+# ================================================================
+#  Per-message trace channel, toggled at runtime
+# ================================================================
+TRACE_LOGGER_NAME = "mqttms.trace"
+# the channel is off until enable_trace(); records are logged at DEBUG level
+_trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+_trace_logger.setLevel(logging.CRITICAL + 1)
+_trace_handler: Optional[logging.Handler] = None
+
+def get_trace_logger() -> logging.Logger:
+    """
+    Returns the logger of the per-message trace channel. Callers guard their calls with
+    trace_logger.isEnabledFor(logging.DEBUG), so the channel costs nothing while it is off.
+    """
+    return _trace_logger
+
+def enable_trace(handler: Optional[logging.Handler] = None) -> None:
+    """
+    Switch the trace channel on. Without 'handler' the records go to the root handlers,
+    which show them at verbosity 6 (DEBUG). With 'handler' they go only to it,
+    whatever the verbosity of the application.
+    """
+    global _trace_handler
+    disable_trace()
+    if handler is not None:
+        _trace_handler = handler
+        _trace_logger.addHandler(handler)
+        _trace_logger.propagate = False
+    _trace_logger.setLevel(logging.DEBUG)
+
+def disable_trace() -> None:
+    global _trace_handler
+    _trace_logger.setLevel(logging.CRITICAL + 1)
+    if _trace_handler is not None:
+        _trace_logger.removeHandler(_trace_handler)
+        _trace_handler = None
+    _trace_logger.propagate = True
+
+def is_trace_enabled() -> bool:
+    return _trace_logger.isEnabledFor(logging.DEBUG)
+
+# ================================================================
+#  Sampled logging of high-rate messages
+# ================================================================
+class LogSampler:
+    """
+    Decides which messages of a high-rate stream are logged: 1 in 'every' messages,
+    counted per key (e.g. per topic). 'every' 1 logs all messages.
+    """
+
+    def __init__(self, every: int = 1, key_every: Optional[Dict[str, int]] = None):
+        self.every = max(every, 1)
+        # sampling rates of particular keys, overriding 'every'
+        self.key_every = dict(key_every or {})
+        self.counters: Dict[str, itertools.count] = {}
+
+    def sample(self, key: str = "") -> bool:
+        every = self.key_every.get(key, self.every)
+        if every <= 1:
+            return True
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters.setdefault(key, itertools.count())
+        # next() of itertools.count is atomic, so concurrent callers do not need a lock
+        return next(counter) % every == 0
+
 def disable_string_handler() -> None:
     if string_handler_instance:
         string_handler_instance.disable()
@@ -0,0 +1,443 @@
+# loopback.py
+
+import heapq
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from mqttms.topic_router import TopicRouter
+
+from mqttms.logger import get_app_logger
+
+logger = get_app_logger(__name__)
+
+# In-process MQTT broker and client for broker-free testing and benchmarking.
+#
+# LoopbackClient implements the part of the paho.mqtt.client.Client interface used by MQTTHandler
+# (callback API version 2): connect / connect_async / reconnect / disconnect, loop / loop_start /
+# loop_stop, publish, subscribe, unsubscribe and the on_* callbacks, which run in the thread calling
+# loop(), like in paho. Clients of the same LoopbackBroker exchange messages with MQTT topic matching,
+# SUBACK / PUBACK acknowledgments and an optional injected latency and loss.
+#
+# Not simulated: retained messages, wills, persistent sessions, QoS 2 handshakes (QoS 1 and 2 are
+# acknowledged once, after a round trip) and packet size limits.
+
+# return codes, with the values of paho.mqtt.client
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_CONN_LOST = 7
+
+# reason code of an unexpected disconnection (MQTT 5 'Unspecified error')
+REASON_UNSPECIFIED_ERROR = 128
+
+class ConnectFlags:
+    __slots__ = ("session_present",)
+
+    def __init__(self, session_present: bool = False):
+        self.session_present = session_present
+
+class DisconnectFlags:
+    __slots__ = ("is_disconnect_packet_from_server",)
+
+    def __init__(self, from_server: bool = False):
+        self.is_disconnect_packet_from_server = from_server
+
+class LoopbackMessage:
+    __slots__ = ("topic", "payload", "qos", "retain", "mid")
+
+    def __init__(self, topic: str, payload: bytes, qos: int, mid: int = 0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = False
+        self.mid = mid
+
+class LoopbackMessageInfo:
+    """Result of LoopbackClient.publish(), like paho's MQTTMessageInfo."""
+    __slots__ = ("rc", "mid")
+
+    def __init__(self, rc: int, mid: int):
+        self.rc = rc
+        self.mid = mid
+
+class LoopbackBroker:
+    """
+    In-memory MQTT broker.
+
+    'latency' (seconds) is the delay of every hop between a client and the broker, plus a random
+    part up to 'jitter': acknowledgments arrive after a round trip, messages reach the subscribers
+    after two hops. 'loss' (0..1) is the probability that a QoS 0 message is not delivered to a
+    subscriber; QoS 1 and 2 messages are always delivered. 'max_qos' limits the granted QoS of
+    subscriptions, and filters in 'refused' are refused with reason code 0x87 (not authorized).
+    With 'seed' the jitter and loss are reproducible.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, loss: float = 0.0, max_qos: int = 2,
+                 refused: Optional[List[str]] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.max_qos = max_qos
+        self.refused = set(refused or [])
+        self.rng = random.Random(seed)
+        # new connections are refused while False, e.g. to test reconnecting
+        self.accepting = True
+        self.clients: Dict[str, "LoopbackClient"] = {}
+        # topic filter -> subscribing clients, matched with the trie of TopicRouter
+        self.router = TopicRouter()
+        self.lock = threading.Lock()
+        self.stats = {"published": 0, "delivered": 0, "lost": 0}
+
+    def hop_delay(self) -> float:
+        # called with the lock held, the rng is shared
+        if self.jitter:
+            return self.latency + self.rng.uniform(0, self.jitter)
+        return self.latency
+
+    def attach(self, client: "LoopbackClient") -> None:
+        if not self.accepting:
+            raise ConnectionRefusedError(f"Loopback broker refuses the connection of '{client.client_id}'")
+        with self.lock:
+            previous = self.clients.get(client.client_id)
+            self.clients[client.client_id] = client
+        # a client id connects once; the previous connection is taken over
+        if previous is not None and previous is not client:
+            previous.connection_lost()
+
+    def detach(self, client: "LoopbackClient") -> None:
+        with self.lock:
+            if self.clients.get(client.client_id) is client:
+                del self.clients[client.client_id]
+            # clean session: the subscriptions end with the connection
+            for topic_filter, subscription in client.subscriptions.items():
+                self.router.remove_route(topic_filter, subscription)
+        client.subscriptions = {}
+
+    def subscribe(self, client: "LoopbackClient", subscriptions: List[Tuple[str, int]]) -> Tuple[List[int], float]:
+        """
+        Register the subscriptions of 'client'. Returns the reason codes and the delay of the SUBACK.
+        """
+        codes = []
+        with self.lock:
+            for topic_filter, qos in subscriptions:
+                if topic_filter in self.refused:
+                    codes.append(0x87)
+                    continue
+                try:
+                    TopicRouter._check_filter(topic_filter)  # pylint: disable=protected-access
+                except ValueError:
+                    # 'Topic Filter invalid'
+                    codes.append(0x8F)
+                    continue
+                granted = min(qos, self.max_qos)
+                previous = client.subscriptions.get(topic_filter)
+                if previous is not None:
+                    self.router.remove_route(topic_filter, previous)
+                subscription = _Subscription(client, granted)
+                client.subscriptions[topic_filter] = subscription
+                self.router.add_route(topic_filter, subscription)
+                codes.append(granted)
+            delay = self.hop_delay() + self.hop_delay()
+        return codes, delay
+
+    def unsubscribe(self, client: "LoopbackClient", topic_filters: List[str]) -> float:
+        with self.lock:
+            for topic_filter in topic_filters:
+                subscription = client.subscriptions.pop(topic_filter, None)
+                if subscription is not None:
+                    self.router.remove_route(topic_filter, subscription)
+            return self.hop_delay() + self.hop_delay()
+
+    def publish(self, topic: str, payload: bytes, qos: int) -> float:
+        """
+        Deliver a message to the matching subscribers. Returns the delay of the PUBACK.
+        """
+        deliveries = []
+        with self.lock:
+            self.stats["published"] += 1
+            inbound = self.hop_delay()
+            # one delivery per client, with the highest QoS of its matching subscriptions
+            granted: Dict[LoopbackClient, int] = {}
+            for subscription in self.router.match(topic):
+                if granted.get(subscription.client, -1) < subscription.qos:
+                    granted[subscription.client] = subscription.qos
+            for client, subscription_qos in granted.items():
+                delivery_qos = min(qos, subscription_qos)
+                if delivery_qos == 0 and self.loss and self.rng.random() < self.loss:
+                    self.stats["lost"] += 1
+                    continue
+                self.stats["delivered"] += 1
+                deliveries.append((client, delivery_qos, inbound + self.hop_delay()))
+            ack_delay = inbound + self.hop_delay()
+
+        for client, delivery_qos, delay in deliveries:
+            client.deliver(LoopbackMessage(topic, payload, delivery_qos), delay)
+        return ack_delay
+
+    def connack_delay(self) -> float:
+        with self.lock:
+            return self.hop_delay() + self.hop_delay()
+
+    def drop_connections(self) -> None:
+        """
+        Close the connections of all clients as if the network failed.
+        """
+        with self.lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            client.connection_lost()
+
+class _Subscription:
+    __slots__ = ("client", "qos")
+
+    def __init__(self, client: "LoopbackClient", qos: int):
+        self.client = client
+        self.qos = qos
+
+# named brokers shared by the clients of one process
+_brokers: Dict[str, LoopbackBroker] = {}
+_brokers_lock = threading.Lock()
+
+def get_broker(name: str = "default", **options: Any) -> LoopbackBroker:
+    """
+    Return the broker 'name', creating it with 'options' (see LoopbackBroker) on first use.
+    The options of later calls are ignored.
+    """
+    with _brokers_lock:
+        broker = _brokers.get(name)
+        if broker is None:
+            broker = LoopbackBroker(**options)
+            _brokers[name] = broker
+        return broker
+
+def remove_broker(name: str = "default") -> None:
+    with _brokers_lock:
+        _brokers.pop(name, None)
+
+class LoopbackClient:
+    """
+    Client of a LoopbackBroker with the interface of paho.mqtt.client.Client used by MQTTHandler.
+    """
+
+    def __init__(self, broker: LoopbackBroker, client_id: str = ""):
+        self.broker = broker
+        self.client_id = client_id or f"loopback-{id(self):x}"
+        self.username: Optional[str] = None
+        self.password: Optional[str] = None
+        self.connected = False
+        # set when the connection is lost, until loop() reports it
+        self.lost = False
+        self.subscriptions: Dict[str, _Subscription] = {}
+
+        # events to be handled by loop(): heap of (due time, sequence, kind, arguments)
+        self.events: list = []
+        self.sequence = 0
+        # due time of the last event, so as the events are handled in order of sending
+        self.last_due = 0.0
+        self.condition = threading.Condition()
+        self.mid = 0
+        self.mid_lock = threading.Lock()
+
+        self.loop_thread: Optional[threading.Thread] = None
+        self.loop_stop_event = threading.Event()
+
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_subscribe = None
+        self.on_unsubscribe = None
+        self.on_publish = None
+        self.on_message = None
+        self.on_socket_register_write = None
+        self.on_socket_unregister_write = None
+
+    def username_pw_set(self, username: Optional[str], password: Optional[str] = None) -> None:
+        self.username = username
+        self.password = password
+
+    def next_mid(self) -> int:
+        with self.mid_lock:
+            self.mid = self.mid % 65535 + 1
+            return self.mid
+
+    def post(self, kind: str, args: tuple, delay: float = 0.0) -> None:
+        with self.condition:
+            due = max(time.monotonic() + delay, self.last_due)
+            self.last_due = due
+            self.sequence += 1
+            heapq.heappush(self.events, (due, self.sequence, kind, args))
+            self.condition.notify()
+
+    def deliver(self, message: LoopbackMessage, delay: float) -> None:
+        if self.connected:
+            self.post("message", (message,), delay)
+
+    # ---- connection ----
+
+    def connect(self, host: str = "", port: int = 0, keepalive: int = 60, **kwargs: Any) -> int:
+        return self.reconnect()
+
+    def connect_async(self, host: str = "", port: int = 0, keepalive: int = 60, **kwargs: Any) -> None:
+        # the connection is made by reconnect(), called by the network loop
+        pass
+
+    def reconnect(self) -> int:
+        self.broker.attach(self)
+        self.connected = True
+        self.lost = False
+        self.post("connack", (), self.broker.connack_delay())
+        return MQTT_ERR_SUCCESS
+
+    def disconnect(self, *args: Any, **kwargs: Any) -> int:
+        if not self.connected:
+            return MQTT_ERR_NO_CONN
+        self.connected = False
+        self.broker.detach(self)
+        self.post("disconnect", (0,))
+        return MQTT_ERR_SUCCESS
+
+    def connection_lost(self) -> None:
+        if not self.connected:
+            return
+        self.connected = False
+        self.lost = True
+        self.broker.detach(self)
+        self.post("disconnect", (REASON_UNSPECIFIED_ERROR,))
+
+    # ---- messages ----
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False, properties: Any = None) -> LoopbackMessageInfo:
+        if not topic or '+' in topic or '#' in topic:
+            raise ValueError("Invalid topic.")
+        if qos not in (0, 1, 2):
+            raise ValueError("Invalid QoS level.")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode("ascii")
+        elif payload is None:
+            payload = b""
+        else:
+            payload = bytes(payload)
+
+        mid = self.next_mid()
+        if not self.connected:
+            return LoopbackMessageInfo(MQTT_ERR_NO_CONN, mid)
+        ack_delay = self.broker.publish(topic, payload, qos)
+        # QoS 0 is complete when sent, QoS 1 and 2 when acknowledged by the broker
+        self.post("puback", (mid, 0), ack_delay if qos else 0.0)
+        return LoopbackMessageInfo(MQTT_ERR_SUCCESS, mid)
+
+    def subscribe(self, topic: Any, qos: int = 0, options: Any = None, properties: Any = None) -> Tuple[int, int]:
+        # a topic filter, a (topic filter, qos) tuple or a list of tuples, like in paho
+        if isinstance(topic, str):
+            subscriptions = [(topic, qos)]
+        elif isinstance(topic, tuple):
+            subscriptions = [(topic[0], topic[1])]
+        else:
+            subscriptions = [(item[0], item[1]) for item in topic]
+        mid = self.next_mid()
+        if not self.connected:
+            return MQTT_ERR_NO_CONN, mid
+        codes, delay = self.broker.subscribe(self, subscriptions)
+        self.post("suback", (mid, codes), delay)
+        return MQTT_ERR_SUCCESS, mid
+
+    def unsubscribe(self, topic: Any, properties: Any = None) -> Tuple[int, int]:
+        topics = [topic] if isinstance(topic, str) else list(topic)
+        mid = self.next_mid()
+        if not self.connected:
+            return MQTT_ERR_NO_CONN, mid
+        # 0x11: no subscription existed, which is what a broker answers for unknown filters
+        codes = [0 if topic in self.subscriptions else 0x11 for topic in topics]
+        delay = self.broker.unsubscribe(self, topics)
+        self.post("unsuback", (mid, codes), delay)
+        return MQTT_ERR_SUCCESS, mid
+
+    # ---- network loop ----
+
+    def loop(self, timeout: float = 1.0) -> int:
+        """
+        Handle the events which are due, waiting for the first one not longer than 'timeout'.
+        Returns MQTT_ERR_SUCCESS, or MQTT_ERR_CONN_LOST / MQTT_ERR_NO_CONN without a connection.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.events and self.events[0][0] <= now:
+                    break
+                if not self.connected and not self.events:
+                    break
+                wait = deadline - now
+                if self.events:
+                    wait = min(wait, self.events[0][0] - now)
+                if wait <= 0:
+                    break
+                self.condition.wait(wait)
+            due = []
+            now = time.monotonic()
+            while self.events and self.events[0][0] <= now:
+                due.append(heapq.heappop(self.events))
+
+        for _, _, kind, args in due:
+            self.handle_event(kind, args)
+
+        if self.connected:
+            return MQTT_ERR_SUCCESS
+        if self.events:
+            # the remaining events (e.g. the disconnection) are handled by the next call
+            return MQTT_ERR_SUCCESS
+        if self.lost:
+            self.lost = False
+            return MQTT_ERR_CONN_LOST
+        return MQTT_ERR_NO_CONN
+
+    def handle_event(self, kind: str, args: tuple) -> None:
+        if kind == "message":
+            if self.on_message and self.connected:
+                self.on_message(self, None, args[0])
+        elif kind == "puback":
+            if self.on_publish:
+                self.on_publish(self, None, args[0], args[1], None)
+        elif kind == "suback":
+            if self.on_subscribe:
+                self.on_subscribe(self, None, args[0], args[1], None)
+        elif kind == "unsuback":
+            if self.on_unsubscribe:
+                self.on_unsubscribe(self, None, args[0], args[1], None)
+        elif kind == "connack":
+            if self.on_connect and self.connected:
+                self.on_connect(self, None, ConnectFlags(False), 0, None)
+        elif kind == "disconnect":
+            if self.on_disconnect:
+                self.on_disconnect(self, None, DisconnectFlags(False), args[0], None)
+
+    def loop_start(self) -> None:
+        if self.loop_thread is not None:
+            return
+        self.loop_stop_event.clear()
+        self.loop_thread = threading.Thread(target=self.loop_forever_runner, daemon=True)
+        self.loop_thread.start()
+
+    def loop_stop(self) -> None:
+        if self.loop_thread is None:
+            return
+        self.loop_stop_event.set()
+        with self.condition:
+            self.condition.notify()
+        self.loop_thread.join()
+        self.loop_thread = None
+
+    def loop_forever_runner(self) -> None:
+        # like paho's loop_start(): a lost connection is made again after a second
+        while not self.loop_stop_event.is_set():
+            rc = self.loop(timeout=0.1)
+            if rc == MQTT_ERR_CONN_LOST and not self.loop_stop_event.wait(1.0):
+                try:
+                    self.reconnect()
+                except OSError as e:
+                    logger.warning("Loopback reconnecting failed: %s", e)
+                    self.lost = True
+            elif rc == MQTT_ERR_NO_CONN:
+                self.loop_stop_event.wait(0.1)
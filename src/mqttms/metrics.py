@@ -0,0 +1,288 @@
+# metrics.py
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from mqttms.logger import get_app_logger
+
+logger = get_app_logger(__name__)
+
+# Buckets (seconds) of command round trips
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Buckets (seconds) of in-process steps like validation and topic matching
+FAST_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2)
+
+class Counter:
+    def __init__(self, name: str, help_text: str = ""):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+class Gauge:
+    """
+    Gauge with a value set by set(), or read from 'function' at collection time.
+    """
+
+    def __init__(self, name: str, help_text: str = "", function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help_text
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:  # pylint: disable=broad-exception-caught
+                return float('nan')
+        return self._value
+
+class Histogram:
+    def __init__(self, name: str, help_text: str = "", buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # the last count is of the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the q-quantile (0..1) by linear interpolation within the bucket that contains it.
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    # above the last bound, nothing better than the bound itself
+                    return self.buckets[-1]
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+            total_sum = self.sum
+        return {
+            "count": total,
+            "sum": total_sum,
+            "avg": total_sum / total if total else 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts)),
+        }
+
+class MetricsRegistry:
+    """
+    Registry of the metrics of one MQTTms instance.
+
+    Metrics are read with snapshot(), exported in Prometheus text format with prometheus_text()
+    or by a local HTTP endpoint (start_http_server), or pushed periodically to a callback
+    (start_snapshots).
+    """
+
+    def __init__(self, prefix: str = "mqttms_"):
+        self.prefix = prefix
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+        # rates of snapshots without a baseline of their own are since this time
+        self.created = time.monotonic()
+        self.http_server = None
+        self.snapshot_thread: Optional[threading.Thread] = None
+        self.snapshot_stop = threading.Event()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        name = self.prefix + name
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' is already registered as {type(metric).__name__}")
+            return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str = "", function: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._get_or_create(Gauge, name, help_text)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name: str, help_text: str = "", buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def snapshot(self, baseline: Optional[Dict] = None) -> Dict:
+        """
+        Return the current values of all metrics. Rates of the counters are per second since
+        'baseline', a dictionary kept by the caller and updated by the call (an empty one at the
+        first call), so as every consumer has its own interval. Without a baseline the rates are
+        since the registry was created and the snapshot changes no state.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        now = time.monotonic()
+        last_time = baseline.get("time", self.created) if baseline is not None else self.created
+        last_counters = baseline.get("counters", {}) if baseline is not None else {}
+        elapsed = max(now - last_time, 1e-9)
+
+        result: Dict[str, Dict] = {"counters": {}, "rates": {}, "gauges": {}, "histograms": {}}
+        for metric in metrics:
+            if isinstance(metric, Counter):
+                value = metric.value
+                result["counters"][metric.name] = value
+                result["rates"][metric.name] = (value - last_counters.get(metric.name, 0)) / elapsed
+            elif isinstance(metric, Gauge):
+                result["gauges"][metric.name] = metric.value
+            elif isinstance(metric, Histogram):
+                result["histograms"][metric.name] = metric.snapshot()
+        if baseline is not None:
+            baseline["time"] = now
+            baseline["counters"] = dict(result["counters"])
+        return result
+
+    def prometheus_text(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            if isinstance(metric, Counter):
+                lines.append(f"# TYPE {metric.name} counter")
+                lines.append(f"{metric.name} {metric.value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"# TYPE {metric.name} gauge")
+                lines.append(f"{metric.name} {metric.value}")
+            elif isinstance(metric, Histogram):
+                with metric.lock:
+                    counts = list(metric.counts)
+                    total = metric.count
+                    total_sum = metric.sum
+                lines.append(f"# TYPE {metric.name} histogram")
+                cumulative = 0
+                for bound, count in zip(metric.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{metric.name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric.name}_bucket{{le="+Inf"}} {total}')
+                lines.append(f"{metric.name}_sum {total_sum}")
+                lines.append(f"{metric.name}_count {total}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> Tuple[str, int]:
+        """
+        Serve prometheus_text() on http://host:port/metrics. Returns the bound address.
+        """
+        # http.server is imported only when the endpoint is enabled
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # pylint: disable=import-outside-toplevel
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                if self.path.split('?')[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:  # pylint: disable=redefined-builtin
+                logger.debug("metrics http: " + format, *args)
+
+        self.http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        address = self.http_server.server_address
+        logger.info("Metrics endpoint at http://%s:%d/metrics", address[0], address[1])
+        return address[0], address[1]
+
+    def start_snapshots(self, callback: Callable[[Dict], None], interval: float) -> None:
+        """
+        Call 'callback' with snapshot() every 'interval' seconds. The rates are since the previous
+        call of the callback.
+        """
+        def runner() -> None:
+            baseline: Dict = {}
+            while not self.snapshot_stop.wait(interval):
+                try:
+                    callback(self.snapshot(baseline))
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.error("Metrics snapshot callback failed: %s", e)
+
+        self.snapshot_stop.clear()
+        self.snapshot_thread = threading.Thread(target=runner, daemon=True)
+        self.snapshot_thread.start()
+
+    def stop(self) -> None:
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        if self.snapshot_thread is not None:
+            self.snapshot_stop.set()
+            self.snapshot_thread.join()
+            self.snapshot_thread = None
+
+class _NullMetric:
+    """Metric which records nothing; used by objects not attached to a registry."""
+
+    value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+class NullMetricsRegistry:
+    _metric = _NullMetric()
+
+    def counter(self, name: str, help_text: str = "") -> _NullMetric:
+        return self._metric
+
+    def gauge(self, name: str, help_text: str = "", function: Optional[Callable[[], float]] = None) -> _NullMetric:
+        return self._metric
+
+    def histogram(self, name: str, help_text: str = "", buckets: Sequence[float] = LATENCY_BUCKETS) -> _NullMetric:
+        return self._metric
+
+NULL_METRICS = NullMetricsRegistry()
@@ -1,18 +1,36 @@
 # mqtt_dispatcher.py
 
 import re
+import logging
 from typing import Dict, Tuple
 from mqttms.abstract_dispatcher import AbstractMQTTDispatcher
 from mqttms.ms_protocol import MSProtocol
 
-from mqttms.logger import get_app_logger
+from mqttms.logger import get_app_logger, get_trace_logger
 
 logger = get_app_logger(__name__)
+trace_logger = get_trace_logger()
 
 class MQTTDispatcher(AbstractMQTTDispatcher):
     def __init__(self, config: Dict, protocol:MSProtocol = None):
         super().__init__(config)
         self.ms_protocol = protocol
+        # In multi-server mode responses and unsolicited messages of any server are accepted
+        if self.config['mqttms']['ms'].get('multi_server', False):
+            server = '+'
+            server_pattern = r"[^/]+"
+        else:
+            server = self.config['mqttms']['ms'].get('server_uuid', '_')
+            server_pattern = re.escape(server)
+
+        # Precompiled patterns, kept for match_mqtt_topic_for_rsp() / match_mqtt_topic_for_usl()
+        self.rsp_pattern = re.compile(fr"^@/{server_pattern}/RSP/(ASCII|ASCIIHEX|JSON|BINARY)$")
+        self.usl_pattern = re.compile(fr"^@/{server_pattern}/USL/(ASCII|ASCIIHEX|JSON|BINARY)$")
+
+        # MS protocol routes
+        for format in ("ASCII", "ASCIIHEX", "JSON", "BINARY"):
+            self.add_route(f"@/{server}/RSP/{format}", self.dispatch_response)
+            self.add_route(f"@/{server}/USL/{format}", self.dispatch_unsolicited)
 
     def define_ms_protocol(self, protocol:MSProtocol = None) -> None:
         self.ms_protocol = protocol
@@ -20,67 +38,55 @@ class MQTTDispatcher(AbstractMQTTDispatcher):
     def match_mqtt_topic_for_rsp(self, topic: str) -> bool:
         """
         Matches an MQTT topic with the following format:
-        @/<mac_address>/RSP/<format>
+        @/<server_uuid>/RSP/<format>
 
-        where mac_address is a 12-digit hexadecimal string and format is one of:
-        'ASCII', 'ASCIIHEX', 'JSON', 'BINARY'.
+        where format is one of: 'ASCII', 'ASCIIHEX', 'JSON', 'BINARY'.
 
         Args:
-            mac_address (str): A 12-character hexadecimal MAC address.
             topic (str): The MQTT topic to validate.
 
         Returns:
             bool: True if the topic matches the expected format, False otherwise.
         """
-        # Define the regex pattern for the MQTT topic, with valid formats embedded
-        pattern = fr"^@/{self.config['mqttms']['ms'].get('server_uuid', '_')}/RSP/(ASCII|ASCIIHEX|JSON|BINARY)$"
-
-        # Check if the given topic matches the regex pattern
-        return bool(re.match(pattern, topic))
+        return bool(self.rsp_pattern.match(topic))
 
     def match_mqtt_topic_for_usl(self, topic: str) -> bool:
         """
         Matches an MQTT topic with the following format:
-        @/<mac_address>/USL/<format>
+        @/<server_uuid>/USL/<format>
 
-        where mac_address is a 12-digit hexadecimal string and format is one of:
-        'ASCII', 'ASCIIHEX', 'JSON', 'BINARY'.
+        where format is one of: 'ASCII', 'ASCIIHEX', 'JSON', 'BINARY'.
 
         Args:
-            mac_address (str): A 12-character hexadecimal MAC address.
             topic (str): The MQTT topic to validate.
-            format (str): The expected format for the topic.
 
         Returns:
             bool: True if the topic matches the expected format, False otherwise.
         """
-        # Define the regex pattern for the MQTT topic, with valid formats embedded
-        pattern = fr"^@/{self.config['mqttms']['ms'].get('server_uuid', '_')}/USL/(ASCII|ASCIIHEX|JSON|BINARY)$"
+        return bool(self.usl_pattern.match(topic))
+
+    def dispatch_response(self, message: Tuple[str, str]) -> None:
+        # every message is logged on receipt already; here only on the trace channel
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug("handle_message: response -t '%s' -m '%s'", message[0], message[1])
+        self.ms_protocol.put_response(message)
 
-        # Check if the given topic matches the regex pattern
-        return bool(re.match(pattern, topic))
+    def dispatch_unsolicited(self, message: Tuple[str, str]) -> None:
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug("handle_message: unsolicited -t '%s' -m '%s'", message[0], message[1])
+        self.ms_protocol.put_unsolicited(message)
 
     def handle_message(self, message: Tuple[str, str]) -> bool:
         """
         Handles an incoming MQTT message, processes the topic, and dispatches based on matching protocols.
 
+        MS protocol responses and unsolicited messages are routes of the dispatcher's topic router.
+        Subclasses can add their own routes with add_route().
+
         Args:
             message (Tuple[str, str]): A tuple containing the topic (str) and payload (str).
 
         Returns:
             Return True if the message is handled
         """
-
-        if not super().handle_message(message):
-
-            if self.match_mqtt_topic_for_rsp(message[0]):
-                logger.info("handle_message: -t '%s' -m '%s'", message[0], message[1])
-                self.ms_protocol.put_response(message)
-                return True
-
-            if self.match_mqtt_topic_for_usl(message[0]):
-                logger.info("handle_message: -t '%s' -m '%s'", message[0], message[1])
-                self.ms_protocol.put_unsolicited(message)
-                return True
-
-        return False
+        return super().handle_message(message)
@@ -2,19 +2,38 @@
 
 import threading
 import queue
-from typing import Dict
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from concurrent.futures import Future
 import paho.mqtt.client as mqtt
 from mqttms.abstract_dispatcher import AbstractMQTTDispatcher
+from mqttms.topic_router import TopicRouter
+from mqttms.bounded_queue import make_queue
+from mqttms.metrics import NULL_METRICS
+from mqttms.backoff import Backoff
+from mqttms.transport import create_transport
 
-from mqttms.logger import get_app_logger
+from mqttms.logger import get_app_logger, get_trace_logger, LogSampler
 
 logger = get_app_logger(__name__)
+trace_logger = get_trace_logger()
+
+# reason code of SUBACK used for subscriptions which could not be sent
+SUBACK_UNSPECIFIED_ERROR = 0x80
+
+# states passed to connection listeners
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+RECONNECTING = "reconnecting"
+FAILED = "failed"
 
 class MQTTHandler:
     def __init__(self, config:Dict, message_handler:AbstractMQTTDispatcher=None):
         self.config = config
         self.configmqttms = config['mqttms']    # shortcut pointer
-        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,client_id=self.configmqttms['mqtt']['client_id'],protocol=mqtt.MQTTv5)
+        # paho client, or another transport with its interface (mqtt.transport)
+        self.client = create_transport(config)
 
         self.message_handler = None
         self.define_message_handler(handler=message_handler)
@@ -23,34 +42,104 @@ class MQTTHandler:
         if self.configmqttms['mqtt']['username'] and self.configmqttms['mqtt']['password']:
             self.client.username_pw_set(self.configmqttms['mqtt']['username'], self.configmqttms['mqtt']['password'])
 
-        self.connection_established = threading.Event()
+        # Raw payload mode: received payloads are queued as the original bytes, decoding is deferred
+        self.raw_payload = self.configmqttms['mqtt'].get('raw_payload', False)
 
-        self.pending_messages = { }
+        # Per-message logging: settings are read once, messages of high-rate topics can be sampled
+        logging_config = self.config.get('logging', {})
+        self.log_verbose = logging_config.get('verbose', 0)
+        self.long_payload = self.configmqttms['mqtt'].get('long_payload', 0)
+        self.log_sampler = LogSampler(logging_config.get('sample_every', 1), logging_config.get('sample_topics'))
 
-        self.pending_subscriptions = { }
+        self.connection_established = threading.Event()
+        # resolved by on_connect() for non-blocking connections
+        self.connect_future: Optional[Future] = None
+
+        # Reconnection: a supervisor thread runs the network loop and, when the connection is lost,
+        # reconnects with exponential backoff and jitter. Subscriptions are restored after reconnecting.
+        reconnect = self.configmqttms['mqtt'].get('reconnect', {})
+        self.auto_reconnect = reconnect.get('enabled', True)
+        self.reconnect_max_attempts = reconnect.get('max_attempts', 0)
+        self.resubscribe = reconnect.get('resubscribe', True)
+        self.backoff = Backoff.from_config(reconnect)
+        self.network_thread = None
+        self.network_stop = threading.Event()
+        # after a stop request the network loop runs until the connection is closed, or until this time
+        self.network_stop_deadline = 0.0
+        # topics subscribed so far, in order of subscription, with their QoS
+        self.subscribed_topics: Dict[str, int] = {}
+        # callbacks called with CONNECTED, DISCONNECTED, RECONNECTING or FAILED
+        self.connection_listeners: list[Callable[[str], None]] = []
+
+        # Published messages waiting for on_publish(), mid -> {'topic', 'qos', 'future'}
+        self.pending_messages = { }
+        # on_publish() calls that arrived before the mid was registered, mid -> (success, time)
+        self.early_publishes: Dict[int, Tuple[bool, float]] = {}
+        # mids failed by fail_pending_publishes(), mid -> time; their late on_publish() is dropped
+        self.failed_publishes: Dict[int, float] = {}
+        # start of the client.publish() call of the publishing thread, None between the calls
+        self.sending_since: Optional[float] = None
+        self.publish_lock = threading.Lock()
+
+        # QoS of published messages: default, overridden per topic filter, overridden per call
+        self.default_qos = self.configmqttms['mqtt'].get('qos', 0)
+        self.topic_qos = TopicRouter()
+        for topic_filter, qos in self.configmqttms['mqtt'].get('topic_qos', {}).items():
+            self.topic_qos.add_route(topic_filter, qos)
+
+        # Bounded in-flight window: publish_message() waits for a free slot (backpressure)
+        self.max_inflight = self.configmqttms['mqtt'].get('max_inflight', 1000)
+        self.inflight_slots = threading.BoundedSemaphore(self.max_inflight)
+
+        # topics of sent SUBSCRIBE packets, mid -> [topic, ...]
+        self.pending_subscriptions: Dict[int, List[str]] = { }
         self.subscription_established = threading.Event()
+        # per-mid subscription futures, resolved by on_subscribe() with the reason codes per topic
+        self.subscription_futures: Dict[int, Future] = {}
+        # reason codes of SUBACKs that arrived before the mid was registered
+        self.early_subacks: Dict[int, List[int]] = {}
+        self.subscription_lock = threading.Lock()
         self.subscriptions_terminated = threading.Event()
 
+        # queues may be bounded, with an overflow policy, in 'queues' configuration
+        queues = self.configmqttms['mqtt'].get('queues', {})
         # queue for messages to be published
-        self.queue_pub = queue.Queue()
+        self.queue_pub = make_queue(queues.get('pub'), 'pub', on_drop=self.drop_publish)
         # queue for received messages
-        self.queue_rec = queue.Queue()
+        self.queue_rec = make_queue(queues.get('rec'), 'rec')
+
+        # metrics are recorded after define_metrics() attaches a registry
+        self.define_metrics(NULL_METRICS)
 
         # Assign the default handlers
         self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        if self.auto_reconnect:
+            # the network thread writes all packets; publishing threads only queue them and wake it up
+            self.client.on_socket_register_write = self.on_socket_write
+            self.client.on_socket_unregister_write = self.on_socket_write
         self.client.on_subscribe = self.on_subscribe
         self.client.on_unsubscribe = self.on_unsubscribe
         self.client.on_publish = self.on_publish
         self.client.on_message = self.on_message
 
+        # Threads are started by start_threads(), when connecting or publishing the first message
         self.mqtt_publish_thread = None
         self.mqtt_receive_thread = None
+        self.threads_lock = threading.Lock()
 
-        self.mqtt_publish_thread = threading.Thread(target=self.publish_mqtt_message, args=((self,self.queue_pub)))
-        self.mqtt_publish_thread.start()
+    def start_threads(self) -> None:
+        """
+        Start the publishing and receiving threads. Calling it again does nothing.
+        """
+        with self.threads_lock:
+            if self.mqtt_publish_thread is not None:
+                return
+            self.mqtt_publish_thread = threading.Thread(target=self.publish_mqtt_message, args=((self,self.queue_pub)))
+            self.mqtt_publish_thread.start()
 
-        self.mqtt_receive_thread = threading.Thread(target=self.receive_mqtt_message, args=((self, self.queue_rec)))
-        self.mqtt_receive_thread.start()
+            self.mqtt_receive_thread = threading.Thread(target=self.receive_mqtt_message, args=((self, self.queue_rec)))
+            self.mqtt_receive_thread.start()
 
     def define_message_handler(self, handler:AbstractMQTTDispatcher=None) -> None:
         if hasattr(handler, 'handle_message') and callable(getattr(handler, 'handle_message')):
@@ -58,16 +147,25 @@ class MQTTHandler:
         else:
             self.message_handler = None
 
+    def define_metrics(self, registry) -> None:
+        self.metric_published = registry.counter("mqtt_published_total", "Messages published")
+        self.metric_publish_failed = registry.counter("mqtt_publish_failed_total", "Messages which failed to be published or were dropped")
+        self.metric_received = registry.counter("mqtt_received_total", "Messages received")
+        self.metric_received_bytes = registry.counter("mqtt_received_bytes_total", "Payload bytes received")
+        registry.gauge("queue_depth_pub", "Messages waiting for publishing", self.queue_pub.qsize)
+        registry.gauge("queue_depth_rec", "Received messages waiting for dispatching", self.queue_rec.qsize)
+        registry.gauge("mqtt_inflight", "Published messages waiting for completion", lambda: len(self.pending_messages))
+
     def exit_threads(self) -> None:
         if self.mqtt_publish_thread:
             # Signal the publish thread to stop by putting (None, None) into the publish queue
-            self.queue_pub.put((None, None))
+            self.queue_pub.close((None, None))
             # Wait for the publish thread to finish its execution
             self.mqtt_publish_thread.join()
 
         if self.mqtt_receive_thread:
             # Signal the receive thread to stop by putting (None, None) into the receive queue
-            self.queue_rec.put((None, None))
+            self.queue_rec.close((None, None))
             # Wait for the receive thread to finish its execution
             self.mqtt_receive_thread.join()
 
@@ -75,6 +173,7 @@ class MQTTHandler:
         host = self.configmqttms['mqtt']['host']
         port = self.configmqttms['mqtt']['port']
         logger.info("MQTT connecting to MQTT broker at %s:%d...", host, port)
+        self.start_threads()
 
         try:
             # Clear the event to indicate that the connection is not established yet.
@@ -84,7 +183,7 @@ class MQTTHandler:
             self.client.connect(host, port, 60)
 
             # Start the network loop in the background.
-            self.client.loop_start()
+            self.start_network_loop()
         except Exception as e:
             # Log any connection failure.
             logger.info("MQTT Connect: Failed to connect to MQTT Broker: %s", e)
@@ -99,19 +198,168 @@ class MQTTHandler:
             return True
         # Connection was not established within the timeout.
         logger.warning("No MQTT connection was established in time")
+        self.stop_network_loop()
         return False
 
+    def connect_nowait(self) -> Future:
+        """
+        Start connecting to the MQTT broker without blocking.
+
+        Returns a Future that resolves with True when the broker accepts the connection
+        or with False when it refuses it.
+        """
+        host = self.configmqttms['mqtt']['host']
+        port = self.configmqttms['mqtt']['port']
+        logger.info("MQTT connecting to MQTT broker at %s:%d...", host, port)
+
+        self.start_threads()
+        future: Future = Future()
+        self.connect_future = future
+        self.connection_established.clear()
+
+        try:
+            # The network loop thread makes the connection, then on_connect() resolves the future.
+            self.client.connect_async(host, port, 60)
+            self.start_network_loop(connect=True)
+        except Exception as e:
+            logger.info("MQTT Connect: Failed to connect to MQTT Broker: %s", e)
+            future.set_result(False)
+
+        return future
+
+    def start_network_loop(self, connect: bool = False) -> None:
+        """
+        Start the network loop: the reconnecting supervisor thread, or paho's own loop thread
+        when reconnection is disabled. With 'connect' the thread makes the first connection
+        (after connect_async()).
+        """
+        if not self.auto_reconnect:
+            self.client.loop_start()
+            return
+        if self.network_thread is not None and self.network_thread.is_alive():
+            return
+        self.network_stop.clear()
+        self.network_thread = threading.Thread(target=self.network_thread_runner, args=(connect,), daemon=True)
+        self.network_thread.start()
+
+    def network_thread_runner(self, connect: bool) -> None:
+        logger.info("MQTT network thread started")
+
+        while True:
+            if connect:
+                connect = False
+                if not self.reconnect_client() and not self.backoff.attempt:
+                    # the first connection failed, there is nothing to resume
+                    self.resolve_connect_future(False)
+                    break
+                continue
+
+            # serve the connection: read, write, keepalive
+            rc = self.client.loop(timeout=1.0)
+            if self.network_stop.is_set() and (rc != mqtt.MQTT_ERR_SUCCESS or time.monotonic() > self.network_stop_deadline):
+                # the DISCONNECT packet is written and the connection closed, or it takes too long
+                break
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                continue
+
+            # the connection is lost or could not be made: wait, then try again
+            if self.reconnect_max_attempts and self.backoff.attempt >= self.reconnect_max_attempts:
+                logger.error("MQTT giving up reconnecting after %d attempts", self.backoff.attempt)
+                self.notify_connection_listeners(FAILED)
+                break
+            delay = self.backoff.next_delay()
+            logger.warning("MQTT reconnecting in %.2f s (attempt %d)", delay, self.backoff.attempt)
+            self.notify_connection_listeners(RECONNECTING)
+            if self.network_stop.wait(delay):
+                break
+            connect = True
+
+        logger.info("MQTT network thread exited")
+
+    def stop_network_loop(self) -> None:
+        """
+        Stop the network loop after the connection has been closed, waiting not longer than 'mqtt.timeout'.
+        """
+        timeout = self.configmqttms['mqtt'].get('timeout', 5.0)
+        self.network_stop_deadline = time.monotonic() + timeout
+        self.network_stop.set()
+        if not self.auto_reconnect:
+            self.client.loop_stop()
+            return
+        if self.network_thread is not None:
+            self.network_thread.join(timeout + 1.5)
+            self.network_thread = None
+
+    def reconnect_client(self) -> bool:
+        # QoS 0 messages not written before the connection was lost are discarded by paho
+        # without on_publish(); fail them so as their futures and window slots are released
+        self.fail_pending_publishes(qos=0)
+        try:
+            self.client.reconnect()
+            return True
+        except (OSError, ValueError) as e:
+            logger.warning("MQTT connecting to broker failed: %s", e)
+            return False
+
+    def on_socket_write(self, client: mqtt.Client, userdata: object, sock) -> None:
+        # nothing to do: the network loop selects the socket for writing when packets are queued
+        pass
+
+    def resolve_connect_future(self, success: bool) -> None:
+        future = self.connect_future
+        if future is not None and not future.done():
+            future.set_result(success)
+
+    def add_connection_listener(self, callback: Callable[[str], None]) -> None:
+        """
+        Register a callback called with the connection state: CONNECTED, DISCONNECTED,
+        RECONNECTING (before every reconnection attempt) or FAILED (reconnecting gave up).
+        Callbacks run in the network thread and must not block.
+        """
+        self.connection_listeners.append(callback)
+
+    def remove_connection_listener(self, callback: Callable[[str], None]) -> None:
+        if callback in self.connection_listeners:
+            self.connection_listeners.remove(callback)
+
+    def notify_connection_listeners(self, state: str) -> None:
+        for callback in list(self.connection_listeners):
+            try:
+                callback(state)
+            except Exception as e:
+                logger.error("MQTT connection listener failed: %s", e, exc_info=True)
+
     def on_connect(self, client: mqtt.Client, userdata: object, flags: dict, rc: int, properties: dict = None) -> None:
         if rc == 0:
             # Connection was successful
             logger.info("MQTT connected to MQTT broker.")
+            reconnected = self.backoff.attempt > 0
+            self.backoff.reset()
+
+            # Restore the subscriptions, unless the broker kept them in the session
+            if reconnected and self.resubscribe and self.subscribed_topics and not getattr(flags, 'session_present', False):
+                self.restore_subscriptions()
 
             # Set the event to signal the connect() method that the connection is established.
             self.connection_established.set()
+            self.notify_connection_listeners(CONNECTED)
         else:
             # Connection failed with a return code (rc != 0)
             logger.info("MQTT failed to connect, return code %d", rc)
 
+        self.resolve_connect_future(rc == 0)
+
+    def restore_subscriptions(self) -> None:
+        # all topics in one SUBSCRIBE packet
+        logger.info("MQTT restoring %d subscriptions", len(self.subscribed_topics))
+        future = self.subscribe_many_nowait(list(self.subscribed_topics.items()))
+        future.add_done_callback(self.log_restored_subscriptions)
+
+    def log_restored_subscriptions(self, future: Future) -> None:
+        for topic, code in future.result().items():
+            if code >= SUBACK_UNSPECIFIED_ERROR:
+                logger.warning("MQTT subscription to '%s' was not restored, reason code: %d", topic, code)
+
     def disconnect_and_exit(self) -> None:
         logger.info("MQTT initiating clean shutdown...")
 
@@ -127,7 +375,10 @@ class MQTTHandler:
         # Step 2: Exit the publishing and receiving threads
         self.exit_threads()  # Signal the threads to stop and wait for them to finish
 
-        # Step 3: Disconnect from the MQTT broker
+        # Step 3: Disconnect from the MQTT broker; the network thread must not reconnect
+        self.network_stop_deadline = time.monotonic() + self.configmqttms['mqtt'].get('timeout', 5.0)
+        self.network_stop.set()
+        self.subscribed_topics.clear()
         try:
             self.client.disconnect()  # This will trigger the on_disconnect() callback
             logger.info("MQTT disconnected from MQTT broker.")
@@ -135,39 +386,32 @@ class MQTTHandler:
             # Log any errors that occur during the disconnection process
             logger.error("MQTT error while disconnecting from the broker: %s", e)
 
+        # Step 4: Stop the network thread once the DISCONNECT packet is written
+        self.stop_network_loop()
+
         logger.info("MQTT clean shutdown complete.")
 
-    def on_disconnect(self, client: mqtt.Client, userdata: object, rc: int) -> None:
-        # If the return code (rc) is 0, the disconnection was intentional
-        if rc == 0:
+    def on_disconnect(self, client: mqtt.Client, userdata: object, disconnect_flags: mqtt.DisconnectFlags, reason_code, properties=None) -> None:
+        self.connection_established.clear()
+
+        # If the reason code is 0 and the disconnection was requested, it was intentional
+        if self.network_stop.is_set() or reason_code == 0:
             logger.info("Disconnected from MQTT broker successfully.")
         else:
-            # If rc != 0, the disconnection was unintentional
-            logger.warning("Unexpected disconnection from MQTT broker. Reason code: %d", rc)
-
-            # Attempt to reconnect to the broker
-            try:
-                client.reconnect()
-                logger.info("Reconnected to MQTT broker.")
-            except Exception as e:
-                # Log the failure to reconnect
-                logger.error("Failed to reconnect: %s", e)
+            # The network thread reconnects with backoff; nothing is done here, in the callback
+            logger.warning("Unexpected disconnection from MQTT broker. Reason code: %s", reason_code)
+        self.notify_connection_listeners(DISCONNECTED)
 
     def subscribe(self, topic: str) -> bool:
         # Clear the subscription event to signal that no acknowledgment has been received yet
         self.subscription_established.clear()
 
-        # Attempt to subscribe to the specified topic
-        result, mid = self.client.subscribe(topic=topic)
-
-        # Store the subscription message ID (mid) and associate it with the topic
-        self.pending_subscriptions[mid] = topic
-
-        # Log the subscription request
-        logger.info("MQTT subscribing to topic: %s", topic)
-
-        # Wait for the subscription acknowledgment from the broker, with a timeout
-        waitres = self.subscription_established.wait(self.config['mqttms']['mqtt']['timeout'])
+        # Send the subscription and wait for the acknowledgment of this very subscription (by mid)
+        future = self.subscribe_nowait(topic)
+        try:
+            waitres = future.result(timeout=self.config['mqttms']['mqtt']['timeout'])
+        except TimeoutError:
+            waitres = False
 
         if waitres:
             # If the acknowledgment was received in time, log success and return True
@@ -178,16 +422,109 @@ class MQTTHandler:
             logger.warning("No MQTT subscription established in time")
             return False
 
-    def on_subscribe(self, client: mqtt.Client, userdata: object, mid: int, rc: int, properties: dict = None) -> None:
+    def subscribe_nowait(self, topic: str, qos: int = 0) -> Future:
+        """
+        Send a subscription request without waiting for the acknowledgment.
+
+        Returns a Future that resolves with True when the broker acknowledges the subscription
+        or with False when the request cannot be sent or is refused.
+        """
+        future: Future = Future()
+        codes = self.subscribe_many_nowait([(topic, qos)])
+        codes.add_done_callback(lambda f: future.set_result(f.result()[topic] < SUBACK_UNSPECIFIED_ERROR))
+        return future
+
+    def subscribe_many(self, topics: Sequence[Union[str, Tuple[str, int]]]) -> Dict[str, int]:
+        """
+        Subscribe to all 'topics' with one SUBSCRIBE packet and wait for the SUBACK.
+        Returns the reason code per topic (see subscribe_many_nowait()); on timeout all codes are 0x80.
+        """
+        future = self.subscribe_many_nowait(topics)
+        try:
+            return future.result(timeout=self.configmqttms['mqtt'].get('timeout', 5.0))
+        except TimeoutError:
+            logger.warning("No MQTT subscription established in time")
+            return {topic: SUBACK_UNSPECIFIED_ERROR for topic in self.subscription_topics(topics)}
+
+    def subscription_topics(self, topics: Sequence[Union[str, Tuple[str, int]]]) -> List[str]:
+        return [topic if isinstance(topic, str) else topic[0] for topic in topics]
+
+    def subscribe_many_nowait(self, topics: Sequence[Union[str, Tuple[str, int]]]) -> Future:
+        """
+        Send one SUBSCRIBE packet for all 'topics' without waiting for the acknowledgment.
+        Topics are given as topic filters (QoS 0) or (topic filter, QoS) tuples.
+
+        Returns a Future that resolves with a dict of the reason code per topic, from the SUBACK:
+        the granted QoS (0-2) on success, 0x80 or higher when the subscription is refused
+        or the request cannot be sent.
+        """
+        future: Future = Future()
+        subscriptions = [(topic, 0) if isinstance(topic, str) else (topic[0], topic[1]) for topic in topics]
+        names = [topic for topic, _ in subscriptions]
+        if not subscriptions:
+            future.set_result({})
+            return future
+        # refused subscriptions are not restored after a reconnection
+        future.add_done_callback(self.forget_refused_subscriptions)
+
+        # remembered for restoring after a reconnection
+        for topic, qos in subscriptions:
+            self.subscribed_topics[topic] = qos
+
+        # Attempt to subscribe to all topics at once
+        result, mid = self.client.subscribe(subscriptions)
+        if result != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning("MQTT failed to subscribe to topics %s, return code: %d", names, result)
+            future.set_result({topic: SUBACK_UNSPECIFIED_ERROR for topic in names})
+            return future
+
+        # Log the subscription request
+        logger.info("MQTT subscribing to topics: %s", ", ".join(names))
+
+        # The SUBACK may be already processed by the network thread
+        with self.subscription_lock:
+            codes = self.early_subacks.pop(mid, None)
+            if codes is None:
+                # Store the subscription message ID (mid) and associate it with the topics
+                self.subscription_futures[mid] = future
+                self.pending_subscriptions[mid] = names
+        if codes is not None:
+            future.set_result(self.reason_codes_by_topic(names, codes))
+
+        return future
+
+    def forget_refused_subscriptions(self, future: Future) -> None:
+        for topic, code in future.result().items():
+            if code >= SUBACK_UNSPECIFIED_ERROR:
+                self.subscribed_topics.pop(topic, None)
+
+    def reason_codes_by_topic(self, topics: List[str], codes: List[int]) -> Dict[str, int]:
+        # a SUBACK without a code for every topic fails the topics without one
+        return {topic: codes[i] if i < len(codes) else SUBACK_UNSPECIFIED_ERROR for i, topic in enumerate(topics)}
+
+    def on_subscribe(self, client: mqtt.Client, userdata: object, mid: int, rc: list, properties: dict = None) -> None:
         # Signal that the subscription acknowledgment has been received
         self.subscription_established.set()
 
-        # Retrieve the topic associated with the message ID (mid)
-        topic = self.pending_subscriptions.pop(mid, None)
-
-        # Log the subscription acknowledgment along with the topic, if available
-        if topic:
-            logger.info("MQTT subscription to '%s' acknowledged", topic)
+        # rc is the list of reason codes, one per subscribed topic
+        codes = [code.value if hasattr(code, 'value') else int(code) for code in rc] if isinstance(rc, list) else [int(rc)]
+
+        with self.subscription_lock:
+            # Retrieve the topics associated with the message ID (mid)
+            topics = self.pending_subscriptions.pop(mid, None)
+            future = self.subscription_futures.pop(mid, None)
+            if future is None:
+                self.early_subacks[mid] = codes
+        if future is not None:
+            future.set_result(self.reason_codes_by_topic(topics or [], codes))
+
+        # Log the subscription acknowledgment along with the topics, if available
+        if topics:
+            refused = [topic for topic, code in zip(topics, codes) if code >= SUBACK_UNSPECIFIED_ERROR]
+            if refused:
+                logger.warning("MQTT subscription to %s refused", ", ".join(refused))
+            else:
+                logger.info("MQTT subscription to '%s' acknowledged", ", ".join(topics))
         else:
             logger.info("MQTT subscription with mid '%d' acknowledged but no topic found in pending subscriptions", mid)
 
@@ -200,21 +537,103 @@ class MQTTHandler:
 
     def on_publish(self, client: mqtt.Client, userdata: object, mid: int, reason_code: int, properties: dict = None) -> None:
         # Log successful message publication with its message ID and reason code
-        if reason_code == 0:
-            logger.info("MQTT message with mid '%d' successfully published.", mid)
+        success = reason_code == 0
+        if success:
+            if trace_logger.isEnabledFor(logging.DEBUG):
+                trace_logger.debug("MQTT message with mid '%d' successfully published.", mid)
         else:
             logger.warning("MQTT failed to publish MQTT message with mid '%d', reason code: %d", mid, reason_code)
 
-        # Optionally, remove the message ID from a tracking dictionary of pending messages (if applicable)
-        if mid in self.pending_messages:
-            self.pending_messages.pop(mid, None)
+        # Complete the tracked message. The publish thread may not have registered the mid yet.
+        with self.publish_lock:
+            pending = self.pending_messages.pop(mid, None)
+            if pending is None:
+                failed_at = self.failed_publishes.pop(mid, None)
+                # a message being published since the failure may have got the same mid again
+                if failed_at is not None and (self.sending_since is None or self.sending_since <= failed_at):
+                    logger.info("MQTT late acknowledgment of failed message with mid '%d' dropped", mid)
+                else:
+                    self.early_publishes[mid] = (success, time.monotonic())
+        if pending is not None:
+            self.complete_publish(pending['future'], success)
+
+    def complete_publish(self, future: Future, success: bool) -> None:
+        # free the slot in the in-flight window and notify the publisher
+        self.inflight_slots.release()
+        if success:
+            self.metric_published.inc()
+        else:
+            self.metric_publish_failed.inc()
+        future.set_result(success)
+
+    def fail_pending_publishes(self, qos: Optional[int] = None) -> int:
+        """
+        Complete the published messages still waiting for on_publish() (of the given QoS) as failed.
+        Returns their number.
+        """
+        with self.publish_lock:
+            now = time.monotonic()
+            mids = [mid for mid, pending in self.pending_messages.items() if qos is None or pending['qos'] == qos]
+            failed = [self.pending_messages.pop(mid) for mid in mids]
+            # an acknowledgment arriving later must not complete a new message with the same mid
+            self.failed_publishes.update(dict.fromkeys(mids, now))
+            # early acknowledgments not taken by a message are stale, except of the one being published
+            since = self.sending_since if self.sending_since is not None else now
+            self.early_publishes = {mid: early for mid, early in self.early_publishes.items() if early[1] >= since}
+        for pending in failed:
+            self.complete_publish(pending['future'], False)
+        if failed:
+            logger.warning("MQTT %d messages were lost with the connection", len(failed))
+        return len(failed)
+
+    def drop_publish(self, message: tuple) -> None:
+        # a message dropped by the publishing queue overflow policy is never published
+        logger.warning("MQTT publish to '%s' dropped: publishing queue is full", message[0])
+        self.complete_publish(message[3], False)
+
+    def qos_for_topic(self, topic: str) -> int:
+        qos = self.topic_qos.match(topic)
+        return max(qos) if qos else self.default_qos
+
+    def publish_message(self, topic: str, payload: str, qos: Optional[int] = None, block: bool = True) -> Optional[Future]:
+        """
+        Queue a message for publishing.
+
+        Returns a Future which resolves with True when the message is published (QoS 0: written
+        to the socket, QoS 1/2: acknowledged by the broker) or with False when publishing fails.
+        When the in-flight window is full, the call waits for a free slot; with block=False it
+        returns None instead of waiting.
+        """
+        if self.mqtt_publish_thread is None:
+            self.start_threads()
+        future: Future = Future()
+        if qos is None:
+            qos = self.qos_for_topic(topic)
+
+        # wait for a free slot in the in-flight window (backpressure)
+        if not block:
+            if not self.inflight_slots.acquire(blocking=False):
+                return None
+        elif not self.inflight_slots.acquire(timeout=self.configmqttms['mqtt'].get('timeout', 5.0)):
+            logger.warning("MQTT publish to '%s' dropped: in-flight window of %d messages is full", topic, self.max_inflight)
+            future.set_result(False)
+            return future
 
-    def publish_message(self, topic: str, payload: str) -> None:
         # Place the topic and payload into the publishing queue
-        self.queue_pub.put((topic, payload))
+        self.queue_pub.put((topic, payload, qos, future))
 
         # Log the message being queued, optionally truncating the payload if verbosity is off and the payload is long
-        logger.info(f"MQTT publish: -t '{topic}' -m '{'<long payload>' if not self.config['logging']['verbose'] and len(payload) > self.configmqttms['mqtt'].get('long_payload', 0) else payload}'")
+        if logger.isEnabledFor(logging.INFO) and self.log_sampler.sample(topic):
+            logger.info("MQTT publish: -t '%s' -m '%s'", topic, self.loggable_payload(payload))
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug("MQTT publish: -t '%s' qos %d -m '%s'", topic, qos, payload)
+        return future
+
+    def loggable_payload(self, payload) -> str:
+        # a placeholder instead of long payloads, unless verbose logging is on
+        if not self.log_verbose and len(payload) > self.long_payload:
+            return '<long payload>'
+        return payload
 
     def publish_mqtt_message(self, client: mqtt.Client, q: queue.Queue) -> None:
         logger.info("MQTT entered publishing thread")
@@ -224,35 +643,73 @@ class MQTTHandler:
             message = self.queue_pub.get()
 
             # Exit the thread if a signal (None, None) is received
-            if message == (None, None):
+            if message[0] is None:
                 break
 
-            # Unpack the topic and payload from the message tuple
-            topic, payload = message
-
-            # Attempt to publish the message to the MQTT broker
-            result = self.client.publish(topic, payload, qos=0)
+            # Unpack the message tuple and hand it to the client
+            topic, payload, qos, future = message
+            self.send_publish(topic, payload, qos, future)
 
-            # Check if the message was successfully queued for publishing
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                mid = result.mid  # Get the message ID for tracking
-                self.pending_messages[mid] = {'topic': topic, 'payload': payload}  # Track the message
-            else:
-                logger.warning("MQTT failed to publish message to topic '%s', return code: %d", topic, result.rc)
+        logger.info("MQTT exited publishing thread")
 
-            # Wait for the message to be fully published (if QoS 1 or 2)
-            result.wait_for_publish()
+    def send_publish(self, topic: str, payload: str, qos: int, future: Future) -> None:
+        # QoS 0 messages are not kept for a later connection
+        if qos == 0 and self.auto_reconnect and not self.connection_established.is_set():
+            logger.warning("MQTT publish to '%s' failed: not connected", topic)
+            self.complete_publish(future, False)
+            return
 
-        logger.info("MQTT exited publishing thread")
+        # Attempt to publish the message to the MQTT broker
+        sending_since = self.sending_since = time.monotonic()
+        try:
+            result = self.client.publish(topic, payload, qos=qos)
+        except (ValueError, TypeError) as e:
+            self.sending_since = None
+            logger.warning("MQTT failed to publish message to topic '%s': %s", topic, e)
+            self.complete_publish(future, False)
+            return
+
+        # Check if the message was successfully queued for publishing
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.sending_since = None
+            logger.warning("MQTT failed to publish message to topic '%s', return code: %d", topic, result.rc)
+            self.complete_publish(future, False)
+            return
+
+        # Track the message by its mid; completion is signalled by on_publish() without waiting here
+        with self.publish_lock:
+            self.sending_since = None
+            # the mid is in use again, a failure recorded for it is of an older message
+            self.failed_publishes.pop(result.mid, None)
+            early = self.early_publishes.pop(result.mid, None)
+            # only an acknowledgment which arrived during this call is of this message
+            success = early[0] if early is not None and early[1] >= sending_since else None
+            if success is None:
+                self.pending_messages[result.mid] = {'topic': topic, 'qos': qos, 'future': future}
+        if success is not None:
+            self.complete_publish(future, success)
 
     def on_message(self, client: mqtt.Client, userdata: object, message: mqtt.MQTTMessage) -> None:
+        self.metric_received.inc()
+        self.metric_received_bytes.inc(len(message.payload))
+
+        if self.raw_payload:
+            # Queue the original bytes; consumers decode them only if they need to
+            if logger.isEnabledFor(logging.INFO) and self.log_sampler.sample(message.topic):
+                logger.info("MQTT receive: -t '%s' (%d bytes)", message.topic, len(message.payload))
+            if trace_logger.isEnabledFor(logging.DEBUG):
+                trace_logger.debug("MQTT receive: -t '%s' -m %r", message.topic, message.payload)
+            self.queue_rec.put((message.topic, message.payload))
+            return
+
         # Decode the payload
         payload = message.payload.decode()
 
         # Log the message. If verbose mode is off and the payload is long, log a placeholder.
-        logger.info(
-            f"MQTT receive: -t '{message.topic}' -m '{'<long payload>' if not self.config['logging']['verbose'] and len(payload) > self.configmqttms['mqtt'].get('long_payload', 0) else payload}'"
-        )
+        if logger.isEnabledFor(logging.INFO) and self.log_sampler.sample(message.topic):
+            logger.info("MQTT receive: -t '%s' -m '%s'", message.topic, self.loggable_payload(payload))
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug("MQTT receive: -t '%s' -m '%s'", message.topic, payload)
 
         # Place the topic and payload into the receiving queue
         self.queue_rec.put((message.topic, payload))
@@ -1,17 +1,161 @@
 import threading
-import re
 import json
-from typing import Dict
+import math
+import logging
+import dataclasses
+import time
+import heapq
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Optional, Tuple, Union
 import queue
 import random
-import jsonschema
-from jsonschema import Draft7Validator
+from functools import cached_property
+from concurrent.futures import Future, InvalidStateError
 
-from mqttms.mqtt_handler import MQTTHandler
+from mqttms.mqtt_handler import MQTTHandler, CONNECTED, DISCONNECTED, SUBACK_UNSPECIFIED_ERROR
+from mqttms.fast_validator import is_valid_response
+from mqttms import codec
+from mqttms.encoders import get_encoder
+from mqttms.cid_allocator import CidAllocator, CidExhaustedError
+from mqttms.bounded_queue import BoundedQueue, make_queue
+from mqttms.metrics import FAST_BUCKETS, NULL_METRICS
 
-from mqttms.logger import get_app_logger
+from mqttms.logger import get_app_logger, get_trace_logger
 
 logger = get_app_logger(__name__)
+trace_logger = get_trace_logger()
+
+def compile_schema(schema: dict):
+    """
+    Build the jsonschema validator of 'schema'. jsonschema is imported here, on first use,
+    as it is not needed at all with 'fast' or 'off' validation of valid messages.
+    """
+    from jsonschema import Draft7Validator  # pylint: disable=import-outside-toplevel
+    return Draft7Validator(schema)
+
+def schema_error(validator, instance: Any) -> Optional[str]:
+    """
+    Return the message of the first error of 'instance' (as validate() raises it), None if it is valid.
+    """
+    error = next(validator.iter_errors(instance), None)
+    return error.message if error is not None else None
+
+def command_order(command: Optional[tuple]) -> tuple:
+    """
+    Order of the commands queue: higher priority first, then the earlier deadline, then the order
+    of putting. The exit signal (None) comes after all commands.
+    """
+    if command is None:
+        return (math.inf, math.inf)
+    deadline = command[4]
+    return (-command[3], deadline if deadline is not None else math.inf)
+
+class PendingCommand:
+    """
+    A command that has been published and waits for its response (pipelined mode).
+    """
+    __slots__ = ("server", "cid", "deadline", "future", "sent_at", "topic", "payload", "windowed")
+
+    def __init__(self, server: str, cid: int, deadline: float, future: Future, sent_at: float, topic: str = "", payload: str = "", windowed: bool = True):
+        self.server = server
+        self.cid = cid
+        self.deadline = deadline
+        self.future = future
+        self.sent_at = sent_at
+        # kept for replaying the command after a reconnection
+        self.topic = topic
+        self.payload = payload
+        # False for the commands of a broadcast, which do not take slots of the in-flight window
+        self.windowed = windowed
+
+class Broadcast:
+    """
+    One command sent to many servers (MSProtocol.broadcast()).
+
+    Every server has its own future in 'futures', resolved with its validated response or with
+    a generated TM / BD response; servers which stay silent until the deadline get TM. 'future'
+    resolves with the dictionary server -> response when all servers are completed. The responses
+    can also be taken as they arrive: by the callback given to broadcast(), called with
+    (server, response) in the thread which completes the command, or by iterating over the
+    Broadcast, which yields (server, response) pairs until all servers are completed.
+    The future of a server can be cancelled until the broadcast is sent; the server is skipped then.
+    """
+
+    def __init__(self, servers: Iterable[str], callback: Optional[Callable[[str, dict], None]] = None):
+        # each server once, in the order of the first occurrence
+        self.servers = list(dict.fromkeys(servers))
+        self.callback = callback
+        self.futures: Dict[str, Future] = {server: Future() for server in self.servers}
+        self.future: Future = Future()
+        self.responses: Dict[str, dict] = {}
+        self.completed = 0
+        self.arrivals: queue.SimpleQueue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+
+        for server, future in self.futures.items():
+            future.add_done_callback(lambda f, server=server: self.complete(server, f))
+        # cancelling the broadcast before it is sent cancels the commands of all servers
+        self.future.add_done_callback(self.cancel_servers)
+        if not self.servers:
+            self.future.set_result({})
+            self.arrivals.put(None)
+
+    def complete(self, server: str, future: Future) -> None:
+        # done callback of the future of 'server', called in the thread which completes it
+        response = None if future.cancelled() else future.result()
+        with self.lock:
+            self.completed += 1
+            finished = self.completed == len(self.servers)
+            if response is not None:
+                self.responses[server] = response
+                self.arrivals.put((server, response))
+            if finished:
+                # after all arrivals
+                self.arrivals.put(None)
+        if response is not None and self.callback:
+            try:
+                self.callback(server, response)
+            except Exception as e:
+                logger.error("MS: broadcast callback failed: %s", e, exc_info=True)
+        if finished and not self.future.cancelled():
+            self.future.set_result(dict(self.responses))
+
+    def start(self) -> list:
+        """
+        Mark the commands of the servers as running, so as they can not be cancelled any more,
+        and return the servers to send to. Servers whose future was cancelled are skipped.
+        """
+        return [server for server in self.servers if self.futures[server].set_running_or_notify_cancel()]
+
+    def cancel_servers(self, future: Future) -> None:
+        if future.cancelled():
+            for server_future in self.futures.values():
+                server_future.cancel()
+
+    def result(self, timeout: Optional[float] = None) -> Dict[str, dict]:
+        """
+        Wait until all servers are completed and return the dictionary server -> response.
+        """
+        return self.future.result(timeout)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def silent(self) -> list:
+        """
+        Servers completed with TM so far.
+        """
+        with self.lock:
+            return [server for server, response in self.responses.items() if response.get("response") == "TM"]
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        while True:
+            arrival = self.arrivals.get()
+            if arrival is None:
+                # for another iteration over the same broadcast
+                self.arrivals.put(None)
+                break
+            yield arrival
 
 class MSProtocol:
     def __init__(self, config:Dict, process_unsolicited_message=None):
@@ -151,12 +295,23 @@ class MSProtocol:
             "additionalProperties": False
         }
 
-        # queue for commands
-        self.queue_cmd = queue.Queue()
+        # Validators are built on first use and reused for every message.
+        # 'validation' selects full (jsonschema), fast (hand-compiled checks, jsonschema fallback) or off.
+        self.validation = self.config['mqttms']['ms'].get('validation', 'full')
+
+        # JSON encoder of structured (dict / dataclass) command payloads
+        self.encode = get_encoder(self.config['mqttms']['ms'].get('encoder', 'auto'))
+        # the "client" tracking field of every command, encoded once
+        self.client_field = f'"client":{self.encode(self.config["mqttms"]["ms"].get("client_uuid", "_"))}'
+
+        # queues may be bounded, with an overflow policy, in 'queues' configuration
+        queues = self.config['mqttms']['ms'].get('queues', {})
+        # queue for commands, (payload, future, server, priority, deadline, timeout), in order of priority and deadline
+        self.queue_cmd = make_queue(queues.get('cmd'), 'cmd', on_drop=self.drop_command, key=command_order)
         # queue for responses
         self.queue_res = queue.Queue()
         # queue for unsolicited messages
-        self.queue_unsolicited = queue.Queue()
+        self.queue_unsolicited = make_queue(queues.get('unsolicited'), 'unsolicited')
 
         # Synchronization for waiting for responses
         self.response_received = threading.Event()
@@ -164,13 +319,101 @@ class MSProtocol:
         # To store the response
         self.response = None
 
-        self.command_thread = None
-        self.command_thread = threading.Thread(target=self.command_thread_runner, args=(self.queue_cmd,self.queue_res))
-        self.command_thread.start()
+        # Multi-server mode: commands address any server, subscriptions use '+' for the server uuid
+        self.multi_server = self.config['mqttms']['ms'].get('multi_server', False)
+        self.default_server = self.config['mqttms']['ms'].get('server_uuid', '_')
+
+        # Pipelined mode: up to 'window' commands are in flight, responses are matched by cid
+        self.pipeline = self.config['mqttms']['ms'].get('pipeline', False)
+        self.window = self.config['mqttms']['ms'].get('window', 16)
+        # outstanding requests, server uuid -> cid -> PendingCommand
+        self.outstanding: Dict[str, Dict[int, PendingCommand]] = {}
+        self.outstanding_lock = threading.Lock()
+        # collision-free command ids, per server, in the range of the response schema
+        self.cid_allocator = CidAllocator(0, 999)
+        # heap of (deadline, server, cid) used to expire outstanding requests
+        self.deadlines: list = []
+        self.window_slots = threading.Semaphore(self.window)
+        # completed responses in pipelined mode, in order of completion; bounded so as
+        # responses which are not collected with get_response() do not accumulate
+        self.queue_done = BoundedQueue(maxsize=1000, policy='drop_oldest', name='done')
+
+        # Commands in flight when the connection is lost: 'keep' waiting until their deadline,
+        # 'expire' them at once with TM, or 'replay' them (same cid and deadline) after reconnecting
+        self.inflight_on_disconnect = self.config['mqttms']['ms'].get('inflight_on_disconnect', 'keep')
+        # (cid, topic, payload) of the command sent in sequential mode
+        self.current_command: Optional[tuple] = None
 
+        # Pool of unsolicited message workers. Messages are sharded by their 'src' field,
+        # so messages of one source are processed in order by the same worker.
+        self.unsolicited_workers = self.config['mqttms']['ms'].get('unsolicited_workers', 1)
+        self.unsolicited_worker_queues = []
+        if self.unsolicited_workers > 1:
+            for index in range(self.unsolicited_workers):
+                self.unsolicited_worker_queues.append(make_queue(queues.get('unsolicited_worker'), f'unsolicited_worker_{index}'))
+        self.unsolicited_worker_threads = []
+        self.unsolicited_process_pool = None
+
+        # metrics are recorded after define_metrics() attaches a registry
+        self.define_metrics(NULL_METRICS)
+
+        # Threads are started by start(), when connecting to the broker, not here
+        self.command_thread = None
+        self.response_thread = None
         self.unsolicited_thread = None
-        self.unsolicited_thread = threading.Thread(target=self.unsolicited_thread_runner, args=(self.queue_unsolicited,))
-        self.unsolicited_thread.start()
+        self.threads_lock = threading.Lock()
+
+    @cached_property
+    def response_validator(self):
+        return compile_schema(self.response_schema)
+
+    @cached_property
+    def unsolicited_validator(self):
+        return compile_schema(self.unsolicited_schema)
+
+    def start(self) -> None:
+        """
+        Start the command, response and unsolicited threads and the unsolicited worker pool.
+        Called when connecting to the broker, or by the first put_command(); calling it again does nothing.
+        """
+        with self.threads_lock:
+            if self.command_thread is not None:
+                return
+            if self.pipeline:
+                self.command_thread = threading.Thread(target=self.pipelined_command_thread_runner, args=(self.queue_cmd,))
+                self.response_thread = threading.Thread(target=self.response_thread_runner, args=(self.queue_res,))
+                self.response_thread.start()
+            else:
+                self.command_thread = threading.Thread(target=self.command_thread_runner, args=(self.queue_cmd,self.queue_res))
+            self.command_thread.start()
+
+            if self.unsolicited_worker_queues:
+                if self.config['mqttms']['ms'].get('unsolicited_executor', 'thread') == 'process':
+                    # CPU-heavy callbacks run in processes; the callback must be picklable
+                    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+                    self.unsolicited_process_pool = ProcessPoolExecutor(max_workers=self.unsolicited_workers)
+                for index, worker_queue in enumerate(self.unsolicited_worker_queues):
+                    worker_thread = threading.Thread(target=self.unsolicited_worker_runner, args=(index, worker_queue))
+                    self.unsolicited_worker_threads.append(worker_thread)
+                    worker_thread.start()
+
+            self.unsolicited_thread = threading.Thread(target=self.unsolicited_thread_runner, args=(self.queue_unsolicited,))
+            self.unsolicited_thread.start()
+
+    def define_metrics(self, registry) -> None:
+        self.metric_latency = registry.histogram("command_latency_seconds", "Command round trip, from publish to validated response")
+        self.metric_commands = registry.counter("commands_total", "Completed commands")
+        self.metric_timeouts = registry.counter("command_timeouts_total", "Commands completed with TM (timeout)")
+        self.metric_bad_responses = registry.counter("command_bad_responses_total", "Commands completed with BD (bad data)")
+        self.metric_expired = registry.counter("commands_expired_total", "Commands completed with TM without sending, their deadline passed in the queue")
+        self.metric_rejected = registry.counter("commands_rejected_total", "Commands completed with TM without sending, all command ids of the server were outstanding")
+        self.metric_validation = registry.histogram("validation_seconds", "Validation time of a response", FAST_BUCKETS)
+        registry.gauge("queue_depth_cmd", "Commands waiting for sending", self.queue_cmd.qsize)
+        registry.gauge("queue_depth_res", "Responses waiting for processing", self.queue_res.qsize)
+        registry.gauge("queue_depth_unsolicited", "Unsolicited messages waiting for processing", self.queue_unsolicited.qsize)
+        for index, worker_queue in enumerate(self.unsolicited_worker_queues):
+            registry.gauge(f"queue_depth_unsolicited_worker_{index}", f"Unsolicited messages waiting for worker {index}", worker_queue.qsize)
+        registry.gauge("commands_outstanding", "Commands sent and waiting for a response", self.cid_allocator.occupancy)
 
     def set_unsolicited_message_processor(self, callback):
         self.process_unsolicited_message = callback
@@ -185,52 +428,446 @@ class MSProtocol:
             if message is None:
                 break
 
+            message, future, server, _, deadline, timeout = message
+            # skip commands cancelled by the caller before being sent
+            if not future.set_running_or_notify_cancel():
+                continue
+            if isinstance(server, Broadcast):
+                self.send_broadcast(message, server, deadline, timeout)
+                continue
+            # commands which can not be answered in time are not sent
+            if deadline is not None and time.monotonic() >= deadline:
+                self.expire_unsent(future, server)
+                continue
+
+            # encoded before taking a cid, a payload which can not be encoded fails this command only
+            text = self.encode_unsent(message, [(future, server)])
+            if text is None:
+                continue
+
             # sending message for publishing
-            topic = self.construct_cmd_topic()
-            payload = self.add_tracking_information(payload=message)
+            topic = self.construct_cmd_topic(server=server)
+            cid = self.cid_allocator.allocate(server)
+            payload = self.add_tracking_information(payload=text, cid=cid)
+            sent_at = time.monotonic()
+            self.current_command = (cid, topic, payload)
             self.mqtt_handler.publish_message(topic, payload)
-            try:
-                jpayload = json.loads(payload)
-                cid = jpayload.get('cid', 0)
-            except json.JSONDecodeError as e:
-                cid = 0
 
-            # wait for response
-            try:
-                topic, payload = self.queue_res.get(block=True,timeout=self.config['mqttms']['ms'].get('timeout', 5))
-            except queue.Empty:
+            # wait for response, then the cid can be reused
+            response = self.wait_response_from(server, cid, self.response_deadline(sent_at, deadline, timeout))
+            self.current_command = None
+            self.cid_allocator.release(cid, server)
+            if response is None:
                 # create timeout answer here
-                self.construct_not_ok_response(cid,"TM")
                 logger.info("MS Timeout")
-                self.response_received.set()
+                self.finish_command(future, self.construct_not_ok_response(cid,"TM",server), sent_at)
                 continue
+            topic, payload = response
+
+            # flag that response has received or generated timeout response
+            self.finish_command(future, self.checked_response(topic, payload, cid, server), sent_at)
 
-            # convert payload to json object
+        logger.info("MS command thread exited")
+
+    def checked_response(self, topic: str, payload: str, cid: int, server: str) -> dict:
+        """
+        Return the validated response in 'payload' (JSON text), or a generated BD response
+        of command 'cid' if it is not valid.
+        """
+        # convert payload to json object
+        try:
+            jpayload = json.loads(payload)
+        except json.JSONDecodeError:
+            return self.construct_not_ok_response(cid, "BD", server)
+
+        jpayload = self.add_data_type(topic, jpayload) if isinstance(jpayload, dict) else None
+        if jpayload is None or not self.validate_json(data=jpayload):
+            # construct BD response
+            return self.construct_not_ok_response(cid, "BD", server)
+        return jpayload
+
+    def response_deadline(self, sent_at: float, deadline: Optional[float] = None, timeout: Optional[float] = None) -> float:
+        # the command's own timeout or 'ms.timeout' after sending, not later than its deadline
+        limit = sent_at + (timeout if timeout is not None else self.config['mqttms']['ms'].get('timeout', 5))
+        return limit if deadline is None else min(limit, deadline)
+
+    def wait_response_from(self, server: str, cid: Optional[int] = None, deadline: Optional[float] = None):
+        # Wait for a response of the given server. Responses of other servers, possible
+        # with wildcard subscriptions, are not for the sent command and are dropped.
+        if deadline is None:
+            deadline = self.response_deadline(time.monotonic())
+        while True:
             try:
-                payload = json.loads(payload)
-            except json.JSONDecodeError as e:
-                self.construct_not_ok_response(cid,"BD")
-                self.response_received.set()
+                topic, payload = self.queue_res.get(block=True, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return None
+            if topic is None:
+                # expiry signal of a lost connection, ignored if it is for an earlier command
+                if payload == cid:
+                    return None
                 continue
+            if not self.multi_server or self.server_from_topic(topic) == server:
+                return topic, payload
+            logger.info("MS: response of server '%s' dropped while waiting for '%s'", self.server_from_topic(topic), server)
+
+    def finish_command(self, future: Future, payload: dict, sent_at: Optional[float] = None) -> None:
+        # count the command by its completion and record its round trip
+        self.metric_commands.inc()
+        if payload.get("response") == "TM":
+            self.metric_timeouts.inc()
+        elif payload.get("response") == "BD":
+            self.metric_bad_responses.inc()
+        if sent_at is not None:
+            self.metric_latency.observe(time.monotonic() - sent_at)
+
+        # keep the legacy shared response for get_response() and resolve the command's own future
+        self.response = payload
+        try:
+            future.set_result(payload)
+        except InvalidStateError:
+            # a command thread must survive a future completed or cancelled elsewhere
+            logger.warning("MS: response of server '%s' dropped, its command is already completed or cancelled", payload.get("server"))
+        self.response_received.set()
+
+    def expire_unsent(self, future: Future, server: str, windowed: bool = True) -> None:
+        # TM without cid, the command has not been sent
+        logger.info("MS Timeout (server '%s'): deadline passed before sending", server)
+        self.metric_expired.inc()
+        payload = self.construct_not_ok_response(None, "TM", server)
+        if self.pipeline and windowed:
+            self.queue_done.put(payload)
+        self.finish_command(future, payload)
+
+    def reject_unsent(self, future: Future, server: str, windowed: bool = True) -> None:
+        # TM without cid, the command can not be told apart from the ones in flight
+        logger.warning("MS: command to server '%s' not sent, all command ids of the server are outstanding", server)
+        self.metric_rejected.inc()
+        payload = self.construct_not_ok_response(None, "TM", server)
+        if self.pipeline and windowed:
+            self.queue_done.put(payload)
+        self.finish_command(future, payload)
+
+    def encode_unsent(self, message: Any, commands: list, windowed: bool = True) -> Optional[str]:
+        """
+        Return the JSON text of a command payload (see encode_command()). If it can not be encoded,
+        complete the commands of 'commands', (future, server) pairs, with BD without cid and return None.
+        """
+        try:
+            return self.encode_command(message)
+        except Exception as e:
+            logger.warning("MS: command not sent, its payload can not be encoded: %s", e)
+        for future, server in commands:
+            payload = self.construct_not_ok_response(None, "BD", server)
+            if self.pipeline and windowed:
+                self.queue_done.put(payload)
+            self.finish_command(future, payload)
+        return None
+
+    def pipelined_command_thread_runner(self, qcmd):
+        logger.info("MS pipelined command thread started (window %d)", self.window)
 
-            payload = self.add_data_type(topic, payload)
-            if payload is None:
-                # construct BD response
-                self.construct_not_ok_response(cid,"BD")
-                self.response_received.set()
+        while True:
+            # wait for a free slot in the in-flight window first, so as the command to send is
+            # chosen by priority when it can be sent, not before waiting for the slot
+            self.window_slots.acquire()
+
+            # waiting for a command
+            message = self.queue_cmd.get()
+            # check for exit
+            if message is None:
+                self.window_slots.release()
+                break
+
+            message, future, server, _, command_deadline, timeout = message
+            # skip commands cancelled by the caller before being sent
+            if not future.set_running_or_notify_cancel():
+                self.window_slots.release()
+                continue
+            if isinstance(server, Broadcast):
+                # the commands of a broadcast are sent at once, out of the window
+                self.window_slots.release()
+                self.send_broadcast_pipelined(message, server, command_deadline, timeout)
+                continue
+            # commands which can not be answered in time are not sent
+            if command_deadline is not None and time.monotonic() >= command_deadline:
+                self.window_slots.release()
+                self.expire_unsent(future, server)
                 continue
 
-            if not self.validate_json(data=payload):
-                # construct BD response
-                self.construct_not_ok_response(cid,"BD")
-                self.response_received.set()
+            # encoded before taking a cid and registering, a payload which can not be encoded
+            # fails this command only
+            text = self.encode_unsent(message, [(future, server)])
+            if text is None:
+                self.window_slots.release()
                 continue
 
-            # flag that response has received or generated timeout response
-            self.response = payload
-            self.response_received.set()
+            # a command id of the server, unless all of them are waiting for responses
+            try:
+                cid = self.cid_allocator.allocate(server)
+            except CidExhaustedError:
+                self.window_slots.release()
+                self.reject_unsent(future, server)
+                continue
 
-        logger.info("MS command thread exited")
+            # register the command before publishing so as a fast response finds it
+            with self.outstanding_lock:
+                server_outstanding = self.outstanding.setdefault(server, {})
+                sent_at = time.monotonic()
+                deadline = self.response_deadline(sent_at, command_deadline, timeout)
+                pending = PendingCommand(server, cid, deadline, future, sent_at)
+                server_outstanding[cid] = pending
+                wakeup = not self.deadlines or deadline < self.deadlines[0][0]
+                heapq.heappush(self.deadlines, (deadline, server, cid))
+
+            # let the response thread recalculate its waiting time
+            if wakeup:
+                self.queue_res.put(())
+
+            pending.topic = self.construct_cmd_topic(server=server)
+            pending.payload = self.add_tracking_information(payload=text, cid=cid)
+            self.mqtt_handler.publish_message(pending.topic, pending.payload)
+
+        logger.info("MS pipelined command thread exited")
+
+    def response_thread_runner(self, qres):
+        logger.info("MS response thread started")
+
+        while True:
+            # wait for a response not longer than the nearest deadline
+            with self.outstanding_lock:
+                timeout = max(self.deadlines[0][0] - time.monotonic(), 0) if self.deadlines else None
+            try:
+                message = self.queue_res.get(block=True, timeout=timeout)
+            except queue.Empty:
+                message = ()
+
+            # check for exit
+            if message is None:
+                break
+
+            if message:
+                self.process_pipelined_response(*message)
+
+            self.expire_outstanding()
+
+        logger.info("MS response thread exited")
+
+    def process_pipelined_response(self, topic: str, payload: str) -> None:
+        if codec.COMPILED:
+            # late or duplicated responses are dropped before parsing, by the envelope fields
+            envelope = codec.response_envelope(payload)
+            if envelope is not None and envelope[0] is not None:
+                server = self.server_from_topic(topic)
+                with self.outstanding_lock:
+                    known = envelope[0] in self.outstanding.get(server, ())
+                if not known:
+                    logger.info("MS: response of '%s' with unknown cid %d dropped (late or duplicated)", server, envelope[0])
+                    return
+
+        # convert payload to json object
+        try:
+            jpayload = json.loads(payload)
+        except json.JSONDecodeError as e:
+            logger.warning("MS: response with invalid JSON dropped: %s", e)
+            return
+
+        cid = jpayload.get('cid') if isinstance(jpayload, dict) else None
+        if not isinstance(cid, int):
+            logger.warning("MS: response without cid dropped")
+            return
+
+        # demultiplex by the server uuid segment of the topic, then by cid
+        server = self.server_from_topic(topic)
+        with self.outstanding_lock:
+            pending = self.pop_outstanding(server, cid)
+        if pending is None:
+            logger.info("MS: response of '%s' with unknown cid %d dropped (late or duplicated)", server, cid)
+            return
+
+        jpayload = self.add_data_type(topic, jpayload)
+        if jpayload is None or not self.validate_json(data=jpayload):
+            # construct BD response
+            self.complete_command(pending, self.construct_not_ok_response(cid, "BD", server))
+            return
+
+        self.complete_command(pending, jpayload)
+
+    def expire_outstanding(self) -> None:
+        now = time.monotonic()
+        expired = []
+        with self.outstanding_lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, server, cid = heapq.heappop(self.deadlines)
+                pending = self.outstanding.get(server, {}).get(cid)
+                # the cid may have been answered and reused by a newer command
+                if pending is not None and pending.deadline == deadline:
+                    self.pop_outstanding(server, cid)
+                    expired.append(pending)
+
+        for pending in expired:
+            logger.info("MS Timeout (server '%s', cid %d)", pending.server, pending.cid)
+            self.complete_command(pending, self.construct_not_ok_response(pending.cid, "TM", pending.server))
+
+    def pop_outstanding(self, server: str, cid: int) -> Optional[PendingCommand]:
+        # must be called with outstanding_lock held
+        server_outstanding = self.outstanding.get(server)
+        if server_outstanding is None:
+            return None
+        pending = server_outstanding.pop(cid, None)
+        if pending is not None:
+            # answered or expired, the cid returns to the pool
+            self.cid_allocator.release(cid, server)
+        if not server_outstanding:
+            # keep the table small when thousands of servers are addressed
+            del self.outstanding[server]
+        return pending
+
+    def on_connection_state(self, state: str) -> None:
+        # connection listener of the MQTT handler, called in its network thread
+        if state == DISCONNECTED and self.inflight_on_disconnect == 'expire':
+            self.expire_all_outstanding()
+        elif state == CONNECTED and self.inflight_on_disconnect == 'replay':
+            # publishing may wait for the in-flight window, not in the network thread
+            threading.Thread(target=self.replay_outstanding, daemon=True).start()
+
+    def expire_all_outstanding(self) -> None:
+        """
+        Complete all commands waiting for a response with TM, without waiting for their deadlines.
+        """
+        if not self.pipeline:
+            current = self.current_command
+            if current is not None:
+                self.queue_res.put((None, current[0]))
+            return
+
+        with self.outstanding_lock:
+            expired = [pending for server_outstanding in self.outstanding.values() for pending in server_outstanding.values()]
+            for pending in expired:
+                self.pop_outstanding(pending.server, pending.cid)
+        for pending in expired:
+            logger.info("MS Timeout (server '%s', cid %d): connection lost", pending.server, pending.cid)
+            self.complete_command(pending, self.construct_not_ok_response(pending.cid, "TM", pending.server))
+
+    def replay_outstanding(self) -> None:
+        """
+        Publish again the commands waiting for a response. They keep their cid and deadline.
+        """
+        if not self.pipeline:
+            current = self.current_command
+            commands = [current[1:]] if current is not None else []
+        else:
+            with self.outstanding_lock:
+                commands = [(pending.topic, pending.payload) for server_outstanding in self.outstanding.values()
+                            for pending in server_outstanding.values() if pending.topic]
+        if commands:
+            logger.info("MS replaying %d commands after reconnection", len(commands))
+        for topic, payload in commands:
+            self.mqtt_handler.publish_message(topic, payload)
+
+    def complete_command(self, pending: PendingCommand, payload: dict) -> None:
+        # free the slot in the in-flight window and publish the result
+        if pending.windowed:
+            self.window_slots.release()
+            self.queue_done.put(payload)
+        self.finish_command(pending.future, payload, pending.sent_at)
+
+    def send_broadcast(self, message: Any, broadcast: Broadcast, deadline: Optional[float], timeout: Optional[float]) -> None:
+        """
+        Sequential mode: publish the command to all servers of 'broadcast', then collect their
+        responses (one per server) until all have answered or the response deadline has passed.
+        """
+        servers = broadcast.start()
+        if deadline is not None and time.monotonic() >= deadline:
+            for server in servers:
+                self.expire_unsent(broadcast.futures[server], server, windowed=False)
+            return
+        # encoded once for all servers
+        text = self.encode_unsent(message, [(broadcast.futures[server], server) for server in servers], windowed=False)
+        if text is None:
+            return
+
+        sent_at = time.monotonic()
+        wait_until = self.response_deadline(sent_at, deadline, timeout)
+        waiting: Dict[str, int] = {}
+        for server in servers:
+            try:
+                cid = self.cid_allocator.allocate(server)
+            except CidExhaustedError:
+                self.reject_unsent(broadcast.futures[server], server, windowed=False)
+                continue
+            waiting[server] = cid
+            self.mqtt_handler.publish_message(self.construct_cmd_topic(server=server), self.add_tracking_information(payload=text, cid=cid))
+
+        while waiting:
+            # the results are partial at the deadline, also when responses are still queued
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                topic, payload = self.queue_res.get(block=True, timeout=remaining)
+            except queue.Empty:
+                break
+            if topic is None:
+                # expiry signal of a lost connection for a single command
+                continue
+            server = self.server_from_topic(topic)
+            cid = waiting.pop(server, None)
+            if cid is None:
+                logger.info("MS: response of server '%s' dropped, not waited for by the broadcast", server)
+                continue
+            self.cid_allocator.release(cid, server)
+            self.finish_command(broadcast.futures[server], self.checked_response(topic, payload, cid, server), sent_at)
+
+        # the servers which stayed silent
+        for server, cid in waiting.items():
+            self.cid_allocator.release(cid, server)
+            self.finish_command(broadcast.futures[server], self.construct_not_ok_response(cid, "TM", server), sent_at)
+        logger.info("MS: broadcast to %d servers completed, %d silent", len(servers), len(waiting))
+
+    def send_broadcast_pipelined(self, message: Any, broadcast: Broadcast, deadline: Optional[float], timeout: Optional[float]) -> None:
+        """
+        Pipelined mode: register and publish the command for all servers of 'broadcast'. The
+        responses are matched by the response thread, silent servers expire at the deadline.
+        """
+        servers = broadcast.start()
+        if deadline is not None and time.monotonic() >= deadline:
+            for server in servers:
+                self.expire_unsent(broadcast.futures[server], server, windowed=False)
+            return
+        # encoded once for all servers
+        text = self.encode_unsent(message, [(broadcast.futures[server], server) for server in servers], windowed=False)
+        if text is None:
+            return
+
+        pendings = []
+        rejected = []
+        with self.outstanding_lock:
+            sent_at = time.monotonic()
+            response_deadline = self.response_deadline(sent_at, deadline, timeout)
+            wakeup = not self.deadlines or response_deadline < self.deadlines[0][0]
+            for server in servers:
+                try:
+                    cid = self.cid_allocator.allocate(server)
+                except CidExhaustedError:
+                    # completed after releasing the lock, the callbacks of the futures may block
+                    rejected.append(server)
+                    continue
+                pending = PendingCommand(server, cid, response_deadline, broadcast.futures[server], sent_at, windowed=False)
+                self.outstanding.setdefault(server, {})[cid] = pending
+                heapq.heappush(self.deadlines, (response_deadline, server, cid))
+                pendings.append(pending)
+
+        for server in rejected:
+            self.reject_unsent(broadcast.futures[server], server, windowed=False)
+
+        # let the response thread recalculate its waiting time
+        if wakeup and pendings:
+            self.queue_res.put(())
+
+        for pending in pendings:
+            pending.topic = self.construct_cmd_topic(server=pending.server)
+            pending.payload = self.add_tracking_information(payload=text, cid=pending.cid)
+            self.mqtt_handler.publish_message(pending.topic, pending.payload)
 
     def unsolicited_thread_runner(self, qunsolicited):
         logger.info("MS unsolicited thread started")
@@ -250,70 +887,227 @@ class MSProtocol:
                 logger.warning("Received invalid JSON in unsolicited message: %s", e)
                 continue
 
-            validator = Draft7Validator(self.unsolicited_schema)
-            try:
-                validator.validate(instance=jpayload)
+            if self.validation != 'off':
+                error = schema_error(self.unsolicited_validator, jpayload)
+                if error is not None:
+                    logger.warning("Received invalid unsolicited message: %s", error)
+                    continue
+
+            if logger.isEnabledFor(logging.INFO):
                 logger.info("Received valid unsolicited message: %s", jpayload)
-                # Here you can add code to process the valid unsolicited message as needed
-                # here we can call a callback or put the message in another queue for processing
-                if self.process_unsolicited_message:
-                    self.process_unsolicited_message(jpayload)
-            except jsonschema.exceptions.ValidationError as err:
-                logger.warning("Received invalid unsolicited message: %s", err.message)
+            if self.unsolicited_worker_queues:
+                # the same source always goes to the same worker
+                src = str(jpayload.get('src', '')) if isinstance(jpayload, dict) else ''
+                shard = zlib.crc32(src.encode()) % len(self.unsolicited_worker_queues)
+                self.unsolicited_worker_queues[shard].put(jpayload)
+            else:
+                self.call_unsolicited_processor(jpayload)
 
         logger.info("MS unsolicited thread exited")
 
-    def add_tracking_information(self,payload):
-        payload = re.sub('({)', r'\1' + f'"client":"{self.config["mqttms"]["ms"].get("client_uuid","_")}",', payload)
-        payload = re.sub('({)', r'\1' + f'"cid":{self.generate_random_cid()},', payload)
-        return payload
+    def unsolicited_worker_runner(self, index: int, qworker) -> None:
+        logger.info("MS unsolicited worker %d started", index)
 
-    def construct_not_ok_response(self, cid: int, response: str):
+        while True:
+            message = qworker.get()
+            # check for exit
+            if message is None:
+                break
+            self.call_unsolicited_processor(message)
+
+        logger.info("MS unsolicited worker %d exited", index)
+
+    def call_unsolicited_processor(self, message: dict) -> None:
+        callback = self.process_unsolicited_message
+        if not callback:
+            return
+        try:
+            if self.unsolicited_process_pool is not None:
+                # wait for the result to keep the order of the messages of this worker's sources
+                self.unsolicited_process_pool.submit(callback, message).result()
+            else:
+                callback(message)
+        except Exception as e:
+            logger.error("MS: unsolicited message processor failed: %s", e, exc_info=True)
+
+    def unsolicited_queue_depths(self) -> list[int]:
+        """
+        Depths of the queues of the unsolicited workers (empty list if there is no worker pool).
+        """
+        return [worker_queue.qsize() for worker_queue in self.unsolicited_worker_queues]
+
+    def encode_command(self, payload: Union[str, Mapping[str, Any], Any]) -> str:
+        """
+        Return a command payload as JSON text, without the tracking fields.
+
+        Structured payloads (a mapping or a dataclass instance) are serialized by the configured
+        encoder, which raises if they can not be encoded. A str payload is returned as it is.
+        """
+        if isinstance(payload, str):
+            return payload
+        if not isinstance(payload, dict):
+            if dataclasses.is_dataclass(payload) and not isinstance(payload, type):
+                payload = dataclasses.asdict(payload)
+            payload = dict(payload)
+        if "cid" in payload or "client" in payload:
+            # the tracking fields are inserted into the text
+            payload = {key: value for key, value in payload.items() if key not in ("cid", "client")}
+        return self.encode(payload)
+
+    def add_tracking_information(self, payload: Union[str, Mapping[str, Any], Any], cid: Optional[int] = None) -> str:
+        """
+        Add the tracking fields "cid" and "client" to a command payload and return it as JSON text.
+
+        Structured payloads are serialized once by encode_command(). A str payload must be a JSON
+        object text; the fields are inserted into the outer object.
+        """
+        if cid is None:
+            cid = self.generate_random_cid()
+        payload = self.encode_command(payload)
+
+        # JSON text: insert after the opening brace of the outer object only
+        start = payload.find('{')
+        if start < 0:
+            logger.warning("MS: command payload is not a JSON object, no tracking information added")
+            return payload
+        rest = payload[start + 1:]
+        separator = '' if rest.lstrip().startswith('}') else ','
+        return f'{payload[:start + 1]}"cid":{cid},{self.client_field}{separator}{rest}'
+
+    def construct_not_ok_response(self, cid: Optional[int], response: str, server: Optional[str] = None) -> dict:
         payload = {}
-        payload["server"] = f'{self.config["mqttms"]["ms"].get("server_uuid", "_")}'
+        payload["server"] = server if server is not None else self.default_server
         payload["cid"] = cid
         payload["response"] = response
         payload["data"] = ""
         payload["dataType"] = "asciihex"
         self.response = payload
+        return payload
 
     def subscribe_all(self, timeout: float = 5.0):
+        # all 'subs_topics' in one SUBSCRIBE packet, acknowledged in one round trip
+        future = self.subscribe_all_nowait()
+        try:
+            codes = future.result(timeout=self.config['mqttms']['mqtt'].get('timeout', timeout))
+        except TimeoutError:
+            logger.warning("Subscription to 'subs_topics' was not acknowledged in time.")
+            return False
+        refused = [topic for topic, code in codes.items() if code >= SUBACK_UNSPECIFIED_ERROR]
+        for topic in refused:
+            logger.warning("Subscription to topic '%s' failed, reason code: %d", topic, codes[topic])
+        return not refused
+
+    def subscribe(self, topic: str, format: str, timeout: float = 5.0):
+        t = self.construct_subs_topic(topic, format)
+        return self.mqtt_handler.subscribe(t)
+
+    def subscribe_all_nowait(self) -> Future:
+        """
+        Send the subscriptions for all 'subs_topics' in one SUBSCRIBE packet without waiting
+        for the acknowledgment. Returns a Future resolving with the SUBACK reason code per
+        topic (granted QoS 0-2, or 0x80 and higher when refused).
+        """
+        subscriptions = []
         for topic in self.config['mqttms']['ms'].get('subs_topics', []):
             logger.info("Subscribing to topic: %s with format: %s", topic["topic"], topic["format"])
-            rtn = self.subscribe(topic["topic"], topic["format"], timeout)
-            if not rtn:
-                logger.warning("Subscription to topic '%s' with format '%s' failed.", topic["topic"], topic["format"])
-                return False
-        return True
+            subscriptions.append((self.construct_subs_topic(topic["topic"], topic["format"]), topic.get("qos", 0)))
+        return self.mqtt_handler.subscribe_many_nowait(subscriptions)
 
-    def subscribe(self, topic: str, format: str, timeout: float = 5.0):
-        t = topic.replace('server_uuid',self.config['mqttms']['ms']['server_uuid'])
+    def construct_subs_topic(self, topic: str, format: str) -> str:
+        # in multi-server mode one wildcard subscription covers all servers
+        t = topic.replace('server_uuid', '+' if self.multi_server else self.default_server)
         t = t.replace('format',format)
-        self.mqtt_handler.subscribe(t)
-
-        return bool(self.mqtt_handler.subscription_established.wait(timeout=self.config['mqttms']['mqtt'].get('timeout', timeout)))
+        return t
 
     def define_mqtt_handler(self,handler:MQTTHandler =None):
         self.mqtt_handler = handler
+        if hasattr(handler, 'add_connection_listener'):
+            handler.add_connection_listener(self.on_connection_state)
 
-    def construct_cmd_topic(self, format='ASCIIHEX'):
-        topic = self.config['mqttms']['ms']['cmd_topic'].replace('server_uuid',self.config['mqttms']['ms']['server_uuid'])
+    def construct_cmd_topic(self, format='ASCIIHEX', server: Optional[str] = None):
+        topic = self.config['mqttms']['ms']['cmd_topic'].replace('server_uuid', server if server is not None else self.default_server)
         topic = topic.replace('format',format)
         return topic
 
-    def put_command(self, payload):
-        self.queue_cmd.put(payload)
+    def server_from_topic(self, topic: str) -> str:
+        # topics have the form @/<server_uuid>/<RSP|USL>/<format>
+        return codec.topic_server(topic)
+
+    def put_command(self, payload, server: Optional[str] = None, priority: int = 0,
+                    deadline: Optional[float] = None, timeout: Optional[float] = None) -> Optional[Future]:
+        """
+        Queue a command for sending to 'server' (server uuid). When it is omitted,
+        the command goes to the configured 'server_uuid'.
+
+        The payload is a JSON object text or a structured object (dict or dataclass instance)
+        which is serialized once, together with the tracking information.
+
+        Commands of higher 'priority' are sent first, among equal priorities the one with the
+        earlier 'deadline', then in order of putting. 'deadline' is an absolute time.monotonic()
+        value: a command still queued at its deadline is completed with TM without being sent,
+        and a sent one waits for its response until the deadline at most. 'timeout' (seconds)
+        replaces 'ms.timeout' for this command.
+
+        Returns a concurrent.futures.Future that resolves with the validated response
+        of this command, or with a TM (timeout) / BD (bad data) response generated locally.
+        Putting None signals the command thread to exit and returns None.
+        """
+        if payload is None:
+            self.queue_cmd.close(None)
+            return None
+        if self.command_thread is None:
+            self.start()
+        future: Future = Future()
+        if not self.pipeline:
+            # get_response() waits for the response of this command
+            self.response_received.clear()
+        self.queue_cmd.put((payload, future, server if server is not None else self.default_server, priority, deadline, timeout))
+        return future
+
+    def broadcast(self, payload, servers: Iterable[str], deadline: Optional[float] = None,
+                  callback: Optional[Callable[[str, dict], None]] = None, priority: int = 0,
+                  timeout: Optional[float] = None) -> Broadcast:
+        """
+        Send the command 'payload' to every server in 'servers' and collect their responses
+        until 'deadline' (time.monotonic()), or 'timeout' / 'ms.timeout' after sending.
+
+        The commands are published together, not one after another, and the responses are
+        collected as they arrive; servers which do not answer in time get TM. The broadcast is
+        one entry of the command queue, scheduled by 'priority' and 'deadline' like put_command();
+        in pipelined mode its commands do not take slots of the in-flight window. 'callback' is
+        called with (server, response) for each server as it completes.
+
+        Returns a Broadcast with the partial and final results.
+        """
+        broadcast = Broadcast(servers, callback)
+        if not broadcast.servers:
+            return broadcast
+        if self.command_thread is None:
+            self.start()
+        self.queue_cmd.put((payload, broadcast.future, broadcast, priority, deadline, timeout))
+        return broadcast
 
     def put_response(self,message):
         self.queue_res.put(message)
 
     def get_response(self):
+        if self.pipeline:
+            # responses are returned in order of completion, not in order of sending
+            return self.queue_done.get()
         self.response_received.wait()
         return self.response
 
     def put_unsolicited(self, message):
+        if message is None:
+            self.queue_unsolicited.close(None)
+            return
         self.queue_unsolicited.put(message)
 
+    def drop_command(self, message: tuple) -> None:
+        # a command dropped by the command queue overflow policy is never sent
+        logger.warning("MS command dropped: command queue is full")
+        message[1].cancel()
+
     def get_unsolicited(self):
         return self.queue_unsolicited.get()
 
@@ -321,38 +1115,45 @@ class MSProtocol:
         return random.randint(0, 999)  # Generate a random, payload: dict
 
     def add_data_type(self, topic: str, payload: dict) -> None:
-        # Split the topic by '/'
-        topic_parts = topic.split('/')
+        # The format is the last element of a topic of at least 4 elements
+        format_part = codec.topic_format(topic)
 
-        # Ensure the topic has at least 4 elements and the last element is the format
-        if len(topic_parts) < 4:
+        # Map the format to the data type; other formats are not valid
+        data_type = codec.FORMAT_DATA_TYPES.get(format_part)
+        if data_type is None:
             return None
-
-        # Extract the format (last element of the topic)
-        format_part = topic_parts[-1]
-
-        # Check if the format part is in the array of valid formats
-        if format_part in self.valid_formats:
-            # Find the index in valid_formats and map to mapped_formats
-            # Note that valid_formats and mapped_formats are parallel arrays and are under control.
-            index = self.valid_formats.index(format_part)
-            payload["dataType"] = self.mapped_formats[index]
-            return payload
-        return None
+        payload["dataType"] = data_type
+        return payload
 
     def validate_json(self, data) -> bool:
-        validator = Draft7Validator(self.response_schema)
-        try:
-            validator.validate(instance=data)
-            logger.info("JSON validation : OK")
+        if self.validation == 'off':
             return True
-        except jsonschema.exceptions.ValidationError as err:
-            logger.info("JSON data is invalid: %s", err.message)
-            return False
+        start = time.perf_counter()
+        valid = True
+        if self.validation != 'fast' or not is_valid_response(data):
+            # full validation, also the fallback of the fast path to confirm rejection and get the reason
+            error = schema_error(self.response_validator, data)
+            if error is not None:
+                logger.info("JSON data is invalid: %s", error)
+                valid = False
+        self.metric_validation.observe(time.perf_counter() - start)
+        if valid and trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug("JSON validation : OK")
+        return valid
 
     def graceful_exit(self) -> None:
         self.put_command(None)
-        self.command_thread.join()
+        if self.command_thread:
+            self.command_thread.join()
+        if self.response_thread:
+            self.put_response(None)
+            self.response_thread.join()
         self.put_unsolicited(None)
-        self.unsolicited_thread.join()
+        if self.unsolicited_thread:
+            self.unsolicited_thread.join()
+        for worker_queue, worker_thread in zip(self.unsolicited_worker_queues, self.unsolicited_worker_threads):
+            worker_queue.close(None)
+            worker_thread.join()
+        if self.unsolicited_process_pool is not None:
+            self.unsolicited_process_pool.shutdown()
         logger.info("MS: graceful exited")
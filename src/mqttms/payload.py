@@ -0,0 +1,65 @@
+# payload.py
+
+from typing import Any, Union
+
+# decode_asciihex and decode_base64 are also exported from here
+from mqttms.codec import BytesLike, decode_asciihex, decode_base64, decode_asciihex_into, decode_base64_into
+
+# Helpers for payloads received in raw payload mode (bytes) and for the data of MS responses.
+# ASCIIHEX and base64 data are decoded straight into bytes without intermediate strings,
+# or into a buffer of the caller (response_data_into), by the compiled codec if it is built.
+
+def payload_text(payload: Union[str, BytesLike]) -> str:
+    """
+    Return the payload as text, decoding it if it is bytes (raw payload mode).
+    """
+    if isinstance(payload, str):
+        return payload
+    return str(payload, "utf-8")
+
+def response_data_bytes(response: dict) -> bytes:
+    """
+    Return the 'data' of a validated MS response as bytes, according to its 'dataType'.
+
+    Raises ValueError for responses with 'object' data, which have no binary form.
+    """
+    data_type = response.get("dataType")
+    data = response.get("data", "")
+    if data_type == "asciihex":
+        return decode_asciihex(data)
+    if data_type == "base64":
+        return decode_base64(data)
+    if data_type == "ascii":
+        return data.encode("ascii")
+    raise ValueError(f"Response data of type '{data_type}' cannot be converted to bytes")
+
+def response_data_into(response: dict, buffer: Any) -> int:
+    """
+    Decode the 'data' of a validated MS response into the writable buffer 'buffer' (bytearray,
+    memoryview, numpy array, ...) and return the number of bytes written. A buffer reused for
+    many responses saves an allocation per response.
+
+    Raises ValueError for responses with 'object' data and when the buffer is too small.
+    """
+    data_type = response.get("dataType")
+    data = response.get("data", "")
+    if data_type == "asciihex":
+        return decode_asciihex_into(data, buffer)
+    if data_type == "base64":
+        return decode_base64_into(data, buffer)
+    if data_type == "ascii":
+        encoded = data.encode("ascii")
+        target = memoryview(buffer).cast("B")
+        if len(encoded) > len(target):
+            raise ValueError(f"Buffer of {len(target)} bytes is too small for {len(encoded)} bytes")
+        target[:len(encoded)] = encoded
+        return len(encoded)
+    raise ValueError(f"Response data of type '{data_type}' cannot be converted to bytes")
+
+def response_data_array(response: dict, dtype: Any = "uint8") -> Any:
+    """
+    Return the 'data' of a validated MS response as a read-only numpy array of 'dtype'.
+    The array shares the memory of the decoded bytes, no copy is made.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+    return numpy.frombuffer(response_data_bytes(response), dtype=dtype)
@@ -0,0 +1,493 @@
+# simulator.py
+
+import sys
+import json
+import math
+import time
+import uuid
+import heapq
+import base64
+import random
+import string
+import argparse
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from mqttms.conferror import ConfigurationError
+from mqttms.transport import create_transport
+
+from mqttms.logger import get_app_logger
+
+logger = get_app_logger(__name__)
+
+# Simulator of MS servers (devices) for load testing the master side.
+#
+# A ServerFarm runs many virtual servers over a few MQTT connections, on a real broker or on the
+# loopback transport. Each virtual server receives commands on its command topic, answers on
+# @/<uuid>/RSP/<format> with the envelope of MSProtocol.response_schema (the master adds 'dataType'
+# from the topic) and emits unsolicited messages (the envelope of MSProtocol.unsolicited_schema) on
+# @/<uuid>/USL/JSON. The behaviour of a server is given by its profile:
+#
+#   {
+#       "format": "ASCIIHEX",                   # format of the responses: BINARY, ASCIIHEX, ASCII, JSON
+#       "latency": {"distribution": "lognormal", "median": 0.02, "sigma": 0.5, "max": 1.0},
+#       "payload_size": {"min": 16, "max": 256}, # bytes of response data (or an integer)
+#       "errors": {"NA": 0.01},                 # probability of answering with another response code
+#       "drop": 0.001,                          # probability of not answering (the master times out)
+#       "malformed": 0.001,                     # probability of an answer failing validation (BD)
+#       "usl_rate": 0.2,                        # unsolicited messages per second (Poisson process)
+#       "serial": False                         # True: commands of a server are processed one at a time
+#   }
+#
+# Latency distributions: a number (fixed), or {"distribution": ...} with fixed (value), uniform
+# (low, high), exponential (mean), normal (mean, stddev) or lognormal (median, sigma); "max" caps
+# any of them. Run as a program (python -m mqttms.simulator) it serves a broker until interrupted.
+
+RESPONSE_FORMATS = ("BINARY", "ASCIIHEX", "ASCII", "JSON")
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "normal", "lognormal")
+
+PROFILE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "format": {"type": "string", "enum": list(RESPONSE_FORMATS)},
+        "latency": {
+            "anyOf": [
+                {"type": "number", "minimum": 0},
+                {
+                    "type": "object",
+                    "properties": {
+                        "distribution": {"type": "string", "enum": list(LATENCY_DISTRIBUTIONS)},
+                        "value": {"type": "number", "minimum": 0},
+                        "low": {"type": "number", "minimum": 0},
+                        "high": {"type": "number", "minimum": 0},
+                        "mean": {"type": "number", "minimum": 0},
+                        "stddev": {"type": "number", "minimum": 0},
+                        "median": {"type": "number", "exclusiveMinimum": 0},
+                        "sigma": {"type": "number", "minimum": 0},
+                        "max": {"type": "number", "minimum": 0}
+                    },
+                    "required": ["distribution"],
+                    "additionalProperties": False
+                }
+            ]
+        },
+        "payload_size": {
+            "anyOf": [
+                {"type": "integer", "minimum": 0},
+                {
+                    "type": "object",
+                    "properties": {
+                        "min": {"type": "integer", "minimum": 0},
+                        "max": {"type": "integer", "minimum": 0}
+                    },
+                    "required": ["min", "max"],
+                    "additionalProperties": False
+                }
+            ]
+        },
+        "errors": {
+            "type": "object",
+            "additionalProperties": {"type": "number", "minimum": 0, "maximum": 1}
+        },
+        "drop": {"type": "number", "minimum": 0, "maximum": 1},
+        "malformed": {"type": "number", "minimum": 0, "maximum": 1},
+        "usl_rate": {"type": "number", "minimum": 0},
+        "serial": {"type": "boolean"}
+    },
+    "additionalProperties": False
+}
+
+def latency_sampler(spec: Any) -> Callable[[random.Random], float]:
+    """
+    Return a function which draws a latency (seconds) from the distribution 'spec' with a given rng.
+    """
+    if isinstance(spec, (int, float)):
+        value = float(spec)
+        return lambda rng: value
+    distribution = spec["distribution"]
+    if distribution == "fixed":
+        value = float(spec.get("value", 0.0))
+        sample = lambda rng: value
+    elif distribution == "uniform":
+        low, high = spec.get("low", 0.0), spec.get("high", 0.0)
+        sample = lambda rng: rng.uniform(low, high)
+    elif distribution == "exponential":
+        mean = spec.get("mean", 0.0)
+        sample = lambda rng: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    elif distribution == "normal":
+        mean, stddev = spec.get("mean", 0.0), spec.get("stddev", 0.0)
+        sample = lambda rng: max(0.0, rng.gauss(mean, stddev))
+    elif distribution == "lognormal":
+        mu, sigma = math.log(spec.get("median", 1.0)), spec.get("sigma", 0.0)
+        sample = lambda rng: rng.lognormvariate(mu, sigma)
+    else:
+        raise ConfigurationError(f"Unknown latency distribution '{distribution}'", key="latency.distribution", value=distribution)
+    if "max" in spec:
+        cap = spec["max"]
+        return lambda rng: min(cap, sample(rng))
+    return sample
+
+def server_uuids(count: int, seed: Optional[int] = None) -> List[str]:
+    """
+    Return 'count' version 4 UUIDs, the same ones for the same seed, so as a master can compute
+    the servers of a farm started with that seed.
+    """
+    rng = random.Random(seed)
+    return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(count)]
+
+class ServerProfile:
+    """
+    Behaviour of virtual servers, built from a profile dictionary (see the top of this module).
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        # pylint: disable=import-outside-toplevel
+        from mqttms.ms_protocol import compile_schema, schema_error
+        error = schema_error(compile_schema(PROFILE_SCHEMA), config)
+        if error is not None:
+            raise ConfigurationError(f"Invalid server profile: {error}")
+        self.config = config
+        self.format = config.get("format", "ASCIIHEX")
+        self.latency = latency_sampler(config.get("latency", 0.0))
+        size = config.get("payload_size", 16)
+        self.payload_min, self.payload_max = (size, size) if isinstance(size, int) else (size["min"], max(size["min"], size["max"]))
+        self.errors = list(config.get("errors", {}).items())
+        self.drop = config.get("drop", 0.0)
+        self.malformed = config.get("malformed", 0.0)
+        self.usl_rate = config.get("usl_rate", 0.0)
+        self.serial = config.get("serial", False)
+
+class VirtualServer:
+    __slots__ = ("uuid", "profile", "connection", "busy_until", "usl_id")
+
+    def __init__(self, server_uuid: str, profile: ServerProfile, connection: "FarmConnection"):
+        self.uuid = server_uuid
+        self.profile = profile
+        self.connection = connection
+        # end of the processing of the last command of a serial server
+        self.busy_until = 0.0
+        self.usl_id = 0
+
+class FarmConnection:
+    """
+    One MQTT connection of a ServerFarm, serving the commands of a part of its servers.
+    """
+
+    def __init__(self, farm: "ServerFarm", index: int):
+        self.farm = farm
+        self.index = index
+        self.client_id = f"{farm.client_id}-{index}"
+        self.client = create_transport({"mqttms": {"mqtt": {**farm.mqtt_config, "client_id": self.client_id}}})
+        self.connected = threading.Event()
+        self.filters: List[str] = []
+        self.lock = threading.Lock()
+
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+
+    def start(self) -> None:
+        mqtt_config = self.farm.mqtt_config
+        self.client.username_pw_set(mqtt_config.get("username") or None, mqtt_config.get("password") or None)
+        self.client.connect(mqtt_config.get("host", "localhost"), mqtt_config.get("port", 1883), mqtt_config.get("keepalive", 60))
+        self.client.loop_start()
+
+    def stop(self) -> None:
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def add_filters(self, filters: List[str]) -> None:
+        with self.lock:
+            self.filters.extend(filters)
+        if self.connected.is_set():
+            self.subscribe(filters)
+
+    def subscribe(self, filters: List[str]) -> None:
+        # in chunks, so as no SUBSCRIBE packet is too large for the broker
+        qos = self.farm.qos
+        for start in range(0, len(filters), 500):
+            self.client.subscribe([(topic_filter, qos) for topic_filter in filters[start:start + 500]])
+
+    def on_connect(self, client, userdata, flags, reason_code, properties=None) -> None:
+        if reason_code != 0:
+            logger.warning("Simulator connection %s refused: %s", self.client_id, reason_code)
+            return
+        # (re)subscribe the command topics of all servers of this connection
+        with self.lock:
+            filters = list(self.filters)
+        self.subscribe(filters)
+        self.connected.set()
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties=None) -> None:
+        self.connected.clear()
+
+    def on_message(self, client, userdata, message) -> None:
+        self.farm.handle_command(message.topic, message.payload)
+
+class ServerFarm:
+    """
+    Virtual MS servers for load testing the master side.
+
+    'config' has the keys of 'mqtt' of the MQTTms configuration (host, port, username, password,
+    client_id, transport, loopback) and optionally:
+    - connections: number of MQTT connections the servers are spread over (default 1),
+    - qos: QoS of subscriptions and of published responses and unsolicited messages (default 0),
+    - cmd_topic, rsp_topic, usl_topic: topic templates with 'server_uuid' and 'format'
+      (defaults '@/server_uuid/CMD/format', '@/server_uuid/RSP/format', '@/server_uuid/USL/format').
+    With 'seed' the server UUIDs, latencies, payloads and errors are reproducible.
+    """
+
+    def __init__(self, config: Dict, seed: Optional[int] = None):
+        self.mqtt_config = config
+        self.client_id = config.get("client_id") or "ms-simulator"
+        self.qos = config.get("qos", 0)
+        self.cmd_topic = config.get("cmd_topic", "@/server_uuid/CMD/format")
+        self.rsp_topic = config.get("rsp_topic", "@/server_uuid/RSP/format")
+        self.usl_topic = config.get("usl_topic", "@/server_uuid/USL/format")
+        # position of the server uuid in the command topics
+        self.server_level = self.cmd_topic.split('/').index("server_uuid")
+
+        self.seed = seed
+        self.uuid_rng = random.Random(seed)
+        self.rng = random.Random(seed)
+        self.servers: Dict[str, VirtualServer] = {}
+        self.connections = [FarmConnection(self, index) for index in range(max(1, config.get("connections", 1)))]
+        # response data per (format, size), generated once
+        self.data_cache: Dict[tuple, Any] = {}
+
+        # scheduled actions: heap of (due time, sequence, action, server, argument)
+        self.events: list = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.scheduler_thread: Optional[threading.Thread] = None
+        self.running = False
+        self.started_at = 0.0
+        self.stats = {"commands": 0, "responses": 0, "errors": 0, "dropped": 0, "malformed": 0, "unsolicited": 0, "unknown": 0}
+
+    def add_servers(self, count: int, profile: Optional[Dict] = None, uuids: Optional[List[str]] = None) -> List[str]:
+        """
+        Add 'count' virtual servers with 'profile' (UUIDs are generated from the seed of the farm
+        unless given in 'uuids') and return their UUIDs. Servers can be added to a running farm.
+        """
+        server_profile = profile if isinstance(profile, ServerProfile) else ServerProfile(profile)
+        if uuids is None:
+            uuids = [str(uuid.UUID(int=self.uuid_rng.getrandbits(128), version=4)) for _ in range(count)]
+        filters: Dict[int, List[str]] = {}
+        with self.condition:
+            for server_uuid in uuids:
+                connection = self.connections[len(self.servers) % len(self.connections)]
+                server = VirtualServer(server_uuid, server_profile, connection)
+                self.servers[server_uuid] = server
+                topic_filter = self.cmd_topic.replace("server_uuid", server_uuid).replace("format", "+")
+                filters.setdefault(connection.index, []).append(topic_filter)
+                if self.running:
+                    self.schedule_unsolicited(server, time.monotonic())
+        for index, connection_filters in filters.items():
+            self.connections[index].add_filters(connection_filters)
+        return list(uuids)
+
+    def start(self, timeout: float = 10.0) -> bool:
+        """
+        Connect the servers to the broker and start serving. Returns False if a connection
+        was not established within 'timeout' seconds.
+        """
+        with self.condition:
+            if self.running:
+                return True
+            self.running = True
+            self.started_at = time.monotonic()
+            for server in self.servers.values():
+                self.schedule_unsolicited(server, self.started_at)
+        self.scheduler_thread = threading.Thread(target=self.scheduler_runner, name="ms-simulator", daemon=True)
+        self.scheduler_thread.start()
+        for connection in self.connections:
+            connection.start()
+        deadline = time.monotonic() + timeout
+        connected = all(connection.connected.wait(max(0.0, deadline - time.monotonic())) for connection in self.connections)
+        logger.info("Simulator started %d servers on %d connections", len(self.servers), len(self.connections))
+        return connected
+
+    def stop(self) -> None:
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        if self.scheduler_thread is not None:
+            self.scheduler_thread.join()
+            self.scheduler_thread = None
+        for connection in self.connections:
+            connection.stop()
+        logger.info("Simulator stopped: %s", self.stats)
+
+    def __enter__(self) -> "ServerFarm":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    # ---- commands ----
+
+    def handle_command(self, topic: str, payload: bytes) -> None:
+        levels = topic.split('/')
+        server = self.servers.get(levels[self.server_level]) if len(levels) > self.server_level else None
+        try:
+            command = json.loads(payload)
+            cid = command["cid"]
+        except (ValueError, TypeError, KeyError):
+            cid = None
+        with self.condition:
+            if server is None or cid is None:
+                self.stats["unknown"] += 1
+                return
+            self.stats["commands"] += 1
+            profile = server.profile
+            rng = self.rng
+            if profile.drop and rng.random() < profile.drop:
+                self.stats["dropped"] += 1
+                return
+            now = time.monotonic()
+            start = max(now, server.busy_until) if profile.serial else now
+            due = start + profile.latency(rng)
+            if profile.serial:
+                server.busy_until = due
+            self.push(due, self.send_response, server, self.make_response(server, cid))
+
+    def make_response(self, server: VirtualServer, cid: Any) -> str:
+        # called with the lock held, the rng is shared
+        profile = server.profile
+        rng = self.rng
+        if profile.malformed and rng.random() < profile.malformed:
+            self.stats["malformed"] += 1
+            # a response code of 3 letters fails the validation of the response schema
+            return json.dumps({"cid": cid, "server": server.uuid, "response": "BAD", "data": ""})
+        for code, probability in profile.errors:
+            if rng.random() < probability:
+                self.stats["errors"] += 1
+                return json.dumps({"cid": cid, "server": server.uuid, "response": code, "data": self.response_data(profile.format, 0)})
+        size = profile.payload_min if profile.payload_min == profile.payload_max else rng.randint(profile.payload_min, profile.payload_max)
+        return json.dumps({"cid": cid, "server": server.uuid, "response": "OK", "data": self.response_data(profile.format, size)})
+
+    def response_data(self, response_format: str, size: int) -> Any:
+        key = (response_format, size)
+        data = self.data_cache.get(key)
+        if data is None:
+            raw = random.Random(size).randbytes(size)
+            if response_format == "ASCIIHEX":
+                data = raw.hex().upper()
+            elif response_format == "BINARY":
+                data = base64.b64encode(raw).decode("ascii")
+            else:
+                text = "".join(string.ascii_letters[byte % 52] for byte in raw)
+                data = text if response_format == "ASCII" else {"text": text}
+            self.data_cache[key] = data
+        return data
+
+    def send_response(self, server: VirtualServer, payload: str) -> None:
+        if not server.connection.connected.is_set():
+            # the command was lost with the connection
+            return
+        topic = self.rsp_topic.replace("server_uuid", server.uuid).replace("format", server.profile.format)
+        server.connection.client.publish(topic, payload, qos=self.qos)
+        self.stats["responses"] += 1
+
+    # ---- unsolicited messages ----
+
+    def schedule_unsolicited(self, server: VirtualServer, now: float) -> None:
+        # called with the lock held; exponential intervals make a Poisson process of 'usl_rate'
+        rate = server.profile.usl_rate
+        if rate > 0:
+            self.push(now + self.rng.expovariate(rate), self.send_unsolicited, server, None)
+
+    def send_unsolicited(self, server: VirtualServer, _: Any) -> None:
+        if not server.connection.connected.is_set():
+            # skipped while disconnected, the process goes on
+            with self.condition:
+                self.schedule_unsolicited(server, time.monotonic())
+            return
+        server.usl_id += 1
+        message = {
+            "ver": "1.0",
+            "type": "event",
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "id": server.usl_id,
+            "severity": "info",
+            "src": server.uuid,
+            "data": {"seq": server.usl_id}
+        }
+        topic = self.usl_topic.replace("server_uuid", server.uuid).replace("format", "JSON")
+        server.connection.client.publish(topic, json.dumps(message), qos=self.qos)
+        with self.condition:
+            self.stats["unsolicited"] += 1
+            self.schedule_unsolicited(server, time.monotonic())
+
+    # ---- scheduler ----
+
+    def push(self, due: float, action: Callable, server: VirtualServer, argument: Any) -> None:
+        # called with the lock held
+        self.sequence += 1
+        heapq.heappush(self.events, (due, self.sequence, action, server, argument))
+        if self.events[0][1] == self.sequence:
+            self.condition.notify()
+
+    def scheduler_runner(self) -> None:
+        while True:
+            with self.condition:
+                while self.running:
+                    now = time.monotonic()
+                    if self.events and self.events[0][0] <= now:
+                        break
+                    self.condition.wait(self.events[0][0] - now if self.events else None)
+                if not self.running:
+                    break
+                due = []
+                while self.events and self.events[0][0] <= now:
+                    due.append(heapq.heappop(self.events))
+            for _, _, action, server, argument in due:
+                action(server, argument)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="MS server simulator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username", default="")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--client-id", default="ms-simulator")
+    parser.add_argument("--servers", type=int, default=100, help="number of virtual servers")
+    parser.add_argument("--connections", type=int, default=1, help="MQTT connections the servers are spread over")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    parser.add_argument("--seed", type=int, default=None, help="seed of UUIDs, latencies and errors")
+    parser.add_argument("--profile", default="{}", help="server profile as JSON text, or @file with it")
+    parser.add_argument("--uuids", default=None, help="file to write the UUIDs of the servers to")
+    args = parser.parse_args()
+
+    profile_text = args.profile
+    if profile_text.startswith("@"):
+        with open(profile_text[1:], "r", encoding="utf-8") as f:
+            profile_text = f.read()
+    config = {"host": args.host, "port": args.port, "username": args.username, "password": args.password,
+              "client_id": args.client_id, "connections": args.connections, "qos": args.qos}
+    farm = ServerFarm(config, seed=args.seed)
+    uuids = farm.add_servers(args.servers, json.loads(profile_text))
+    if args.uuids:
+        with open(args.uuids, "w", encoding="utf-8") as f:
+            f.write("\n".join(uuids) + "\n")
+    if not farm.start():
+        print("Simulator: connection to the broker failed", file=sys.stderr)
+        farm.stop()
+        return 1
+    print(f"Simulator: {len(uuids)} servers running, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Simulator: {farm.stats}")
+    except KeyboardInterrupt:
+        pass
+    farm.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
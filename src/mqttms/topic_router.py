@@ -0,0 +1,114 @@
+# topic_router.py
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RouteHandler = Callable[[Tuple[str, str]], Any]
+
+class _RouteNode:
+    __slots__ = ("children", "plus", "hash_handlers", "handlers")
+
+    def __init__(self) -> None:
+        # exact topic levels
+        self.children: Dict[str, "_RouteNode"] = {}
+        # '+' single level wildcard
+        self.plus: Optional["_RouteNode"] = None
+        # handlers of a '#' multi level wildcard that follows this level
+        self.hash_handlers: List[RouteHandler] = []
+        # handlers of filters that end at this level
+        self.handlers: List[RouteHandler] = []
+
+class TopicRouter:
+    """
+    Router of MQTT topics to handlers.
+
+    Topic filters are compiled once into a trie over topic levels with support of MQTT
+    wildcards '+' (single level) and '#' (multi level, last level only). Matching a topic
+    walks the trie once, level by level, so its cost does not depend on the number of routes.
+    """
+
+    def __init__(self) -> None:
+        self.root = _RouteNode()
+
+    @staticmethod
+    def _check_filter(topic_filter: str) -> List[str]:
+        levels = topic_filter.split('/')
+        for i, level in enumerate(levels):
+            if level == '#' and i != len(levels) - 1:
+                raise ValueError(f"'#' must be the last level of topic filter '{topic_filter}'")
+            if level not in ('+', '#') and ('+' in level or '#' in level):
+                raise ValueError(f"Wildcards must occupy a whole level in topic filter '{topic_filter}'")
+        return levels
+
+    def add_route(self, topic_filter: str, handler: RouteHandler) -> None:
+        """
+        Register 'handler' for messages whose topic matches 'topic_filter'.
+        The handler is called with the message tuple (topic, payload).
+        """
+        node = self.root
+        for level in self._check_filter(topic_filter):
+            if level == '#':
+                node.hash_handlers.append(handler)
+                return
+            if level == '+':
+                if node.plus is None:
+                    node.plus = _RouteNode()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _RouteNode())
+        node.handlers.append(handler)
+
+    def remove_route(self, topic_filter: str, handler: RouteHandler) -> bool:
+        """
+        Unregister 'handler' from 'topic_filter'. Returns True if the route existed.
+        """
+        node: Optional[_RouteNode] = self.root
+        for level in self._check_filter(topic_filter):
+            if node is None:
+                return False
+            if level == '#':
+                if handler in node.hash_handlers:
+                    node.hash_handlers.remove(handler)
+                    return True
+                return False
+            node = node.plus if level == '+' else node.children.get(level)
+        if node is None or handler not in node.handlers:
+            return False
+        node.handlers.remove(handler)
+        return True
+
+    def match(self, topic: str) -> List[RouteHandler]:
+        """
+        Return the handlers of all filters that match 'topic', in order of registration per filter.
+        """
+        levels = topic.split('/')
+        matched: List[RouteHandler] = []
+        nodes = [self.root]
+        for i, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # wildcards do not match topics starting with '$' at the first level
+                if i > 0 or not level.startswith('$'):
+                    if node.hash_handlers:
+                        matched.extend(node.hash_handlers)
+                    if node.plus is not None:
+                        next_nodes.append(node.plus)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            if not next_nodes:
+                return matched
+            nodes = next_nodes
+        for node in nodes:
+            matched.extend(node.handlers)
+            # 'a/#' matches 'a' as well
+            matched.extend(node.hash_handlers)
+        return matched
+
+    def dispatch(self, message: Tuple[str, str]) -> bool:
+        """
+        Call all handlers matching the topic of 'message'. Returns True if at least one matched.
+        """
+        handlers = self.match(message[0])
+        for handler in handlers:
+            handler(message)
+        return bool(handlers)
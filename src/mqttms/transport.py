@@ -0,0 +1,44 @@
+# transport.py
+
+from typing import Any, Callable, Dict
+
+from mqttms.conferror import ConfigurationError
+
+# The transport of MQTTHandler is the MQTT client object it drives. It has the interface of
+# paho.mqtt.client.Client (callback API version 2) used by MQTTHandler: connect / connect_async /
+# reconnect / disconnect, loop / loop_start / loop_stop, publish, subscribe, unsubscribe,
+# username_pw_set and the on_* callback attributes.
+#
+# 'mqtt.transport' selects the factory which creates the client: 'paho' (default), 'loopback'
+# (in-process broker, see loopback.py) or a name registered with register_transport().
+
+TransportFactory = Callable[[Dict], Any]
+
+_transports: Dict[str, TransportFactory] = {}
+
+def register_transport(name: str, factory: TransportFactory) -> None:
+    """
+    Register 'factory', called with the whole configuration, as the transport 'name'.
+    """
+    _transports[name] = factory
+
+def create_transport(config: Dict) -> Any:
+    name = config['mqttms']['mqtt'].get('transport', 'paho')
+    factory = _transports.get(name)
+    if factory is None:
+        raise ConfigurationError(f"Unknown MQTT transport '{name}'")
+    return factory(config)
+
+def paho_transport(config: Dict) -> Any:
+    import paho.mqtt.client as mqtt  # pylint: disable=import-outside-toplevel
+    return mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=config['mqttms']['mqtt']['client_id'], protocol=mqtt.MQTTv5)
+
+def loopback_transport(config: Dict) -> Any:
+    # pylint: disable=import-outside-toplevel
+    from mqttms.loopback import LoopbackClient, get_broker
+    options = dict(config['mqttms']['mqtt'].get('loopback', {}))
+    broker = get_broker(options.pop('broker', 'default'), **options)
+    return LoopbackClient(broker, config['mqttms']['mqtt']['client_id'])
+
+register_transport('paho', paho_transport)
+register_transport('loopback', loopback_transport)
@@ -0,0 +1,119 @@
+# conftest.py
+
+# Fixtures of the test suite: MQTTms sessions and simulated MS servers (mqttms.simulator) on
+# the in-process loopback transport, so as no broker is needed. Every test gets its own
+# loopback broker.
+
+import itertools
+import json
+import threading
+from typing import Callable, Dict, List
+
+import pytest
+
+from mqttms import MQTTms
+from mqttms.loopback import LoopbackClient, get_broker, remove_broker
+from mqttms.simulator import ServerFarm
+
+_brokers = itertools.count()
+
+@pytest.fixture
+def broker_name():
+    name = f"test-broker-{next(_brokers)}"
+    yield name
+    remove_broker(name)
+
+def mqtt_config(broker_name: str, client_id: str) -> Dict:
+    return {"host": "localhost", "port": 1883, "username": "", "password": "", "client_id": client_id,
+            "timeout": 5.0, "transport": "loopback", "loopback": {"broker": broker_name},
+            "reconnect": {"min_delay": 0.05, "max_delay": 0.2, "jitter": "equal"}}
+
+@pytest.fixture
+def make_farm(broker_name):
+    """
+    Factory of started ServerFarm objects: make_farm(count, profile) returns (farm, server uuids).
+    """
+    farms: List[ServerFarm] = []
+
+    def factory(count: int = 1, profile: Dict = None):
+        farm = ServerFarm(mqtt_config(broker_name, f"farm-{len(farms)}"), seed=len(farms) + 1)
+        servers = farm.add_servers(count, profile)
+        farms.append(farm)
+        assert farm.start(timeout=5.0)
+        return farm, servers
+
+    yield factory
+    for farm in farms:
+        farm.stop()
+
+@pytest.fixture
+def make_config(broker_name):
+    """
+    Factory of MQTTms configurations: make_config(client_id, metrics=None, **ms) with the 'metrics'
+    section and keys of the 'ms' section. The sessions address many servers ('multi_server').
+    """
+    def factory(client_id: str, metrics: Dict = None, **ms) -> Dict:
+        config = {
+            "mqtt": mqtt_config(broker_name, client_id),
+            "ms": {"client_uuid": "c", "server_uuid": "_", "cmd_topic": "@/server_uuid/CMD/format",
+                   "subs_topics": [{"topic": "@/server_uuid/RSP/format", "format": "ASCIIHEX"}],
+                   "timeout": 2.0, "multi_server": True, **ms}
+        }
+        if metrics is not None:
+            config["metrics"] = metrics
+        return config
+
+    return factory
+
+@pytest.fixture
+def make_mqttms(make_config):
+    """
+    Factory of connected and subscribed MQTTms sessions: make_mqttms(metrics=None, **ms), see make_config.
+    """
+    sessions: List[MQTTms] = []
+
+    def factory(**ms) -> MQTTms:
+        session = MQTTms(make_config(f"master-{len(sessions)}", **ms), {"verbose": 0})
+        sessions.append(session)
+        assert session.connect_mqtt_broker()
+        assert session.subscribe_all()
+        return session
+
+    yield factory
+    for session in sessions:
+        session.graceful_exit()
+
+class Sniffer:
+    """
+    Loopback client recording the commands published to the servers, in order of publishing.
+    """
+
+    def __init__(self, broker_name: str):
+        self.commands: List[Dict] = []
+        self.lock = threading.Lock()
+        self.subscribed = threading.Event()
+        self.client = LoopbackClient(get_broker(broker_name), "sniffer")
+        self.client.on_message = self.on_message
+        self.client.on_subscribe = lambda *args: self.subscribed.set()
+        self.client.connect()
+        self.client.loop_start()
+        self.client.subscribe("@/+/CMD/#", 0)
+        assert self.subscribed.wait(5.0)
+
+    def on_message(self, client, userdata, message) -> None:
+        with self.lock:
+            self.commands.append({"server": message.topic.split('/')[1], **json.loads(message.payload)})
+
+    def recorded(self, predicate: Callable[[Dict], bool] = lambda command: True) -> List[Dict]:
+        with self.lock:
+            return [command for command in self.commands if predicate(command)]
+
+    def stop(self) -> None:
+        self.client.disconnect()
+        self.client.loop_stop()
+
+@pytest.fixture
+def sniffer(broker_name):
+    recorder = Sniffer(broker_name)
+    yield recorder
+    recorder.stop()
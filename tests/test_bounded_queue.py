@@ -0,0 +1,80 @@
+# test_bounded_queue.py
+
+import queue
+import threading
+
+import pytest
+
+from mqttms.bounded_queue import BoundedQueue, PriorityBoundedQueue, make_queue
+
+def drain(q: queue.Queue) -> list:
+    items = []
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            return items
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(ValueError):
+        BoundedQueue(maxsize=1, policy="drop_random")
+
+def test_drop_oldest():
+    dropped = []
+    q = BoundedQueue(maxsize=2, policy="drop_oldest", on_drop=dropped.append)
+    for item in range(4):
+        q.put(item)
+    assert drain(q) == [2, 3]
+    assert dropped == [0, 1]
+    assert q.stats()["dropped"] == 2
+
+def test_drop_newest():
+    dropped = []
+    q = BoundedQueue(maxsize=2, policy="drop_newest", on_drop=dropped.append)
+    for item in range(4):
+        q.put(item)
+    assert drain(q) == [0, 1]
+    assert dropped == [2, 3]
+
+def test_block_waits_for_space():
+    q = BoundedQueue(maxsize=1, policy="block")
+    q.put(1)
+    with pytest.raises(queue.Full):
+        q.put(2, timeout=0.05)
+    threading.Timer(0.05, q.get).start()
+    q.put(3, timeout=2.0)
+    assert drain(q) == [3]
+
+def test_close_ignores_the_limit_and_drops_later_items():
+    dropped = []
+    q = BoundedQueue(maxsize=1, policy="block", on_drop=dropped.append)
+    q.put(1)
+    q.close(None)
+    q.put(2)
+    assert drain(q) == [1, None]
+    assert dropped == [2]
+
+def test_priority_order_and_fifo_among_equal_keys():
+    q = PriorityBoundedQueue(key=lambda item: item[0])
+    for item in [(2, "a"), (1, "b"), (2, "c"), (1, "d")]:
+        q.put(item)
+    assert drain(q) == [(1, "b"), (1, "d"), (2, "a"), (2, "c")]
+
+def test_priority_drop_oldest_drops_the_least_urgent():
+    dropped = []
+    q = PriorityBoundedQueue(key=lambda item: item[0], maxsize=3, policy="drop_oldest", on_drop=dropped.append)
+    for item in [(1, "a"), (3, "b"), (3, "c")]:
+        q.put(item)
+    # the oldest of the least urgent items makes room
+    q.put((2, "d"))
+    assert dropped == [(3, "b")]
+    # a new item less urgent than all queued ones is the one dropped
+    q.put((9, "e"))
+    assert dropped == [(3, "b"), (9, "e")]
+    assert drain(q) == [(1, "a"), (2, "d"), (3, "c")]
+
+def test_make_queue():
+    assert isinstance(make_queue(None, "q"), BoundedQueue)
+    q = make_queue({"maxsize": 5, "policy": "drop_newest"}, "q", key=lambda item: item)
+    assert isinstance(q, PriorityBoundedQueue)
+    assert q.stats() == {"depth": 0, "maxsize": 5, "policy": "drop_newest", "dropped": 0}
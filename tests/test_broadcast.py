@@ -0,0 +1,117 @@
+# test_broadcast.py
+
+import asyncio
+import time
+
+import pytest
+
+from mqttms import AsyncMQTTms
+
+MODES = [pytest.param(False, id="sequential"), pytest.param(True, id="pipelined")]
+
+def wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_partial_results_with_silent_servers(make_farm, make_mqttms, pipeline):
+    _, answering = make_farm(4, {"latency": 0.01})
+    _, silent = make_farm(2, {"drop": 1.0})
+    session = make_mqttms(pipeline=pipeline)
+    arrivals = []
+    broadcast = session.broadcast({"command": "status"}, answering + silent, deadline=time.monotonic() + 0.5,
+                                  callback=lambda server, response: arrivals.append(server))
+    iterated = dict(broadcast)
+    results = broadcast.result(5)
+
+    assert set(results) == set(answering + silent)
+    assert all(results[server]["response"] == "OK" for server in answering)
+    assert all(results[server]["response"] == "TM" for server in silent)
+    assert sorted(broadcast.silent()) == sorted(silent)
+    assert iterated == results
+    assert sorted(arrivals) == sorted(results)
+    # the commands of the broadcast do not stay in flight
+    assert session.ms_protocol.cid_allocator.occupancy() == 0
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_duplicated_and_no_servers(make_farm, make_mqttms, pipeline):
+    _, servers = make_farm(1)
+    session = make_mqttms(pipeline=pipeline)
+    assert session.broadcast({"command": "status"}, []).result(1) == {}
+    results = session.broadcast({"command": "status"}, servers * 3).result(5)
+    assert list(results) == servers
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_broadcast_past_its_deadline_is_not_sent(make_farm, make_mqttms, sniffer, pipeline):
+    _, servers = make_farm(2)
+    session = make_mqttms(pipeline=pipeline)
+    results = session.broadcast({"command": "status"}, servers, deadline=time.monotonic() - 1).result(5)
+    assert [response["response"] for response in results.values()] == ["TM", "TM"]
+    assert all(response["cid"] is None for response in results.values())
+    assert not sniffer.recorded()
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_cancelled_server_does_not_stop_the_command_threads(make_farm, make_mqttms, sniffer, pipeline):
+    _, slow = make_farm(1, {"latency": 0.2})
+    _, servers = make_farm(3, {"latency": 0.05})
+    session = make_mqttms(pipeline=pipeline, window=1)
+    # the broadcast stays queued behind this command
+    blocker = session.ms_protocol.put_command({"name": "blocker"}, server=slow[0])
+    broadcast = session.broadcast({"name": "broadcast"}, servers)
+    assert broadcast.futures[servers[0]].cancel()
+    results = broadcast.result(5)
+    assert sorted(results) == sorted(servers[1:])
+    assert blocker.result(5)["response"] == "OK"
+    assert servers[0] not in [command["server"] for command in sniffer.recorded(lambda command: command["name"] == "broadcast")]
+
+    # once sent, the futures of the servers can not be cancelled any more
+    broadcast = session.broadcast({"name": "sent"}, servers)
+    assert wait_for(lambda: len(sniffer.recorded(lambda command: command["name"] == "sent")) == 3)
+    assert not broadcast.futures[servers[1]].cancel()
+    assert all(response["response"] == "OK" for response in broadcast.result(5).values())
+    assert session.ms_protocol.put_command({"name": "next"}, server=servers[2]).result(5)["response"] == "OK"
+
+def test_server_without_a_free_cid_gets_tm(make_farm, make_mqttms):
+    _, silent = make_farm(1, {"drop": 1.0})
+    _, answering = make_farm(1)
+    session = make_mqttms(pipeline=True, metrics={"enabled": True})
+    # the commands to the silent server stay in flight until the end of the test, so as the
+    # last broadcast finds all its command ids taken
+    broadcasts = [session.broadcast({"command": "status"}, [silent[0], answering[0]], timeout=60) for _ in range(1001)]
+    assert all(broadcast.futures[answering[0]].result(10)["response"] == "OK" for broadcast in broadcasts)
+    rejected = broadcasts[-1].futures[silent[0]].result(5)
+    assert rejected["response"] == "TM"
+    assert rejected["cid"] is None
+    assert not any(broadcast.futures[silent[0]].done() for broadcast in broadcasts[:-1])
+    assert session.ms_protocol.cid_allocator.occupancy(silent[0]) == 1000
+    assert session.get_metrics()["counters"]["mqttms_commands_rejected_total"] == 1
+    # the command thread goes on
+    assert session.ms_protocol.put_command({"command": "status"}, server=answering[0]).result(5)["response"] == "OK"
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_async_broadcast(make_farm, make_config, pipeline):
+    _, servers = make_farm(3)
+
+    async def scenario():
+        async with AsyncMQTTms(make_config("async-master", pipeline=pipeline), {"verbose": 0}) as ams:
+            assert await ams.connect()
+            assert await ams.subscribe_all()
+            results = await ams.broadcast({"command": "status"}, servers)
+            streamed = [server async for server, _ in ams.broadcast_stream({"command": "status"}, servers)]
+        return results, streamed
+
+    results, streamed = asyncio.run(scenario())
+    assert sorted(results) == sorted(streamed) == sorted(servers)
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_payload_which_can_not_be_encoded_fails_the_broadcast_only(make_farm, make_mqttms, sniffer, pipeline):
+    _, servers = make_farm(2)
+    session = make_mqttms(pipeline=pipeline)
+    results = session.broadcast({"value": object()}, servers).result(5)
+    assert [(response["response"], response["cid"]) for response in results.values()] == [("BD", None), ("BD", None)]
+    assert not sniffer.recorded()
+    assert all(response["response"] == "OK" for response in session.broadcast({"command": "status"}, servers).result(5).values())
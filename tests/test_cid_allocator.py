@@ -0,0 +1,34 @@
+# test_cid_allocator.py
+
+import pytest
+
+from mqttms.cid_allocator import CidAllocator, CidExhaustedError
+
+def test_ids_follow_a_ring_and_skip_outstanding():
+    allocator = CidAllocator(0, 3)
+    assert [allocator.allocate("s") for _ in range(3)] == [0, 1, 2]
+    allocator.release(1, "s")
+    # a released id is reused as late as possible
+    assert allocator.allocate("s") == 3
+    assert allocator.allocate("s") == 1
+
+def test_ids_are_per_server():
+    allocator = CidAllocator(0, 1)
+    allocator.allocate("a")
+    allocator.allocate("a")
+    with pytest.raises(CidExhaustedError):
+        allocator.allocate("a")
+    # another server has its own ids
+    assert allocator.allocate("b") in (0, 1)
+    assert allocator.occupancy() == 3
+    assert allocator.occupancy("a") == 2
+
+def test_release_is_idempotent():
+    allocator = CidAllocator(0, 9)
+    cid = allocator.allocate("s")
+    assert allocator.is_outstanding(cid, "s")
+    allocator.release(cid, "s")
+    allocator.release(cid, "s")
+    allocator.release(5, "unknown")
+    assert not allocator.is_outstanding(cid, "s")
+    assert allocator.occupancy() == 0
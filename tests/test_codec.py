@@ -0,0 +1,79 @@
+# test_codec.py
+
+# The compiled codec extension must give the same results as the pure-Python codec.
+
+import importlib.util
+
+import pytest
+
+from mqttms import codec
+
+def load_pure_codec(monkeypatch):
+    # a separate copy of the module, loaded without the compiled functions
+    monkeypatch.setenv("MQTTMS_PURE_PYTHON", "1")
+    spec = importlib.util.spec_from_file_location("mqttms_pure_codec", codec.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert not module.COMPILED
+    return module
+
+@pytest.fixture
+def implementations(monkeypatch):
+    pure = load_pure_codec(monkeypatch)
+    try:
+        # pylint: disable=import-outside-toplevel
+        from mqttms.extensions.codec import codec as compiled
+    except ImportError:
+        pytest.skip("the codec extension is not built")
+    return pure, compiled
+
+TOPICS = ["@/4fdc0d1f-2421-4b5b-975b-9b4d0a08d712/RSP/ASCIIHEX", "@/s/USL/JSON", "@/s/CMD/JSON", "@/s/RSP/XML",
+          "@//RSP/JSON", "x/s/RSP/JSON", "@/s/RSP", "@/s", "@", "", "a/b/c/d/e", "@/s/RSP/JSON/"]
+
+@pytest.mark.parametrize("topic", TOPICS)
+def test_topic_functions(implementations, topic):
+    pure, compiled = implementations
+    assert compiled.topic_server(topic) == pure.topic_server(topic)
+    assert compiled.topic_format(topic) == pure.topic_format(topic)
+    assert compiled.parse_ms_topic(topic) == pure.parse_ms_topic(topic)
+
+@pytest.mark.parametrize("data", ["", "00", "0a1B", "DEADBEEF", b"00ff", bytearray(b"10")])
+def test_decode_asciihex_into(implementations, data):
+    pure, compiled = implementations
+    buffers = bytearray(8), bytearray(8)
+    assert compiled.decode_asciihex_into(data, buffers[0]) == pure.decode_asciihex_into(data, buffers[1])
+    assert buffers[0] == buffers[1]
+
+@pytest.mark.parametrize("data", ["", "QUJD", "QUI=", "QQ==", b"QUJD"])
+def test_decode_base64_into(implementations, data):
+    pure, compiled = implementations
+    buffers = bytearray(8), bytearray(8)
+    assert compiled.decode_base64_into(data, buffers[0]) == pure.decode_base64_into(data, buffers[1])
+    assert buffers[0] == buffers[1]
+
+@pytest.mark.parametrize("function", ["decode_asciihex_into", "decode_base64_into"])
+def test_too_small_buffer(implementations, function):
+    for implementation in implementations:
+        with pytest.raises(ValueError):
+            getattr(implementation, function)("00112233" if "hex" in function else "QUJDREVG", bytearray(2))
+
+PAYLOADS = [
+    '{"cid": 12, "server": "s", "response": "OK", "data": "00"}',
+    '{"response":"TM","cid":999,"server":"s"}',
+    '{"cid": "12", "server": 5}',
+    '{"cid": 1.5}',
+    '{"data": {"cid": 3}, "cid": 4}',
+    '{"server": "s\\u00e9", "cid": 1}',
+    '{}',
+    '[]',
+    'not json',
+    b'{"cid": 7, "server": "s", "response": "BD"}',
+]
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_response_envelope(implementations, payload):
+    pure, compiled = implementations
+    result = compiled.response_envelope(payload)
+    # the compiled codec may give up (None) where a full parse is needed, otherwise it agrees
+    if result is not None:
+        assert result == pure.response_envelope(payload)
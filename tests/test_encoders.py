@@ -0,0 +1,26 @@
+# test_encoders.py
+
+import json
+
+import pytest
+
+from mqttms.encoders import ENCODERS, get_encoder
+
+@pytest.fixture(params=list(ENCODERS))
+def encoder(request):
+    try:
+        return ENCODERS[request.param]()
+    except ImportError:
+        pytest.skip(f"{request.param} is not installed")
+
+def test_encoders_agree_with_json(encoder):
+    payload = {"command": "write", "data": [1, 2.5, None, True], "text": "é\"", 7: "int key", 2.5: "float key"}
+    assert json.loads(encoder(payload)) == json.loads(json.dumps(payload))
+
+def test_payload_which_can_not_be_encoded_raises(encoder):
+    with pytest.raises(Exception):
+        encoder({"value": object()})
+
+def test_unknown_encoder_is_refused():
+    with pytest.raises(ValueError):
+        get_encoder("yaml")
@@ -0,0 +1,78 @@
+# test_metrics.py
+
+import time
+
+from mqttms.metrics import MetricsRegistry
+
+def test_snapshot_without_baseline_changes_nothing():
+    registry = MetricsRegistry()
+    counter = registry.counter("events")
+    counter.inc(10)
+    first = registry.snapshot()
+    second = registry.snapshot()
+    assert first["counters"]["mqttms_events"] == second["counters"]["mqttms_events"] == 10
+    # rates since the creation of the registry, not reset by the first snapshot
+    assert second["rates"]["mqttms_events"] > 0
+
+def test_consumers_keep_their_own_rate_baselines():
+    registry = MetricsRegistry()
+    counter = registry.counter("events")
+    first, second = {}, {}
+    registry.snapshot(first)
+    registry.snapshot(second)
+    counter.inc(5)
+    time.sleep(0.05)
+    assert registry.snapshot(first)["counters"]["mqttms_events"] == 5
+    # neither another consumer nor a plain snapshot resets the baseline of 'second'
+    registry.snapshot()
+    counter.inc(5)
+    rates = registry.snapshot(second)["rates"]["mqttms_events"]
+    assert rates > 0
+    assert second["counters"]["mqttms_events"] == 10
+    assert registry.snapshot(first)["rates"]["mqttms_events"] > 0
+
+def test_periodic_snapshots_are_not_disturbed_by_direct_snapshots():
+    registry = MetricsRegistry()
+    counter = registry.counter("events")
+    rates = []
+    registry.start_snapshots(lambda snapshot: rates.append(snapshot["rates"]["mqttms_events"]), 0.1)
+    try:
+        deadline = time.monotonic() + 0.35
+        while time.monotonic() < deadline:
+            counter.inc()
+            registry.snapshot()
+            time.sleep(0.001)
+    finally:
+        registry.stop()
+    assert len(rates) >= 2
+    assert all(rate > 0 for rate in rates)
+
+def test_gauges_and_histograms():
+    registry = MetricsRegistry()
+    depth = [3]
+    registry.gauge("depth", "", lambda: depth[0])
+    histogram = registry.histogram("latency", "", (0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(value)
+    snapshot = registry.snapshot()
+    assert snapshot["gauges"]["mqttms_depth"] == 3
+    latency = snapshot["histograms"]["mqttms_latency"]
+    assert latency["count"] == 4
+    assert latency["buckets"] == {"0.1": 2, "1.0": 1, "+Inf": 1}
+    assert 0.0 < latency["p50"] <= 0.1
+    text = registry.prometheus_text()
+    assert 'mqttms_latency_bucket{le="+Inf"} 4' in text
+    assert "mqttms_depth 3" in text
+
+def test_metrics_are_off_by_default(make_farm, make_mqttms):
+    _, servers = make_farm(1)
+    session = make_mqttms()
+    assert session.ms_protocol.put_command({"command": "status"}, server=servers[0]).result(5)["response"] == "OK"
+    assert session.metrics is None
+    assert session.get_metrics() == {}
+    assert session.metrics_text() == ""
+
+def test_unsolicited_worker_queue_depths_are_gauges(make_mqttms):
+    session = make_mqttms(unsolicited_workers=3, metrics={"enabled": True})
+    gauges = session.get_metrics()["gauges"]
+    assert [gauges[f"mqttms_queue_depth_unsolicited_worker_{index}"] for index in range(3)] == [0, 0, 0]
@@ -0,0 +1,90 @@
+# test_mqtt_handler.py
+
+# Tracking of published messages by mid: on_publish() may come before the publishing thread
+# has registered the mid, after the message was failed by a lost connection, or never.
+
+from concurrent.futures import Future
+
+import pytest
+
+from mqttms.loopback import LoopbackMessageInfo
+from mqttms.mqtt_handler import MQTTHandler
+
+class ManualClient:
+    """
+    Client whose acknowledgments are sent by the test, with a chosen mid for every publish.
+    """
+
+    def __init__(self, handler: MQTTHandler):
+        self.handler = handler
+        self.mid = 1
+        self.ack_during_publish = False
+
+    def publish(self, topic, payload=None, qos=0, **kwargs):
+        if self.ack_during_publish:
+            self.handler.on_publish(self, None, self.mid, 0)
+        return LoopbackMessageInfo(0, self.mid)
+
+@pytest.fixture
+def handler(broker_name):
+    config = {"mqttms": {"mqtt": {"host": "localhost", "port": 1883, "username": "", "password": "", "client_id": "handler",
+                                  "timeout": 1.0, "transport": "loopback", "loopback": {"broker": broker_name}},
+                         "ms": {"client_uuid": "c", "server_uuid": "_", "cmd_topic": "@/server_uuid/CMD/format", "timeout": 1.0}}}
+    created = MQTTHandler(config)
+    created.client = ManualClient(created)
+    created.connection_established.set()
+    yield created
+    created.exit_threads()
+
+def send(handler: MQTTHandler, qos: int = 1) -> Future:
+    future: Future = Future()
+    handler.inflight_slots.acquire()
+    handler.send_publish("t", "payload", qos, future)
+    return future
+
+def acknowledge(handler: MQTTHandler, mid: int, reason_code: int = 0) -> None:
+    handler.on_publish(handler.client, None, mid, reason_code)
+
+def test_acknowledgment_completes_the_message(handler):
+    future = send(handler)
+    assert not future.done()
+    acknowledge(handler, 1)
+    assert future.result(0) is True
+
+def test_acknowledgment_during_publish(handler):
+    handler.client.ack_during_publish = True
+    assert send(handler).result(0) is True
+    assert not handler.early_publishes
+
+def test_late_acknowledgment_of_a_failed_message_is_dropped(handler):
+    failed = send(handler)
+    assert handler.fail_pending_publishes() == 1
+    assert failed.result(0) is False
+    acknowledge(handler, 1)
+    assert not handler.early_publishes
+    # the same mid used again waits for its own acknowledgment
+    reused = send(handler)
+    assert not reused.done()
+    acknowledge(handler, 1)
+    assert reused.result(0) is True
+
+def test_stale_early_acknowledgment_does_not_complete_a_new_message(handler):
+    acknowledge(handler, 7)
+    handler.client.mid = 7
+    future = send(handler)
+    assert not future.done()
+    acknowledge(handler, 7, reason_code=0)
+    assert future.result(0) is True
+
+def test_failing_pending_messages_clears_stale_early_acknowledgments(handler):
+    acknowledge(handler, 9)
+    assert 9 in handler.early_publishes
+    handler.fail_pending_publishes()
+    assert not handler.early_publishes
+
+def test_failed_publish_releases_the_window(handler):
+    slots = handler.inflight_slots._value
+    future = send(handler)
+    acknowledge(handler, 1, reason_code=0x80)
+    assert future.result(0) is False
+    assert handler.inflight_slots._value == slots
@@ -0,0 +1,174 @@
+# test_ms_protocol.py
+
+# MS protocol commands end to end: MQTTms -> loopback broker -> simulated MS servers -> MQTTms,
+# in sequential and pipelined mode.
+
+import threading
+import time
+
+import pytest
+
+MODES = [pytest.param(False, id="sequential"), pytest.param(True, id="pipelined")]
+
+def wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_command_gets_its_response(make_farm, make_mqttms, pipeline):
+    _, servers = make_farm(1)
+    session = make_mqttms(pipeline=pipeline)
+    response = session.ms_protocol.put_command({"command": "status"}, server=servers[0]).result(5)
+    assert response["response"] == "OK"
+    assert response["server"] == servers[0]
+    assert response["dataType"] == "asciihex"
+
+def test_pipelined_responses_are_matched_by_cid(make_farm, make_mqttms, sniffer):
+    # random latencies, so as the responses arrive out of order
+    _, servers = make_farm(3, {"latency": {"distribution": "uniform", "low": 0.0, "high": 0.05}})
+    session = make_mqttms(pipeline=True, window=32)
+    futures = [session.ms_protocol.put_command({"command": "read", "index": index}, server=servers[index % 3]) for index in range(60)]
+    responses = [future.result(5) for future in futures]
+    sent = {command["index"]: command for command in sniffer.recorded()}
+    for index, response in enumerate(responses):
+        assert response["response"] == "OK"
+        assert response["server"] == servers[index % 3] == sent[index]["server"]
+        assert response["cid"] == sent[index]["cid"]
+
+def test_pipelined_window_limits_commands_in_flight(make_farm, make_mqttms):
+    _, servers = make_farm(4, {"latency": 0.05})
+    session = make_mqttms(pipeline=True, window=4)
+    in_flight = []
+    stop = threading.Event()
+
+    def sample() -> None:
+        while not stop.is_set():
+            in_flight.append(session.ms_protocol.cid_allocator.occupancy())
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        futures = [session.ms_protocol.put_command({"command": "read"}, server=servers[index % 4]) for index in range(24)]
+        assert all(future.result(5)["response"] == "OK" for future in futures)
+    finally:
+        stop.set()
+        sampler.join()
+    assert max(in_flight) <= 4
+    assert max(in_flight) >= 2
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_silent_server_times_out(make_farm, make_mqttms, pipeline):
+    _, servers = make_farm(1, {"drop": 1.0})
+    _, answering = make_farm(1)
+    session = make_mqttms(pipeline=pipeline)
+    started = time.monotonic()
+    response = session.ms_protocol.put_command({"command": "status"}, server=servers[0], timeout=0.2).result(5)
+    assert response["response"] == "TM"
+    assert response["cid"] is not None
+    assert 0.15 <= time.monotonic() - started < 1.5
+    # the cid of the timed out command is free again and the session goes on
+    assert session.ms_protocol.cid_allocator.occupancy() == 0
+    assert session.ms_protocol.put_command({"command": "status"}, server=answering[0]).result(5)["response"] == "OK"
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_bad_response_is_bd(make_farm, make_mqttms, pipeline):
+    _, servers = make_farm(1, {"malformed": 1.0})
+    session = make_mqttms(pipeline=pipeline)
+    response = session.ms_protocol.put_command({"command": "status"}, server=servers[0]).result(5)
+    assert response["response"] == "BD"
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_commands_are_sent_by_priority_then_deadline(make_farm, make_mqttms, sniffer, pipeline):
+    _, slow = make_farm(1, {"latency": 0.3})
+    _, fast = make_farm(1)
+    session = make_mqttms(pipeline=pipeline, window=1)
+    protocol = session.ms_protocol
+    # the command thread is busy with this command while the others are queued
+    blocker = protocol.put_command({"name": "blocker"}, server=slow[0])
+    assert wait_for(lambda: sniffer.recorded(lambda command: command.get("name") == "blocker"))
+    now = time.monotonic()
+    futures = [
+        protocol.put_command({"name": "low"}, server=fast[0]),
+        protocol.put_command({"name": "late"}, server=fast[0], priority=5, deadline=now + 10),
+        protocol.put_command({"name": "high"}, server=fast[0], priority=5),
+        protocol.put_command({"name": "soon"}, server=fast[0], priority=5, deadline=now + 5),
+        protocol.put_command({"name": "middle"}, server=fast[0], priority=2),
+    ]
+    assert blocker.result(5)["response"] == "OK"
+    assert all(future.result(5)["response"] == "OK" for future in futures)
+    order = [command["name"] for command in sniffer.recorded() if command["name"] != "blocker"]
+    # without a deadline last among equal priorities
+    assert order == ["soon", "late", "high", "middle", "low"]
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_queued_command_expires_at_its_deadline_without_sending(make_farm, make_mqttms, sniffer, pipeline):
+    _, slow = make_farm(1, {"latency": 0.3})
+    _, fast = make_farm(1)
+    session = make_mqttms(pipeline=pipeline, window=1, metrics={"enabled": True})
+    protocol = session.ms_protocol
+    protocol.put_command({"name": "blocker"}, server=slow[0])
+    assert wait_for(lambda: sniffer.recorded(lambda command: command.get("name") == "blocker"))
+    response = protocol.put_command({"name": "expiring"}, server=fast[0], deadline=time.monotonic() + 0.05).result(5)
+    assert response["response"] == "TM"
+    assert response["cid"] is None
+    assert protocol.put_command({"name": "next"}, server=fast[0]).result(5)["response"] == "OK"
+    assert not sniffer.recorded(lambda command: command["name"] == "expiring")
+    assert session.get_metrics()["counters"]["mqttms_commands_expired_total"] == 1
+
+def test_full_command_queue_cancels_dropped_commands(make_farm, make_mqttms, sniffer):
+    _, slow = make_farm(1, {"latency": 0.2})
+    session = make_mqttms(queues={"cmd": {"maxsize": 2, "policy": "drop_oldest"}})
+    protocol = session.ms_protocol
+    protocol.put_command({"name": "blocker"}, server=slow[0])
+    assert wait_for(lambda: sniffer.recorded(lambda command: command.get("name") == "blocker"))
+    low = protocol.put_command({"name": "low"}, server=slow[0])
+    high = protocol.put_command({"name": "high"}, server=slow[0], priority=1)
+    urgent = protocol.put_command({"name": "urgent"}, server=slow[0], priority=2)
+    # drop_oldest drops the least urgent command
+    assert low.cancelled()
+    assert high.result(5)["response"] == urgent.result(5)["response"] == "OK"
+
+@pytest.mark.parametrize("pipeline", MODES)
+@pytest.mark.parametrize("policy", ["keep", "expire", "replay"])
+def test_commands_in_flight_when_the_connection_is_lost(make_farm, make_mqttms, sniffer, pipeline, policy):
+    _, servers = make_farm(1, {"drop": 1.0})
+    session = make_mqttms(pipeline=pipeline, inflight_on_disconnect=policy, timeout=1.5)
+    sent_at = time.monotonic()
+    future = session.ms_protocol.put_command({"name": "lost"}, server=servers[0])
+    assert wait_for(lambda: sniffer.recorded())
+    session.mqtt_handler.client.connection_lost()
+
+    response = future.result(5)
+    elapsed = time.monotonic() - sent_at
+    assert response["response"] == "TM"
+    sent = sniffer.recorded()
+    if policy == "expire":
+        assert elapsed < 1.0
+        assert len(sent) == 1
+    else:
+        assert elapsed >= 1.4
+    if policy == "replay":
+        # published again after reconnecting, with the same cid
+        assert len(sent) == 2
+        assert sent[0]["cid"] == sent[1]["cid"]
+    if policy == "keep":
+        assert len(sent) == 1
+
+@pytest.mark.parametrize("pipeline", MODES)
+def test_payload_which_can_not_be_encoded_fails_only_its_command(make_farm, make_mqttms, sniffer, pipeline):
+    _, servers = make_farm(1)
+    session = make_mqttms(pipeline=pipeline, window=1)
+    protocol = session.ms_protocol
+    response = protocol.put_command({"name": "bad", "value": object()}, server=servers[0]).result(5)
+    assert response["response"] == "BD"
+    assert response["cid"] is None
+    assert protocol.cid_allocator.occupancy() == 0
+    # int keys are written as strings by every encoder
+    assert protocol.put_command({"name": "next", 1: "one"}, server=servers[0]).result(5)["response"] == "OK"
+    assert wait_for(lambda: sniffer.recorded())
+    assert [(command["name"], command["1"]) for command in sniffer.recorded()] == [("next", "one")]
@@ -0,0 +1,48 @@
+# test_topic_router.py
+
+import itertools
+
+import pytest
+from paho.mqtt.client import topic_matches_sub
+
+from mqttms.topic_router import TopicRouter
+
+FILTERS = ["#", "+", "a", "a/#", "a/+", "a/b", "a/+/c", "+/b/#", "+/+", "a/b/c/#", "$SYS/#", "+/x", "a//c", "a/+/+"]
+TOPICS = ["a", "b", "a/b", "a/x", "a/b/c", "a/b/c/d", "x/b/c", "a//c", "$SYS/broker", "/a", "a/", "q/x"]
+
+def test_matches_like_mqtt():
+    router = TopicRouter()
+    for topic_filter in FILTERS:
+        router.add_route(topic_filter, topic_filter)
+    for topic in TOPICS:
+        expected = sorted(topic_filter for topic_filter in FILTERS if topic_matches_sub(topic_filter, topic))
+        assert sorted(router.match(topic)) == expected, topic
+
+def test_handlers_of_one_filter_keep_their_order():
+    router = TopicRouter()
+    router.add_route("a/+", "first")
+    router.add_route("a/+", "second")
+    assert router.match("a/b") == ["first", "second"]
+
+def test_remove_route():
+    router = TopicRouter()
+    for topic_filter, handler in itertools.product(["a/+", "a/#"], ["h1", "h2"]):
+        router.add_route(topic_filter, handler)
+    assert router.remove_route("a/+", "h1")
+    assert router.remove_route("a/#", "h2")
+    assert not router.remove_route("a/+", "h1")
+    assert not router.remove_route("b/c", "h1")
+    assert sorted(router.match("a/b")) == ["h1", "h2"]
+
+def test_dispatch():
+    router = TopicRouter()
+    received = []
+    router.add_route("a/+", received.append)
+    assert router.dispatch(("a/b", "payload"))
+    assert not router.dispatch(("b/c", "payload"))
+    assert received == [("a/b", "payload")]
+
+@pytest.mark.parametrize("topic_filter", ["a/#/b", "a/b+", "a#", "a/+b/c"])
+def test_invalid_filters_are_refused(topic_filter):
+    with pytest.raises(ValueError):
+        TopicRouter().add_route(topic_filter, "handler")
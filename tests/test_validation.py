@@ -0,0 +1,74 @@
+# test_validation.py
+
+# The fast response validator must agree with jsonschema: it never accepts what jsonschema
+# rejects, and the 'fast' validation mode of MSProtocol, which confirms rejections by jsonschema,
+# gives the same results as 'full'.
+
+import copy
+
+import pytest
+from jsonschema import Draft202012Validator
+
+from mqttms.fast_validator import is_valid_response
+from mqttms.ms_protocol import MSProtocol
+
+SERVER = "4fdc0d1f-2421-4b5b-975b-9b4d0a08d712"
+
+def response(**fields):
+    return {"cid": 12, "server": SERVER, "response": "OK", "dataType": "asciihex", "data": "0A1b", **fields}
+
+RESPONSES = [
+    response(),
+    response(cid=0),
+    response(cid=999),
+    response(cid=1000),
+    response(cid=-1),
+    response(cid=12.0),
+    response(cid="12"),
+    response(cid=True),
+    response(server="not-a-uuid"),
+    response(server=SERVER.upper()),
+    response(response="TM"),
+    response(response="ok"),
+    response(response="OKK"),
+    response(data="0G"),
+    response(data=""),
+    response(dataType="ascii", data="any text ~"),
+    response(dataType="ascii", data="tab\t"),
+    response(dataType="base64", data="QUJD"),
+    response(dataType="base64", data="QUI="),
+    response(dataType="base64", data="QUI"),
+    response(dataType="object", data={"a": 1}),
+    response(dataType="object", data="text"),
+    response(dataType="binary"),
+    {key: value for key, value in response().items() if key != "data"},
+    {**response(), "extra": 1},
+    [],
+    "text",
+    None,
+]
+
+@pytest.fixture(scope="module")
+def protocols():
+    created = {}
+    for validation in ("full", "fast"):
+        created[validation] = MSProtocol({
+            "mqttms": {
+                "mqtt": {"host": "localhost", "port": 1883, "username": "", "password": "", "client_id": "validation", "timeout": 1.0},
+                "ms": {"client_uuid": "c", "server_uuid": SERVER, "cmd_topic": "@/server_uuid/CMD/format", "timeout": 1.0, "validation": validation}
+            },
+            "logging": {"verbose": 0}
+        })
+    yield created
+    for protocol in created.values():
+        protocol.graceful_exit()
+
+@pytest.mark.parametrize("data", RESPONSES)
+def test_fast_response_validator_accepts_only_valid_responses(protocols, data):
+    schema_valid = Draft202012Validator(protocols["full"].response_schema).is_valid(data)
+    if is_valid_response(data):
+        assert schema_valid
+
+@pytest.mark.parametrize("data", RESPONSES)
+def test_fast_validation_mode_agrees_with_full(protocols, data):
+    assert protocols["fast"].validate_json(copy.deepcopy(data)) == protocols["full"].validate_json(copy.deepcopy(data))